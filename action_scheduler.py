@@ -0,0 +1,424 @@
+"""
+Outbound action scheduling module
+Rate-limited, prioritized and coalesced Telegram API calls
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+from config import Config
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+PRIORITY_DELETE = 0
+PRIORITY_BAN = 1
+PRIORITY_REPLY = 2
+
+MAX_DELETE_BATCH = 100  # delete_messages limit
+MAX_MESSAGE_LENGTH = 4096
+
+API_CALL_SECONDS = REGISTRY.histogram(
+    'moderator_api_call_seconds', "Telegram API call latency by action", ['action']
+)
+
+
+class SchedulerStopped(RuntimeError):
+    """The scheduler stopped before the action could be sent"""
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` stored"""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class _ChatQueue:
+    """Pending actions of one chat, already coalesced"""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.blocked_until = 0.0
+        self.in_flight = False
+        self.last_served = 0.0
+        # message_id -> [future, attempts]
+        self.deletes: Dict[int, List[Any]] = {}
+        # user_id -> [future, attempts, kwargs, 'ban' or 'unban']
+        self.bans: Dict[int, List[Any]] = {}
+        # coalesce key -> [texts, future, attempts, kwargs]
+        self.replies: Dict[Any, List[Any]] = {}
+
+    def priority(self) -> Optional[int]:
+        if self.deletes:
+            return PRIORITY_DELETE
+        if self.bans:
+            return PRIORITY_BAN
+        if self.replies:
+            return PRIORITY_REPLY
+        return None
+
+    def pop(self) -> Tuple[str, Any]:
+        """Take the next request: a delete batch, one ban/unban or one (merged) reply"""
+        if self.deletes:
+            ids = list(self.deletes)[:MAX_DELETE_BATCH]
+            return 'delete', {message_id: self.deletes.pop(message_id) for message_id in ids}
+        if self.bans:
+            user_id = next(iter(self.bans))
+            entry = self.bans.pop(user_id)
+            return entry[3], (user_id, entry)
+        key = next(iter(self.replies))
+        return 'reply', (key, self.replies.pop(key))
+
+
+class ActionScheduler:
+    """
+    Sends moderation actions through per-chat token buckets and a global budget.
+
+    Deletes go first, then bans and unbans, then informational replies. While
+    a chat is waiting for budget its actions coalesce: deletes merge into one
+    delete_messages call (up to 100 ids), repeated bans of the same user
+    share one call (a later unban replaces a pending ban and vice versa), and
+    replies submitted with the same `coalesce` key merge
+    into a single summary message. A 429 blocks the chat for `retry_after`
+    seconds and puts the action back; other API errors are logged and
+    delivered to whoever awaits the returned future.
+    """
+
+    def __init__(self, global_rate: float = Config.API_GLOBAL_PER_SECOND,
+                 chat_per_minute: float = Config.API_CHAT_PER_MINUTE,
+                 max_in_flight: int = Config.API_MAX_IN_FLIGHT,
+                 max_retries: int = 5, clock: Callable[[], float] = time.monotonic):
+        self.bot = None
+        self.clock = clock
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock)
+        self.chat_rate = chat_per_minute / 60
+        self.chat_burst = chat_per_minute
+        self.max_retries = max_retries
+        self._chats: Dict[int, _ChatQueue] = {}
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sending = set()
+
+        # Metrics
+        self.calls = {'delete': 0, 'ban': 0, 'unban': 0, 'reply': 0}
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def start(self, bot):
+        """Start dispatching through `bot` (telegram.Bot or a stand-in)"""
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        """Give pending actions `timeout` seconds to go out, then stop"""
+        deadline = self.clock() + timeout
+        while (self.pending() or self._sending) and self.clock() < deadline:
+            await asyncio.sleep(0.05)
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+        for queue in self._chats.values():
+            while queue.priority() is not None:
+                kind, items = queue.pop()
+                for future in self._futures(kind, items):
+                    self._fail(future, SchedulerStopped("Action scheduler stopped"))
+        self._chats.clear()
+
+    def _queue(self, chat_id: int) -> _ChatQueue:
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = _ChatQueue(
+                TokenBucket(self.chat_rate, self.chat_burst, self.clock)
+            )
+        return queue
+
+    def delete(self, chat_id: int, message_id: int) -> asyncio.Future:
+        """Delete a message"""
+        queue = self._queue(chat_id)
+        entry = queue.deletes.get(message_id)
+        if entry is None:
+            entry = queue.deletes[message_id] = [asyncio.get_running_loop().create_future(), 0]
+        else:
+            self.coalesced += 1
+        self._wakeup.set()
+        return entry[0]
+
+    def ban(self, chat_id: int, user_id: int, **kwargs) -> asyncio.Future:
+        """Ban a chat member (ban_chat_member keyword arguments pass through)"""
+        return self._member(chat_id, user_id, 'ban', kwargs)
+
+    def unban(self, chat_id: int, user_id: int, **kwargs) -> asyncio.Future:
+        """Unban a chat member (unban_chat_member keyword arguments pass through)"""
+        return self._member(chat_id, user_id, 'unban', kwargs)
+
+    def _member(self, chat_id: int, user_id: int, kind: str, kwargs) -> asyncio.Future:
+        queue = self._queue(chat_id)
+        entry = queue.bans.get(user_id)
+        if entry is not None and entry[3] == kind:
+            # Same action still waiting: send it once, with the latest arguments
+            entry[2] = kwargs
+            self.coalesced += 1
+        else:
+            if entry is not None:
+                # Opposite action still waiting: only the latest request matters
+                self._supersede(entry[0])
+            entry = queue.bans[user_id] = [asyncio.get_running_loop().create_future(), 0, kwargs, kind]
+        self._wakeup.set()
+        return entry[0]
+
+    def reply(self, chat_id: int, text: str, coalesce: Optional[str] = None,
+              **kwargs) -> asyncio.Future:
+        """
+        Send a message to the chat
+
+        Replies sharing a `coalesce` key that are still waiting are merged,
+        one per line, into a single message.
+        """
+        queue = self._queue(chat_id)
+        key = coalesce if coalesce is not None else object()
+        entry = queue.replies.get(key)
+        if entry is None:
+            entry = queue.replies[key] = [[text], asyncio.get_running_loop().create_future(), 0, kwargs]
+        else:
+            if text not in entry[0]:
+                entry[0].append(text)
+            self.coalesced += 1
+        self._wakeup.set()
+        return entry[1]
+
+    def pending(self) -> int:
+        """Actions waiting to be sent (after coalescing)"""
+        return sum(len(q.deletes) + len(q.bans) + len(q.replies) for q in self._chats.values())
+
+    def _next_ready(self) -> Tuple[Optional[int], Optional[float]]:
+        """The chat to serve now, or how long until one is ready"""
+        now = self.clock()
+        best, best_rank, wait = None, None, None
+        for chat_id, queue in list(self._chats.items()):
+            priority = queue.priority()
+            if priority is None:
+                # Forget idle chats once their bucket has refilled
+                if not queue.in_flight and queue.blocked_until <= now and queue.bucket.full():
+                    del self._chats[chat_id]
+                continue
+            if queue.in_flight:
+                continue
+
+            delay = max(queue.blocked_until - now, queue.bucket.delay())
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            rank = (priority, queue.last_served)
+            if best_rank is None or rank < best_rank:
+                best, best_rank = chat_id, rank
+
+        if best is not None:
+            global_delay = self.global_bucket.delay()
+            if global_delay > 0:
+                return None, global_delay
+        return best, wait
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            chat_id, wait = self._next_ready()
+            if chat_id is None:
+                self._slots.release()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            queue = self._chats[chat_id]
+            queue.in_flight = True
+            queue.last_served = self.clock()
+            self.global_bucket.take()
+            queue.bucket.take()
+            task = asyncio.create_task(self._send(chat_id, queue, *queue.pop()))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    @staticmethod
+    def _futures(kind: str, items) -> List[asyncio.Future]:
+        if kind == 'delete':
+            return [future for future, _ in items.values()]
+        if kind in ('ban', 'unban'):
+            return [items[1][0]]
+        return [items[1][1]]
+
+    @staticmethod
+    def _supersede(future: asyncio.Future):
+        """Resolve a ban/unban that a later opposite request replaced"""
+        if not future.done():
+            future.set_result(None)
+
+    @staticmethod
+    def _fail(future: asyncio.Future, error: BaseException):
+        if not future.done():
+            future.set_exception(error)
+            # The scheduler logs failures itself; fire-and-forget callers are fine
+            future.exception()
+
+    async def _call(self, chat_id: int, kind: str, items):
+        if kind == 'delete':
+            ids = list(items)
+            if len(ids) == 1:
+                return await self.bot.delete_message(chat_id, ids[0])
+            return await self.bot.delete_messages(chat_id, ids)
+        if kind == 'ban':
+            user_id, (_, _, kwargs, _) = items
+            return await self.bot.ban_chat_member(chat_id, user_id, **kwargs)
+        if kind == 'unban':
+            user_id, (_, _, kwargs, _) = items
+            return await self.bot.unban_chat_member(chat_id, user_id, **kwargs)
+
+        _, (texts, _, _, kwargs) = items
+        return await self.bot.send_message(chat_id, self._summary(texts), **kwargs)
+
+    @staticmethod
+    def _summary(texts: List[str]) -> str:
+        """Join merged replies, keeping under Telegram's message length"""
+        text = texts[0]
+        for i, line in enumerate(texts[1:], start=1):
+            more = f"\n…and {len(texts) - i} more"
+            if len(text) + 1 + len(line) + len(more) > MAX_MESSAGE_LENGTH:
+                return text + more
+            text += "\n" + line
+        return text
+
+    def _requeue(self, queue: _ChatQueue, kind: str, items) -> List[asyncio.Future]:
+        """Put an action back for another attempt; return futures out of retries"""
+        # (pending dict, key, entry, index of the entry's attempt counter)
+        if kind == 'delete':
+            entries = [(queue.deletes, message_id, entry, 1) for message_id, entry in items.items()]
+        elif kind in ('ban', 'unban'):
+            entries = [(queue.bans, items[0], items[1], 1)]
+        else:
+            entries = [(queue.replies, items[0], items[1], 2)]
+
+        exhausted = []
+        for pending, key, entry, attempts in entries:
+            # The future always sits just before the attempt counter
+            future = entry[attempts - 1]
+            entry[attempts] += 1
+            if entry[attempts] > self.max_retries:
+                exhausted.append(future)
+                continue
+            newer = pending.get(key)
+            if newer is not None and kind in ('ban', 'unban') and newer[3] != kind:
+                # Banned again or unbanned meanwhile; the newer request wins
+                self._supersede(future)
+                continue
+            if newer is not None:
+                # The same action was requested again meanwhile; one call serves both
+                if kind == 'reply':
+                    entry[0].extend(text for text in newer[0] if text not in entry[0])
+                self._chain(newer[attempts - 1], future)
+            pending[key] = entry
+        return exhausted
+
+    @staticmethod
+    def _chain(follower: asyncio.Future, leader: asyncio.Future):
+        """Resolve `follower` with `leader`'s outcome"""
+        def copy(done: asyncio.Future):
+            if follower.done():
+                return
+            if done.exception() is not None:
+                follower.set_exception(done.exception())
+                follower.exception()
+            else:
+                follower.set_result(done.result())
+        leader.add_done_callback(copy)
+
+    async def _send(self, chat_id: int, queue: _ChatQueue, kind: str, items):
+        try:
+            with API_CALL_SECONDS.time(kind):
+                result = await self._call(chat_id, kind, items)
+            self.calls[kind] += 1
+            for future in self._futures(kind, items):
+                if not future.done():
+                    future.set_result(result)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            seconds = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else retry_after
+            queue.blocked_until = self.clock() + seconds
+            self.rate_limited += 1
+            logger.warning(f"Rate limited in chat {chat_id}, retrying {kind} in {seconds}s")
+            for future in self._requeue(queue, kind, items):
+                self.failed += 1
+                self._fail(future, e)
+        except BadRequest as e:
+            # Deleted already, user not a member, ...: retrying won't help
+            self.failed += 1
+            logger.warning(f"{kind.capitalize()} in chat {chat_id} rejected: {str(e)}")
+            for future in self._futures(kind, items):
+                self._fail(future, e)
+        except NetworkError as e:
+            # Includes TimedOut; back off briefly and try again
+            queue.blocked_until = self.clock() + 1.0
+            logger.warning(f"Network error sending {kind} to chat {chat_id}: {str(e)}")
+            for future in self._requeue(queue, kind, items):
+                self.failed += 1
+                self._fail(future, e)
+        except TelegramError as e:
+            self.failed += 1
+            logger.warning(f"{kind.capitalize()} in chat {chat_id} failed: {str(e)}")
+            for future in self._futures(kind, items):
+                self._fail(future, e)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"{kind.capitalize()} in chat {chat_id} failed: {str(e)}", exc_info=True)
+            for future in self._futures(kind, items):
+                self._fail(future, e)
+        finally:
+            queue.in_flight = False
+            self._slots.release()
+            self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': self.pending(),
+            'chats': len(self._chats),
+            'calls': dict(self.calls),
+            'coalesced': self.coalesced,
+            'rate_limited': self.rate_limited,
+            'failed': self.failed,
+        }
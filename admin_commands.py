@@ -1,31 +1,118 @@
 """
 Admin commands module for bot configuration
 """
+import logging
+from typing import FrozenSet, Optional
 from telegram import Update, ChatMember
+from telegram.constants import ChatType
 from telegram.ext import ContextTypes
-from database import Database
+from telegram.error import TelegramError
+from cache import TTLCache
+from shared_state import InProcessState, SharedState
+from storage import Storage
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+
 
 class AdminCommands:
     """Admin command handlers"""
     
-    def __init__(self, db: Database):
+    def __init__(self, db: Storage, state: Optional[SharedState] = None):
         self.db = db
+        # Admin lists per chat, and per-user admin status for chats without
+        # an administrator list (private chats)
+        self.state = state or InProcessState()
+        # Chats whose administrator list could not be loaded, so messages
+        # there don't each pay for another failing call
+        self.unlisted_chats = TTLCache(Config.ADMIN_CACHE_SIZE, Config.ADMIN_LIST_RETRY)
+    
+    async def warm_start(self):
+        """Seed the admin cache from the admins table"""
+        # The stored lists may be stale, so only trust them briefly
+        ttl = min(Config.ADMIN_CACHE_TTL, 60)
+        admins = await self.db.get_admins()
+        for chat_id, user_ids in admins.items():
+            # Lists other instances already loaded are fresher than ours
+            await self.state.set_admins(chat_id, frozenset(user_ids), ttl=ttl, replace=False)
+        logger.info(f"Admin cache warmed with {len(admins)} chat(s)")
+    
+    async def _load_chat_admins(self, chat_id: int,
+                                context: ContextTypes.DEFAULT_TYPE) -> Optional[FrozenSet[int]]:
+        """Fetch a chat's administrators in one call and cache them"""
+        try:
+            members = await context.bot.get_chat_administrators(chat_id)
+        except TelegramError:
+            self.unlisted_chats.set(chat_id, True)
+            return None
+        
+        admins = frozenset(member.user.id for member in members)
+        await self.state.set_admins(chat_id, admins)
+        await self.db.set_chat_admins(chat_id, admins)
+        return admins
     
-    async def is_admin(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
-        """Check if user is admin"""
+    async def is_admin(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                       admins: Optional[FrozenSet[int]] = None) -> bool:
+        """
+        Check if user is admin
+        
+        Args:
+            admins: The chat's admin set when the caller already has it
+                (SharedState.record_message returns it), saving a lookup
+        """
         if not update.effective_chat or not update.effective_user:
             return False
         
+        chat_id = update.effective_chat.id
+        user_id = update.effective_user.id
+        
+        if admins is None:
+            admins = await self.state.get_admins(chat_id)
+        # Private chats have no administrator list to load
+        if (admins is None and update.effective_chat.type != ChatType.PRIVATE
+                and self.unlisted_chats.get(chat_id) is None):
+            admins = await self._load_chat_admins(chat_id, context)
+        if admins is not None:
+            return user_id in admins
+        
+        # No administrator list for this chat, ask about the user directly
+        is_admin = await self.state.get_member_admin(chat_id, user_id)
+        if is_admin is not None:
+            return is_admin
+        
         try:
-            chat_member = await context.bot.get_chat_member(
-                update.effective_chat.id,
-                update.effective_user.id
-            )
-            return chat_member.status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]
+            chat_member = await context.bot.get_chat_member(chat_id, user_id)
+            is_admin = chat_member.status in ADMIN_STATUSES
         except:
             return False
+        
+        await self.state.set_member_admin(chat_id, user_id, is_admin)
+        return is_admin
+    
+    async def handle_chat_member_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Keep the admin cache in sync with promotions and demotions"""
+        member_update = update.chat_member or update.my_chat_member
+        if not member_update:
+            return
+        
+        chat_id = member_update.chat.id
+        user_id = member_update.new_chat_member.user.id
+        was_admin = member_update.old_chat_member.status in ADMIN_STATUSES
+        now_admin = member_update.new_chat_member.status in ADMIN_STATUSES
+        if was_admin == now_admin:
+            return
+        
+        await self.state.forget_member_admin(chat_id, user_id)
+        admins = await self.state.get_admins(chat_id)
+        if admins is None:
+            # Nothing cached, the next is_admin call reloads the full list
+            return
+        
+        admins = admins | {user_id} if now_admin else admins - {user_id}
+        await self.state.set_admins(chat_id, admins)
+        await self.db.set_chat_admins(chat_id, admins)
     
     async def set_warn_limit(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Set warning limit before ban"""
@@ -84,7 +171,7 @@ class AdminCommands:
             return
         
         config = await self.db.get_chat_config(update.effective_chat.id)
-        new_state = not config['enable_ai_moderation']
+        new_state = not config.enable_ai_moderation
         
         await self.db.set_chat_config(update.effective_chat.id, enable_ai_moderation=new_state)
         
@@ -136,24 +223,24 @@ class AdminCommands:
         
         config = await self.db.get_chat_config(update.effective_chat.id)
         
-        hours = config['ban_duration'] // 3600
-        minutes = (config['ban_duration'] % 3600) // 60
+        hours = config.ban_duration // 3600
+        minutes = (config.ban_duration % 3600) // 60
         time_str = f"{hours}h {minutes}m" if hours else f"{minutes}m"
         
-        ai_status = "✅ Enabled" if config['enable_ai_moderation'] else "❌ Disabled"
+        ai_status = "✅ Enabled" if config.enable_ai_moderation else "❌ Disabled"
         
         message = f"""
 ⚙️ **Chat Configuration**
 
 📊 **Moderation Settings:**
-• Warning Limit: {config['warn_limit']} warnings
+• Warning Limit: {config.warn_limit} warnings
 • Ban Duration: {time_str}
 • AI Moderation: {ai_status}
 
 🌊 **Flood Protection:**
-• Threshold: {config['flood_threshold']} messages
-• Time Window: {config['flood_time_window']} seconds
-• Auto-delete Spam: {'✅ Yes' if config['auto_delete_spam'] else '❌ No'}
+• Threshold: {config.flood_threshold} messages
+• Time Window: {config.flood_time_window} seconds
+• Auto-delete Spam: {'✅ Yes' if config.auto_delete_spam else '❌ No'}
 
 💡 **Tip:** Use /help to see all available commands
         """
@@ -181,8 +268,8 @@ class AdminCommands:
         """Show chat rules"""
         config = await self.db.get_chat_config(update.effective_chat.id)
         
-        if config['rules']:
-            await update.message.reply_text(f"📜 **Chat Rules:**\n\n{config['rules']}", parse_mode='Markdown')
+        if config.rules:
+            await update.message.reply_text(f"📜 **Chat Rules:**\n\n{config.rules}", parse_mode='Markdown')
         else:
             await update.message.reply_text("📜 No rules have been set yet. Admins can use /setrules to add them.")
     
@@ -216,13 +303,13 @@ class AdminCommands:
         stats = await self.db.get_user_stats(target_user, update.effective_chat.id)
         warnings = await self.db.get_warnings(target_user, update.effective_chat.id)
         
-        ban_status = "🚫 Banned" if stats['is_banned'] else "✅ Active"
+        ban_status = "🚫 Banned" if stats.is_banned else "✅ Active"
         
         message = f"""
 📊 **User Statistics**
 
 👤 User: @{target_username} (ID: {target_user})
-⚠️ Warnings: {stats['warnings']}
+⚠️ Warnings: {stats.warnings}
 🔒 Status: {ban_status}
 
 **Recent Warnings:**
@@ -230,7 +317,7 @@ class AdminCommands:
         
         if warnings:
             for i, warn in enumerate(warnings[:5], 1):
-                message += f"\n{i}. {warn['reason']} - {warn['timestamp']}"
+                message += f"\n{i}. {warn.reason} - {warn.timestamp}"
         else:
             message += "\nNo warnings"
         
@@ -2,19 +2,160 @@
 AI-powered content moderation module
 Uses free, local models for toxic content detection
 """
+import hashlib
 import re
-from typing import Dict, Tuple, Any
-from better_profanity import profanity
+import time
+from typing import Dict, Tuple, Any, List, Iterable, Optional, Callable
+from better_profanity import Profanity
 from textblob import TextBlob
+from config import Config
+from records import AnalysisResult
+
+
+class CompiledWordset:
+    """
+    Drop-in replacement for better_profanity's CENSOR_WORDSET list.
+    
+    The library tests every word against each VaryingString in turn; here all
+    variants are folded into one regex so membership is a single fullmatch.
+    """
+    
+    def __init__(self, wordset: list):
+        self.words = list(wordset)
+        alternatives = []
+        for word in self.words:
+            alternatives.append(''.join(
+                '(?:' + '|'.join(re.escape(char) for char in chars) + ')'
+                for chars in word._char_combos
+            ))
+        self._regex = re.compile('|'.join(alternatives)) if alternatives else None
+        self.min_length = min((word._min_len for word in self.words), default=0)
+    
+    def __len__(self) -> int:
+        return len(self.words)
+    
+    def __iter__(self):
+        return iter(self.words)
+    
+    def __contains__(self, text) -> bool:
+        return (isinstance(text, str) and self._regex is not None
+                and self._regex.fullmatch(text) is not None)
+
+
+class AnalysisContext:
+    """Partial verdict handed from one analysis stage to the next"""
+    
+    __slots__ = ('text', 'text_lower', 'has_profanity', 'is_spam', 'is_toxic',
+                 'toxic_reason', 'categories')
+    
+    def __init__(self, text: str):
+        self.text = text
+        self.text_lower = text.lower()
+        self.has_profanity = False
+        self.is_spam = False
+        self.is_toxic = False
+        self.toxic_reason = ""
+        # Rule categories hit by the keyword stage
+        self.categories = set()
+
+
+class AnalysisStage:
+    """One pluggable step of the analysis pipeline"""
+    
+    def __init__(self, name: str, cost: float, run: Callable[[AnalysisContext], None],
+                 needed: Optional[Callable[[AnalysisContext], bool]] = None):
+        """
+        Args:
+            name: Stage name used in stage_stats()
+            cost: Rough cost estimate in microseconds; stages run cheapest first
+            run: Updates the context in place
+            needed: Returns False when the stage cannot change the verdict
+        """
+        self.name = name
+        self.cost = cost
+        self.run = run
+        self.needed = needed
+        self.runs = 0
+        self.skips = 0
+        self.seconds = 0.0
+
+
+class RuleEngine:
+    """
+    Keyword and pattern rules compiled once into a single scanner.
+    
+    All rules are folded into one lookahead alternation, so one pass over
+    the text reports every (category, rule) hit, including overlapping ones.
+    Literal keywords that start at the same position are always prefixes of
+    each other, so a hit on the longest one also implies the shorter ones.
+    """
+    
+    def __init__(self, keywords: Dict[str, Iterable[str]],
+                 patterns: Optional[Dict[str, Iterable[str]]] = None):
+        # group name -> (category, rule)
+        self._groups: Dict[str, Tuple[str, str]] = {}
+        # group name of a literal -> literal rules it implies at the same position
+        self._implied: Dict[str, List[Tuple[str, str]]] = {}
+        
+        literals = [(category, word) for category, words in keywords.items() for word in words]
+        regexes = [(category, pattern) for category, rules in (patterns or {}).items()
+                   for pattern in rules]
+        
+        pattern_parts = []
+        for category, pattern in regexes:
+            name = f"r{len(self._groups)}"
+            self._groups[name] = (category, pattern)
+            pattern_parts.append(f"(?P<{name}>{pattern})")
+        
+        literal_parts = []
+        # Longest first, so shorter prefixes are recovered through _implied
+        for category, word in sorted(literals, key=lambda item: -len(item[1])):
+            name = f"k{len(self._groups)}"
+            self._groups[name] = (category, word)
+            self._implied[name] = [(c, w) for c, w in literals
+                                   if w != word and word.startswith(w)]
+            literal_parts.append(f"(?P<{name}>{re.escape(word)})")
+        
+        self._scanner = re.compile(f"(?=(?:{'|'.join(pattern_parts + literal_parts)}))")
+        # Anchored literal probe for positions where a pattern won the alternation
+        self._literal_scanner = re.compile('|'.join(literal_parts)) if literal_parts else None
+    
+    def scan(self, text: str) -> List[Tuple[str, str]]:
+        """Return every (category, rule) hit in order of position"""
+        hits = []
+        for match in self._scanner.finditer(text):
+            name = match.lastgroup
+            hits.append(self._groups[name])
+            if name[0] == 'r':
+                # A pattern hid any literal starting here
+                if self._literal_scanner is None:
+                    continue
+                literal = self._literal_scanner.match(text, match.start())
+                if not literal:
+                    continue
+                name = literal.lastgroup
+                hits.append(self._groups[name])
+            hits.extend(self._implied[name])
+        return hits
 
 
 class AIContentModerator:
     """AI-powered content moderator using free local models"""
     
-    def __init__(self):
-        """Initialize the moderator"""
-        # Initialize profanity filter
-        profanity.load_censor_words()
+    def __init__(self, early_exit: bool = Config.ANALYSIS_EARLY_EXIT):
+        """
+        Initialize the moderator
+        
+        Args:
+            early_exit: Skip remaining stages once the message is certain to
+                be flagged and deleted (spam or profanity found). When False
+                every stage runs and the reason lists every finding.
+        """
+        self.early_exit = early_exit
+        
+        # Initialize profanity filter with a compiled wordset
+        self.profanity = Profanity()
+        self.profanity.CENSOR_WORDSET = CompiledWordset(self.profanity.CENSOR_WORDSET)
         
         # Spam patterns
         self.spam_patterns = [
@@ -29,8 +170,81 @@ class AIContentModerator:
             'nazi', 'hitler', 'terrorist', 'kill yourself', 'kys',
             'extremist', 'bomb', 'attack', 'threat'
         ]
+        
+        # Words that make very negative sentiment count as toxic
+        self.aggressive_words = ['hate', 'stupid', 'idiot', 'dumb']
+        
+        # Harassment patterns
+        self.harassment_patterns = [
+            r'kill\s+your',
+            r'go\s+die',
+            r'should\s+die',
+            r'hate\s+you',
+        ]
+        
+        self.compile_rules()
+        
+        # Cheapest first; expensive stages only run while the verdict is open
+        self.stages: List[AnalysisStage] = []
+        self.add_stage(AnalysisStage('spam', 5, self._stage_spam))
+        self.add_stage(AnalysisStage('keywords', 5, self._stage_keywords))
+        self.add_stage(AnalysisStage('profanity', 50, self._stage_profanity,
+                                     needed=self._profanity_possible))
+        self.add_stage(AnalysisStage('sentiment', 500, self._stage_sentiment,
+                                     needed=self._sentiment_needed))
+    
+    def add_stage(self, stage: AnalysisStage):
+        """Insert a stage, keeping the pipeline ordered by cost"""
+        self.stages.append(stage)
+        self.stages.sort(key=lambda s: s.cost)
+        self._update_rules_version()
+    
+    def compile_rules(self):
+        """Compile the rule lists; call again after editing them"""
+        # Spam patterns overlap each other, so each keeps its own match count
+        self._spam_regexes = [re.compile(pattern) for pattern in self.spam_patterns]
+        self._emoji_regex = re.compile(
+            r'[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F1E0-\U0001F1FF]'
+        )
+        self._toxic_rank = {keyword: i for i, keyword in enumerate(self.toxic_keywords)}
+        self.rules = RuleEngine(
+            keywords={'toxic': self.toxic_keywords, 'aggressive': self.aggressive_words},
+            patterns={'harassment': self.harassment_patterns},
+        )
+        self._update_rules_version()
+    
+    def rules_snapshot(self) -> Dict[str, Any]:
+        """The editable rules as plain lists, for rebuilding this moderator in another process"""
+        return {
+            'early_exit': self.early_exit,
+            'spam_patterns': list(self.spam_patterns),
+            'toxic_keywords': list(self.toxic_keywords),
+            'aggressive_words': list(self.aggressive_words),
+            'harassment_patterns': list(self.harassment_patterns),
+            'censor_words': [str(word) for word in self.profanity.CENSOR_WORDSET],
+        }
+    
+    def load_rules(self, snapshot: Dict[str, Any]):
+        """Replace the rules with a rules_snapshot() and recompile them"""
+        self.early_exit = snapshot['early_exit']
+        self.spam_patterns = list(snapshot['spam_patterns'])
+        self.toxic_keywords = list(snapshot['toxic_keywords'])
+        self.aggressive_words = list(snapshot['aggressive_words'])
+        self.harassment_patterns = list(snapshot['harassment_patterns'])
+        # Rebuilding the wordset is the slow part, so only when it changed
+        if snapshot['censor_words'] != [str(word) for word in self.profanity.CENSOR_WORDSET]:
+            self.profanity.load_censor_words(snapshot['censor_words'])
+            self.profanity.CENSOR_WORDSET = CompiledWordset(self.profanity.CENSOR_WORDSET)
+        self.compile_rules()
+    
+    def _update_rules_version(self):
+        """Fingerprint everything that can change a verdict, for cache invalidation"""
+        rule_set = repr((self.spam_patterns, self.toxic_keywords, self.aggressive_words,
+                         self.harassment_patterns, len(self.profanity.CENSOR_WORDSET),
+                         self.early_exit, [stage.name for stage in getattr(self, 'stages', [])]))
+        self.rules_version = hashlib.sha1(rule_set.encode()).hexdigest()[:12]
     
-    def analyze_message(self, text: str) -> Dict[str, Any]:
+    def analyze_message(self, text: str) -> AnalysisResult:
         """
         Analyze message content for toxicity, spam, and profanity
         
@@ -45,48 +259,139 @@ class AIContentModerator:
         if not text:
             return self._create_result(False, False, False, 1.0, "Empty message")
         
-        text_lower = text.lower()
-        
-        # Check for profanity
-        has_profanity = profanity.contains_profanity(text)
-        
-        # Check for spam patterns
-        is_spam = self._is_spam(text)
+        ctx = AnalysisContext(text)
+        for stage in self.stages:
+            if self.early_exit and (ctx.is_spam or ctx.has_profanity):
+                # Flagged and deleted either way, later stages only add detail
+                stage.skips += 1
+                continue
+            if stage.needed is not None and not stage.needed(ctx):
+                stage.skips += 1
+                continue
+            
+            start = time.perf_counter()
+            stage.run(ctx)
+            stage.seconds += time.perf_counter() - start
+            stage.runs += 1
         
-        # Check for toxic content
-        is_toxic, toxic_reason = self._is_toxic(text_lower)
+        self._resolve_harassment(ctx)
         
         # Calculate confidence
-        confidence = self._calculate_confidence(text, has_profanity, is_spam, is_toxic)
+        confidence = self._calculate_confidence(text, ctx.has_profanity, ctx.is_spam, ctx.is_toxic)
         
         # Determine if message should be flagged
-        should_flag = has_profanity or is_spam or is_toxic
+        should_flag = ctx.has_profanity or ctx.is_spam or ctx.is_toxic
         
-        reason = self._build_reason(has_profanity, is_spam, toxic_reason)
+        reason = self._build_reason(ctx.has_profanity, ctx.is_spam, ctx.toxic_reason)
         
         return self._create_result(
-            is_toxic=is_toxic,
-            is_spam=is_spam,
-            has_profanity=has_profanity,
+            is_toxic=ctx.is_toxic,
+            is_spam=ctx.is_spam,
+            has_profanity=ctx.has_profanity,
             confidence=confidence,
             reason=reason,
             should_flag=should_flag
         )
     
+    def stage_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-stage run/skip counters and mean run time"""
+        return {
+            stage.name: {
+                'cost': stage.cost,
+                'runs': stage.runs,
+                'skips': stage.skips,
+                'avg_us': stage.seconds / stage.runs * 1e6 if stage.runs else 0.0,
+            }
+            for stage in self.stages
+        }
+    
+    def _stage_spam(self, ctx: AnalysisContext):
+        ctx.is_spam = self._is_spam(ctx.text)
+    
+    def _stage_keywords(self, ctx: AnalysisContext):
+        hits = self.rules.scan(ctx.text_lower)
+        ctx.categories = {category for category, _ in hits}
+        
+        # Earliest listed toxic keyword wins
+        if 'toxic' in ctx.categories:
+            keyword = min((rule for category, rule in hits if category == 'toxic'),
+                          key=self._toxic_rank.__getitem__)
+            ctx.is_toxic, ctx.toxic_reason = True, f"Contains toxic keyword: {keyword}"
+    
+    def _profanity_possible(self, ctx: AnalysisContext) -> bool:
+        # Shorter than the shortest censored word (or a single character)
+        return len(ctx.text) >= max(self.profanity.CENSOR_WORDSET.min_length, 2)
+    
+    def _stage_profanity(self, ctx: AnalysisContext):
+        ctx.has_profanity = self._contains_profanity(ctx.text)
+    
+    def _contains_profanity(self, text: str) -> bool:
+        return self.profanity.contains_profanity(text)
+    
+    def _sentiment_needed(self, ctx: AnalysisContext) -> bool:
+        # Sentiment only matters with aggressive words and no keyword verdict
+        return not ctx.is_toxic and 'aggressive' in ctx.categories
+    
+    def _resolve_harassment(self, ctx: AnalysisContext):
+        # Harassment only counts when nothing more specific was found
+        if not ctx.is_toxic and 'harassment' in ctx.categories:
+            ctx.is_toxic, ctx.toxic_reason = True, "Contains harassment language"
+    
+    def _stage_sentiment(self, ctx: AnalysisContext):
+        # Use TextBlob for sentiment analysis
+        try:
+            blob = TextBlob(ctx.text_lower)
+            polarity = blob.sentiment.polarity
+            
+            # Very negative sentiment might indicate toxic content
+            if polarity < -0.5:
+                ctx.is_toxic, ctx.toxic_reason = True, "Negative sentiment with aggressive language"
+        except:
+            pass
+    
+    def apply_model_score(self, result: AnalysisResult, score: float,
+                          threshold: float = Config.TOXICITY_THRESHOLD) -> AnalysisResult:
+        """Fold a model toxicity score into an analysis result"""
+        if score < threshold:
+            return result
+        
+        toxic_reason = f"Model toxicity score {score:.2f}"
+        return self._create_result(
+            is_toxic=True,
+            is_spam=result.is_spam,
+            has_profanity=result.has_profanity,
+            confidence=self._calculate_confidence('', result.has_profanity, result.is_spam, True),
+            reason=self._build_reason(result.has_profanity, result.is_spam, toxic_reason),
+            should_flag=True
+        )
+    
+    def campaign_result(self, reason: str) -> AnalysisResult:
+        """Analysis result for a message that belongs to a cross-chat campaign"""
+        return self._create_result(
+            is_toxic=False,
+            is_spam=True,
+            has_profanity=False,
+            confidence=self._calculate_confidence('', False, True, False),
+            reason=reason,
+            should_flag=True
+        )
+    
     def _is_spam(self, text: str) -> bool:
         """Detect spam patterns"""
         spam_score = 0
         
-        # Check each pattern
-        for pattern in self.spam_patterns:
-            matches = re.findall(pattern, text)
-            if matches:
-                spam_score += len(matches)
+        # Check each pattern, stopping as soon as the verdict is settled
+        for regex in self._spam_regexes:
+            for _ in regex.finditer(text):
+                spam_score += 1
+                if spam_score >= 3:
+                    return True
         
-        # Count excessive emojis
-        emoji_count = len(re.findall(r'[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F1E0-\U0001F1FF]', text))
-        if emoji_count > 10:
-            spam_score += 2
+        # Count excessive emojis (ASCII text cannot contain any)
+        if not text.isascii():
+            emoji_count = len(self._emoji_regex.findall(text))
+            if emoji_count > 10:
+                spam_score += 2
         
         # Check for link spam
         if text.count('http') > 2:
@@ -95,36 +400,13 @@ class AIContentModerator:
         return spam_score >= 3
     
     def _is_toxic(self, text: str) -> Tuple[bool, str]:
-        """Detect toxic content"""
-        # Check for toxic keywords
-        for keyword in self.toxic_keywords:
-            if keyword in text:
-                return True, f"Contains toxic keyword: {keyword}"
-        
-        # Use TextBlob for sentiment analysis
-        try:
-            blob = TextBlob(text)
-            polarity = blob.sentiment.polarity
-            
-            # Very negative sentiment might indicate toxic content
-            if polarity < -0.5 and any(word in text for word in ['hate', 'stupid', 'idiot', 'dumb']):
-                return True, "Negative sentiment with aggressive language"
-        except:
-            pass
-        
-        # Check for harassment patterns
-        harassment_patterns = [
-            r'kill\s+your',
-            r'go\s+die',
-            r'should\s+die',
-            r'hate\s+you',
-        ]
-        
-        for pattern in harassment_patterns:
-            if re.search(pattern, text):
-                return True, "Contains harassment language"
-        
-        return False, ""
+        """Detect toxic content (keyword, sentiment and harassment stages)"""
+        ctx = AnalysisContext(text)
+        self._stage_keywords(ctx)
+        if self._sentiment_needed(ctx):
+            self._stage_sentiment(ctx)
+        self._resolve_harassment(ctx)
+        return ctx.is_toxic, ctx.toxic_reason
     
     def _calculate_confidence(self, text: str, has_profanity: bool, 
                             is_spam: bool, is_toxic: bool) -> float:
@@ -157,16 +439,9 @@ class AIContentModerator:
         return ", ".join(reasons)
     
     def _create_result(self, is_toxic: bool, is_spam: bool, has_profanity: bool,
-                      confidence: float, reason: str, should_flag: bool = False) -> Dict:
-        """Create result dictionary"""
-        return {
-            'is_toxic': is_toxic,
-            'is_spam': is_spam,
-            'has_profanity': has_profanity,
-            'confidence': confidence,
-            'reason': reason,
-            'should_flag': should_flag
-        }
+                      confidence: float, reason: str, should_flag: bool = False) -> AnalysisResult:
+        """Create result record"""
+        return AnalysisResult(is_toxic, is_spam, has_profanity, confidence, reason, should_flag)
     
     def check_user_behavior(self, message_count: int, time_window: int, 
                            threshold: int) -> bool:
@@ -0,0 +1,169 @@
+"""
+Analysis execution module
+Runs AIContentModerator off the event loop (inline, thread pool or process pool)
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from ai_moderator import AIContentModerator
+from config import Config
+from records import AnalysisResult
+
+logger = logging.getLogger(__name__)
+
+MODES = ('inline', 'thread', 'process')
+
+# Per-process moderator, built once by the pool initializer
+_worker_moderator: Optional[AIContentModerator] = None
+
+
+def _init_worker(rules: Dict[str, Any]):
+    global _worker_moderator
+    _worker_moderator = AIContentModerator()
+    _worker_moderator.load_rules(rules)
+
+
+# (name, runs, skips, seconds) per stage since the previous analysis
+StageDeltas = List[Tuple[str, int, int, float]]
+
+
+def _analyze_in_worker(text: str, rules_version: str,
+                       rules: Optional[Dict[str, Any]] = None) -> Optional[Tuple[AnalysisResult, StageDeltas]]:
+    # Verdicts are cached under the parent's rules_version, so never answer
+    # from older rules: ask for them (None) or load the ones sent along
+    if _worker_moderator.rules_version != rules_version:
+        if rules is None:
+            return None
+        _worker_moderator.load_rules(rules)
+        if _worker_moderator.rules_version != rules_version:
+            raise RuntimeError("Analysis workers can't rebuild the moderator's stages; "
+                               "custom stages need ANALYSIS_MODE inline or thread")
+
+    result = _worker_moderator.analyze_message(text)
+    # Stage counters travel back with each result and restart from zero, so
+    # the parent's stage_stats() covers the work done in every worker
+    deltas = []
+    for stage in _worker_moderator.stages:
+        deltas.append((stage.name, stage.runs, stage.skips, stage.seconds))
+        stage.runs = stage.skips = 0
+        stage.seconds = 0.0
+    return result, deltas
+
+
+def _warm_up_worker() -> bool:
+    return _worker_moderator is not None
+
+
+class AnalysisExecutor:
+    """
+    Dispatches analyze_message calls according to ANALYSIS_MODE.
+
+    inline   - on the event loop thread (the original behaviour)
+    thread   - in a thread pool sharing the given moderator
+    process  - in worker processes, each with its own pre-built moderator,
+               brought up to date with the given one's rules when they change
+
+    At most `max_pending` analyses are submitted at once; further callers
+    wait for a slot instead of piling work onto the executor queue.
+    """
+
+    def __init__(self, moderator: AIContentModerator, mode: str = Config.ANALYSIS_MODE,
+                 workers: int = Config.ANALYSIS_WORKERS,
+                 max_pending: int = Config.ANALYSIS_MAX_PENDING):
+        if mode not in MODES:
+            raise ValueError(f"ANALYSIS_MODE must be one of {', '.join(MODES)}, got {mode!r}")
+
+        self.moderator = moderator
+        self.mode = mode
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor: Optional[Executor] = None
+        self._slots = asyncio.Semaphore(max_pending)
+
+        # Metrics
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+
+    async def start(self):
+        """Create the pool and make sure every worker is initialized"""
+        if self.mode == 'inline' or self.executor is not None:
+            return
+
+        if self.mode == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                               thread_name_prefix='analysis')
+            return
+
+        # Spawn rather than fork: the parent already runs aiosqlite threads
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.moderator.rules_snapshot(),),
+        )
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, _warm_up_worker)
+                               for _ in range(self.workers)))
+        logger.info(f"Started {self.workers} analysis worker process(es)")
+
+    async def stop(self):
+        """Shut the pool down, waiting for it off the event loop"""
+        if self.executor is not None:
+            executor, self.executor = self.executor, None
+            await asyncio.to_thread(executor.shutdown, wait=True)
+
+    async def analyze(self, text: str) -> AnalysisResult:
+        """Analyze a message without blocking the event loop (except inline)"""
+        if self.mode == 'inline':
+            self.completed += 1
+            return self.moderator.analyze_message(text)
+
+        if self.executor is None:
+            await self.start()
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            if self.mode == 'thread':
+                return await loop.run_in_executor(self.executor, self.moderator.analyze_message, text)
+            version = self.moderator.rules_version
+            reply = await loop.run_in_executor(self.executor, _analyze_in_worker, text, version)
+            if reply is None:
+                # That worker predates a rule edit; resend with the rules
+                reply = await loop.run_in_executor(self.executor, _analyze_in_worker, text, version,
+                                                   self.moderator.rules_snapshot())
+            result, deltas = reply
+            self._merge_stage_stats(deltas)
+            return result
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def _merge_stage_stats(self, deltas: StageDeltas):
+        """Add a worker's stage counters to the parent moderator's"""
+        stages = {stage.name: stage for stage in self.moderator.stages}
+        for name, runs, skips, seconds in deltas:
+            stage = stages.get(name)
+            if stage is not None:
+                stage.runs += runs
+                stage.skips += skips
+                stage.seconds += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth metrics"""
+        return {
+            'mode': self.mode,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'completed': self.completed,
+        }
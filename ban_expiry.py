@@ -0,0 +1,149 @@
+"""
+Ban expiry module
+Lifts temporary bans at their expiry time
+"""
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from action_scheduler import ActionScheduler
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class BanExpiryScheduler:
+    """
+    Lifts temporary bans when they run out.
+
+    Expiry times sit in a min-heap; one task sleeps until the earliest, lifts
+    every ban that is due (one DELETE batch on active_bans plus an unban per
+    user through the action scheduler) and sleeps again. A newly scheduled
+    ban that expires sooner wakes it early. Renewing or removing a ban leaves
+    its old heap entry in place; stale entries are skipped when they reach
+    the top, so every operation stays O(log n). With `owns` set only bans in
+    chats it accepts are loaded, for a worker that handles some chats only.
+    """
+
+    def __init__(self, db: Storage, actions: ActionScheduler,
+                 clock: Callable[[], float] = time.time,
+                 owns: Optional[Callable[[int], bool]] = None):
+        self.db = db
+        self.actions = actions
+        self.clock = clock
+        self.owns = owns
+        # (ban_until, chat_id, user_id)
+        self._heap: List[Tuple[float, int, int]] = []
+        # (chat_id, user_id) -> current ban_until
+        self._expiry: Dict[Tuple[int, int], float] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.lifted = 0
+        self.failed = 0
+
+    async def start(self):
+        """Load the active temporary bans and start lifting them"""
+        for chat_id, user_id, ban_until in await self.db.get_expiring_bans():
+            if self.owns is not None and not self.owns(chat_id):
+                continue
+            self._expiry[(chat_id, user_id)] = ban_until
+            self._heap.append((ban_until, chat_id, user_id))
+        heapq.heapify(self._heap)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, chat_id: int, user_id: int, duration: Optional[float]):
+        """
+        Lift this ban `duration` seconds from now (None: permanent, never)
+
+        Call after the ban is recorded, so the stored expiry is not later
+        than the scheduled one.
+        """
+        key = (chat_id, user_id)
+        if duration is None:
+            self._expiry.pop(key, None)
+            return
+
+        ban_until = self.clock() + duration
+        self._expiry[key] = ban_until
+        heapq.heappush(self._heap, (ban_until, chat_id, user_id))
+        if self._heap[0][0] == ban_until:
+            self._wakeup.set()
+
+    def cancel(self, chat_id: int, user_id: int):
+        """Forget a ban that was lifted by hand"""
+        self._expiry.pop((chat_id, user_id), None)
+
+    def pending(self) -> int:
+        """Temporary bans waiting to expire"""
+        return len(self._expiry)
+
+    def _drop_stale(self):
+        while self._heap:
+            ban_until, chat_id, user_id = self._heap[0]
+            if self._expiry.get((chat_id, user_id)) == ban_until:
+                return
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now: float) -> List[Tuple[int, int]]:
+        due = []
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, chat_id, user_id = heapq.heappop(self._heap)
+            del self._expiry[(chat_id, user_id)]
+            due.append((chat_id, user_id))
+            self._drop_stale()
+        return due
+
+    def next_expiry(self) -> Optional[float]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            next_expiry = self.next_expiry()
+            delay = None if next_expiry is None else next_expiry - self.clock()
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = self.clock()
+            due = self._pop_due(now)
+            try:
+                await self.db.lift_expired_bans(due, now)
+            except Exception as e:
+                logger.error(f"Could not remove {len(due)} expired bans: {str(e)}", exc_info=True)
+            for chat_id, user_id in due:
+                self.actions.unban(chat_id, user_id, only_if_banned=True) \
+                    .add_done_callback(self._lifted)
+
+    def _lifted(self, future: asyncio.Future):
+        if future.exception() is not None:
+            self.failed += 1
+        else:
+            self.lifted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        next_expiry = self.next_expiry()
+        return {
+            'pending': self.pending(),
+            'next_in': None if next_expiry is None else max(0.0, next_expiry - self.clock()),
+            'lifted': self.lifted,
+            'failed': self.failed,
+        }
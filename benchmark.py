@@ -0,0 +1,982 @@
+"""
+Performance benchmarks for Telegram Moderator Bot
+Run this to measure hot-path throughput on synthetic chat load
+
+Usage:
+    python benchmark.py                 # run every scenario
+    python benchmark.py connections     # run a single scenario
+    python benchmark.py indexes --rows 10000,1000000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+from types import MappingProxyType, SimpleNamespace
+from datetime import datetime, timedelta
+
+import aiosqlite
+from better_profanity import profanity
+from textblob import TextBlob
+
+from action_scheduler import ActionScheduler
+from ai_moderator import AIContentModerator
+from analysis_executor import AnalysisExecutor
+from campaign_detector import CampaignDetector
+from config import Config
+from database import Database
+from fake_bot import FakeBot
+from fake_redis import FakeRedisServer
+from maintenance import Maintenance
+from memory_database import MemoryDatabase
+from metrics import Registry
+from migrations import migrate
+from raid_mode import RaidMode
+from shared_state import InProcessState, RedisState
+from replay import generate_corpus, replay
+from sharding import shard_for
+from records import WarningRecord
+from storage import Storage, default_chat_config
+from verdict_cache import VerdictCache
+from toxicity_classifier import BatchingClassifier, DummyClassifier, TransformerClassifier
+from update_processor import KeyedUpdateProcessor
+
+
+def section(title: str):
+    """Print section header"""
+    print(f"\n{'='*60}")
+    print(f"  {title}")
+    print(f"{'='*60}")
+
+
+def synthetic_load(messages: int, chats: int = 20, users: int = 200, seed: int = 42):
+    """Generate a reproducible list of (user_id, chat_id) message events"""
+    rng = random.Random(seed)
+    return [
+        (rng.randrange(users) + 1, -(rng.randrange(chats) + 1000))
+        for _ in range(messages)
+    ]
+
+
+# =================================================================
+# Connection pooling
+# =================================================================
+
+class UnpooledDatabase(Database):
+    """The pre-pool hot path: one aiosqlite.connect() per call"""
+
+    async def track_message(self, user_id: int, chat_id: int):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('''
+                INSERT INTO user_messages (user_id, chat_id)
+                VALUES (?, ?)
+            ''', (user_id, chat_id))
+            await db.commit()
+
+    async def get_chat_config(self, chat_id: int):
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute('''
+                SELECT * FROM chat_config WHERE chat_id = ?
+            ''', (chat_id,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else {}
+
+    async def get_recent_message_count(self, user_id: int, chat_id: int,
+                                       time_window: int) -> int:
+        cutoff_time = (datetime.now() - timedelta(seconds=time_window)).isoformat()
+
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute('''
+                SELECT COUNT(*) FROM user_messages
+                WHERE user_id = ? AND chat_id = ?
+                AND timestamp > ?
+            ''', (user_id, chat_id, cutoff_time)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else 0
+
+
+async def _drive_hot_path(db: Storage, load) -> float:
+    """Replay the per-message database calls of handle_message, return msgs/sec"""
+    start = time.perf_counter()
+    for user_id, chat_id in load:
+        await db.track_message(user_id, chat_id)
+        await db.get_chat_config(chat_id)
+        await db.get_recent_message_count(user_id, chat_id, Config.FLOOD_TIME_WINDOW)
+    return len(load) / (time.perf_counter() - start)
+
+
+async def bench_connections(args):
+    """Compare connect-per-call against the pooled connection layer"""
+    section("Connection pooling (messages/sec)")
+    load = synthetic_load(args.messages)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, cls in (("per-call connect", UnpooledDatabase), ("pooled", Database)):
+            db = cls(os.path.join(tmp, f"{cls.__name__}.db"))
+            await db.initialize()
+            rate = await _drive_hot_path(db, load)
+            await db.close()
+            print(f"{label:<20} {rate:>10.0f} msg/s")
+
+
+# =================================================================
+# Write-behind batching
+# =================================================================
+
+async def bench_writes(args):
+    """Compare one commit per write against the write-behind queue"""
+    section("Write-behind batching (raid writes/sec)")
+    load = synthetic_load(args.messages)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, write_behind in (("commit per write", False), ("write-behind", True)):
+            db = Database(os.path.join(tmp, f"writes_{write_behind}.db"), write_behind=write_behind)
+            await db.initialize()
+
+            start = time.perf_counter()
+            for user_id, chat_id in load:
+                await db.track_message(user_id, chat_id)
+                await db.add_warning(user_id, chat_id, "raider", "Flood/Spam", 0)
+            await db.flush()
+            rate = 2 * len(load) / (time.perf_counter() - start)
+
+            extra = ""
+            if db.write_queue:
+                stats = db.write_queue.stats()
+                extra = (f"  ({stats['flushes']} flushes, "
+                         f"avg {stats['avg_flush_ms']:.1f} ms, max {stats['max_flush_ms']:.1f} ms)")
+            await db.close()
+            print(f"{label:<20} {rate:>10.0f} writes/s{extra}")
+
+
+# =================================================================
+# Schema indexes
+# =================================================================
+
+def _fill_warnings(path: str, rows: int, users: int, chats: int):
+    """Bulk-load synthetic warning history with plain sqlite3"""
+    rng = random.Random(7)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        'INSERT INTO warnings (user_id, chat_id, username, reason, warned_by, timestamp) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        ((rng.randrange(users), rng.randrange(chats), "user", "Flood/Spam", 0,
+          f"2025-01-{rng.randrange(28) + 1:02d} 12:00:00") for _ in range(rows))
+    )
+    conn.commit()
+    conn.close()
+
+
+async def _count_warnings(db: Database, user_id: int, chat_id: int) -> int:
+    """get_warning_count as it was before the warning_counts table"""
+    async with db.pool.reader() as conn:
+        async with conn.execute('''
+            SELECT COUNT(*) FROM warnings WHERE user_id = ? AND chat_id = ?
+        ''', (user_id, chat_id)) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def _latest_ban(db: Database, user_id: int, chat_id: int) -> bool:
+    """is_banned as it was before the active_bans table"""
+    async with db.pool.reader() as conn:
+        async with conn.execute('''
+            SELECT is_permanent, ban_until FROM bans WHERE user_id = ? AND chat_id = ?
+            ORDER BY timestamp DESC LIMIT 1
+        ''', (user_id, chat_id)) as cursor:
+            return await cursor.fetchone() is not None
+
+
+async def _lookup_latency(lookups: dict, users: int, chats: int, samples: int = 200) -> dict:
+    """Mean latency in ms of each per-user lookup"""
+    rng = random.Random(11)
+    keys = [(rng.randrange(users), rng.randrange(chats)) for _ in range(samples)]
+    results = {}
+    for name, method in lookups.items():
+        start = time.perf_counter()
+        for user_id, chat_id in keys:
+            await method(user_id, chat_id)
+        results[name] = (time.perf_counter() - start) * 1000 / samples
+    return results
+
+
+async def bench_indexes(args):
+    """Per-user lookup latency before and after the index, counter and active-ban migrations"""
+    section("Schema indexes (lookup latency, ms)")
+    users, chats = 100000, 100
+
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "indexes.db")
+            db = Database(path)
+            await db.pool.open()
+            async with db.pool.writer() as conn:
+                await migrate(conn, target=1)
+            _fill_warnings(path, rows, users, chats)
+            lookups = {
+                'warning count': lambda user_id, chat_id: _count_warnings(db, user_id, chat_id),
+                'get_warnings': db.get_warnings,
+                'ban lookup': lambda user_id, chat_id: _latest_ban(db, user_id, chat_id),
+            }
+
+            before = await _lookup_latency(lookups, users, chats)
+            start = time.perf_counter()
+            async with db.pool.writer() as conn:
+                await migrate(conn, target=2)
+            build = time.perf_counter() - start
+            after = await _lookup_latency(lookups, users, chats)
+
+            # Maintained counters and active_bans replace the history scans
+            start = time.perf_counter()
+            async with db.pool.writer() as conn:
+                await migrate(conn)
+            seed = time.perf_counter() - start
+            tables = await _lookup_latency({'warning count': db.get_warning_count,
+                                            'ban lookup': db.is_banned}, users, chats)
+            await db.close()
+
+        print(f"{rows:>10,} rows  (index build {build:.1f}s, table seed {seed:.1f}s)")
+        for name in before:
+            print(f"    {name:<20} {before[name]:>9.3f} -> {after[name]:.3f}"
+                  + (f" -> {tables[name]:.3f} (table)" if name in tables else ""))
+
+
+async def bench_maintenance(args):
+    """Write latency while old message tracking rows are purged"""
+    section("Maintenance (write latency during a 200k-row purge)")
+    rows = 200000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, chunked in (("single DELETE", False), ("chunked purge", True)):
+            path = os.path.join(tmp, f"maintenance_{chunked}.db")
+            db = Database(path)
+            await db.initialize()
+            conn = sqlite3.connect(path)
+            conn.executemany(
+                'INSERT INTO user_messages (user_id, chat_id, timestamp) VALUES (?, ?, ?)',
+                ((i, i % 100, '2020-01-01 00:00:00') for i in range(rows))
+            )
+            conn.commit()
+            conn.close()
+
+            latencies = []
+            done = asyncio.Event()
+
+            async def writer():
+                while not done.is_set():
+                    start = time.perf_counter()
+                    await db.track_message(1, 1)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    await asyncio.sleep(0.001)
+
+            task = asyncio.create_task(writer())
+            start = time.perf_counter()
+            if chunked:
+                await Maintenance(db, warning_retention_days=0, chunk_size=1000).run_once()
+            else:
+                async with db.pool.writer() as conn:
+                    await conn.execute("DELETE FROM user_messages WHERE timestamp < datetime('now', '-24 hours')")
+                    await conn.commit()
+            elapsed = time.perf_counter() - start
+            done.set()
+            await task
+            await db.close()
+
+            latencies.sort()
+            print(f"{label:<16} {elapsed:>6.2f}s   {len(latencies):>5} writes meanwhile, "
+                  f"max wait {latencies[-1]:.1f} ms")
+
+
+# =================================================================
+# Rule engine
+# =================================================================
+
+CORPUS_TEMPLATES = [
+    "hey everyone, how is it going?",
+    "ok",
+    "thanks!",
+    "does anyone know when the next meetup is? I think it was moved to friday",
+    "lol that's hilarious 😂",
+    "can someone share the link to the docs please",
+    "I think the new release fixed the login bug, at least for me",
+    "Check out http://cheap-crypto.example and http://win.example and http://free.example",
+    "BUY NOW!!!!! LIMITED OFFER @promo_bot @deals_bot @crypto_bot",
+    "AAAAAAAAAAAAAAAA look at this http://spam.example",
+    "🔥🔥🔥🔥🔥🔥🔥🔥🔥🔥🔥🔥 giveaway 🎁🎁🎁",
+    "you are so stupid, I hate this group",
+    "I hate you, go die",
+    "you should die, seriously",
+    "this is a terrorist threat",
+    "kys loser",
+    "what a dumb idea, you idiot",
+    "the bomb squad cleared the building this morning",
+    "shit, I missed the bus again",
+    "well that was a damn good game",
+]
+
+
+def synthetic_corpus(messages: int, seed: int = 42):
+    """Generate a reproducible corpus of realistic chat messages"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(messages):
+        text = rng.choice(CORPUS_TEMPLATES)
+        if rng.random() < 0.3:
+            text = f"{text} {rng.choice(CORPUS_TEMPLATES)}"
+        corpus.append(text)
+    return corpus
+
+
+class LegacyModerator(AIContentModerator):
+    """The pre-rule-engine checks: uncompiled patterns scanned in loops"""
+
+    def __init__(self):
+        super().__init__(early_exit=False)
+        profanity.load_censor_words()
+
+    def analyze_message(self, text: str):
+        if not text:
+            return self._create_result(False, False, False, 1.0, "Empty message")
+        text_lower = text.lower()
+        has_profanity = profanity.contains_profanity(text)
+        is_spam = self._is_spam(text)
+        is_toxic, toxic_reason = self._is_toxic(text_lower)
+        confidence = self._calculate_confidence(text, has_profanity, is_spam, is_toxic)
+        should_flag = has_profanity or is_spam or is_toxic
+        reason = self._build_reason(has_profanity, is_spam, toxic_reason)
+        return self._create_result(
+            is_toxic=is_toxic,
+            is_spam=is_spam,
+            has_profanity=has_profanity,
+            confidence=confidence,
+            reason=reason,
+            should_flag=should_flag
+        )
+
+    def _is_spam(self, text: str) -> bool:
+        spam_score = 0
+        for pattern in self.spam_patterns:
+            matches = re.findall(pattern, text)
+            if matches:
+                spam_score += len(matches)
+        emoji_count = len(re.findall(r'[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F1E0-\U0001F1FF]', text))
+        if emoji_count > 10:
+            spam_score += 2
+        if text.count('http') > 2:
+            spam_score += 3
+        return spam_score >= 3
+
+    def _is_toxic(self, text: str):
+        for keyword in self.toxic_keywords:
+            if keyword in text:
+                return True, f"Contains toxic keyword: {keyword}"
+        try:
+            blob = TextBlob(text)
+            polarity = blob.sentiment.polarity
+            if polarity < -0.5 and any(word in text for word in ['hate', 'stupid', 'idiot', 'dumb']):
+                return True, "Negative sentiment with aggressive language"
+        except:
+            pass
+        harassment_patterns = [
+            r'kill\s+your',
+            r'go\s+die',
+            r'should\s+die',
+            r'hate\s+you',
+        ]
+        for pattern in harassment_patterns:
+            if re.search(pattern, text):
+                return True, "Contains harassment language"
+        return False, ""
+
+
+async def bench_rules(args):
+    """Compare the legacy checks against the compiled rule engine"""
+    section("Rule engine (messages/sec)")
+    corpus = synthetic_corpus(args.messages)
+    legacy, compiled = LegacyModerator(), AIContentModerator(early_exit=False)
+
+    mismatches = [text for text in corpus
+                  if legacy.analyze_message(text) != compiled.analyze_message(text)]
+    print(f"verdict mismatches    {len(mismatches)} / {len(corpus)}")
+
+    for label, moderator in (("legacy", legacy), ("compiled", compiled)):
+        start = time.perf_counter()
+        for text in corpus:
+            moderator._is_spam(text)
+            moderator._is_toxic(text.lower())
+        rules_rate = len(corpus) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for text in corpus:
+            moderator.analyze_message(text)
+        full_rate = len(corpus) / (time.perf_counter() - start)
+        print(f"{label:<20} rules {rules_rate:>9.0f} msg/s   full analysis {full_rate:>7.0f} msg/s")
+
+
+# =================================================================
+# Tiered analysis pipeline
+# =================================================================
+
+async def bench_stages(args):
+    """Per-stage cost and skip counts, exhaustive versus early exit"""
+    section("Tiered analysis pipeline")
+    corpus = synthetic_corpus(args.messages)
+
+    for label, early_exit in (("exhaustive", False), ("early exit", True)):
+        moderator = AIContentModerator(early_exit=early_exit)
+        start = time.perf_counter()
+        for text in corpus:
+            moderator.analyze_message(text)
+        rate = len(corpus) / (time.perf_counter() - start)
+
+        print(f"{label:<12} {rate:>8.0f} msg/s")
+        for name, stats in moderator.stage_stats().items():
+            print(f"    {name:<10} runs {stats['runs']:>6}  skips {stats['skips']:>6}  "
+                  f"avg {stats['avg_us']:>8.1f} us")
+
+
+# =================================================================
+# Verdict cache
+# =================================================================
+
+def raid_corpus(messages: int, seed: int = 42):
+    """Spam raid: a few base texts copied with light mutations, plus normal chat"""
+    rng = random.Random(seed)
+    bases = [
+        "join my crypto pump group now at http://scam.example and http://pump.example @pumpbot",
+        "FREE NITRO giveaway click http://gift.example @nitro_bot @gifts claim before it expires",
+        "hot singles in your area want to meet you http://date.example http://meet.example tonight",
+    ]
+    corpus = []
+    for _ in range(messages):
+        if rng.random() < 0.3:
+            corpus.append(rng.choice(CORPUS_TEMPLATES))
+            continue
+        text = rng.choice(bases)
+        if rng.random() < 0.5:
+            text = f"{text} {rng.randrange(1000)}"
+        corpus.append(text)
+    return corpus
+
+
+async def bench_verdicts(args):
+    """Hit ratios and throughput of the verdict cache on a spam raid"""
+    section("Verdict cache (spam raid)")
+    corpus = raid_corpus(args.messages)
+    moderator = AIContentModerator()
+
+    start = time.perf_counter()
+    for text in corpus:
+        moderator.analyze_message(text)
+    print(f"{'no cache':<16} {len(corpus) / (time.perf_counter() - start):>8.0f} msg/s")
+
+    for label, near in (("exact", False), ("exact + simhash", True)):
+        verdicts = VerdictCache(version=lambda: moderator.rules_version, near_duplicates=near)
+        start = time.perf_counter()
+        for text in corpus:
+            if verdicts.get(text) is None:
+                verdicts.put(text, moderator.analyze_message(text))
+        rate = len(corpus) / (time.perf_counter() - start)
+        stats = verdicts.stats()
+        print(f"{label:<16} {rate:>8.0f} msg/s   hit ratio {stats['hit_ratio']:.2f}   "
+              f"near-duplicate hit ratio {stats['near_hit_ratio']:.2f}")
+
+
+# =================================================================
+# Cross-chat campaign detection
+# =================================================================
+
+async def bench_campaigns(args):
+    """Detection delay, false positives and memory of the campaign detector"""
+    section("Campaign detector (link posted into 200 chats)")
+    rng = random.Random(42)
+    # Organic chat rarely repeats verbatim: link-free templates with unique detail
+    organic = [text for text in CORPUS_TEMPLATES if 'http' not in text]
+    corpus = [f"{rng.choice(organic)} {rng.choice(organic)} #{i}" for i in range(args.messages)]
+    campaign = "limited offer, claim yours at http://campaign.example/ref"
+    # Normal traffic across 200 chats with the campaign interleaved
+    load = [(rng.randrange(200), rng.randrange(5000), text, None) for text in corpus]
+    for chat in range(200):
+        load.insert(rng.randrange(len(load)), (chat, 10000 + chat, campaign, chat))
+
+    tracemalloc.start()
+    detector = CampaignDetector()
+    built = tracemalloc.get_traced_memory()[0]
+
+    flagged_at, false_positives = None, 0
+    start = time.perf_counter()
+    for i, (chat, user, text, campaign_chat) in enumerate(load):
+        reason = detector.observe(chat, user, text, now=i * 0.01)
+        if reason and campaign_chat is None:
+            false_positives += 1
+        elif reason and flagged_at is None:
+            flagged_at = sum(1 for *_, c in load[:i + 1] if c is not None)
+    elapsed = time.perf_counter() - start
+    grown = tracemalloc.get_traced_memory()[0] - built
+    tracemalloc.stop()
+
+    print(f"throughput       {len(load) / elapsed:>8.0f} msg/s")
+    print(f"flagged after    {flagged_at} chats (threshold {detector.chat_threshold})")
+    print(f"false positives  {false_positives} of {len(corpus)} normal messages")
+    print(f"sketch memory    {built / 1024:>8.0f} KiB, +{grown / 1024:.0f} KiB after traffic")
+
+
+# =================================================================
+# Concurrent update dispatch
+# =================================================================
+
+async def bench_dispatch(args):
+    """Fast-chat latency while one chat is stuck behind slow API calls"""
+    section("Update dispatch (1 slow chat, 19 fast chats)")
+    rng = random.Random(42)
+    updates = [(rng.randrange(20), rng.randrange(100)) for _ in range(args.messages // 4)]
+
+    for label, limit in (("sequential", 1), ("keyed x32", 32)):
+        processor = KeyedUpdateProcessor(max_concurrent_updates=limit)
+        fast = []
+
+        async def handle(chat, queued_at):
+            # Chat 0 waits on a slow ban_chat_member; the others on quick replies
+            await asyncio.sleep(0.02 if chat == 0 else 0.001)
+            if chat:
+                fast.append(time.perf_counter() - queued_at)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            processor.process_update(
+                SimpleNamespace(effective_chat=SimpleNamespace(id=chat),
+                                effective_user=SimpleNamespace(id=user)),
+                handle(chat, time.perf_counter()))
+            for chat, user in updates
+        ))
+        elapsed = time.perf_counter() - start
+        fast.sort()
+        print(f"{label:<12} {len(updates) / elapsed:>8.0f} updates/s   "
+              f"fast-chat p50 {fast[len(fast) // 2] * 1000:>7.1f} ms   "
+              f"p99 {fast[int(len(fast) * 0.99)] * 1000:>7.1f} ms")
+
+
+# =================================================================
+# Outbound API scheduling
+# =================================================================
+
+async def bench_actions(args):
+    """API calls and 429s for a raid: direct calls vs the action scheduler"""
+    section("Outbound actions (raid: 100 flagged messages in each of 5 chats)")
+    raid = [(-chat, message_id) for chat in range(1, 6) for message_id in range(1, 101)]
+
+    # Before: delete + reply per message, errors swallowed
+    bot = FakeBot(latency=0.002, chat_limit=20, limit_window=60)
+    start = time.perf_counter()
+    failed = 0
+    for chat_id, message_id in raid:
+        for call in (bot.delete_message(chat_id, message_id),
+                     bot.send_message(chat_id, f"⚠️ @user{message_id} slow down! Warning 1/3")):
+            try:
+                await call
+            except Exception:
+                failed += 1
+    print(f"{'direct':<10} {len(bot.calls):>4} calls   {bot.rate_limited:>4} x 429   "
+          f"{failed:>4} actions lost   {time.perf_counter() - start:.2f}s")
+
+    bot = FakeBot(latency=0.002, chat_limit=20, limit_window=60)
+    actions = ActionScheduler()
+    start = time.perf_counter()
+    futures = []
+    for chat_id, message_id in raid:
+        futures.append(actions.delete(chat_id, message_id))
+        futures.append(actions.reply(chat_id, f"⚠️ @user{message_id} slow down! Warning 1/3",
+                                     coalesce='flood'))
+    actions.start(bot)
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    await actions.stop()
+    lost = sum(isinstance(result, Exception) for result in results)
+    print(f"{'scheduled':<10} {len(bot.calls):>4} calls   {bot.rate_limited:>4} x 429   "
+          f"{lost:>4} actions lost   {time.perf_counter() - start:.2f}s")
+
+
+# =================================================================
+# Raid mode sweeps
+# =================================================================
+
+async def bench_raid(args):
+    """Removing a raid message by message vs in one raid-mode sweep"""
+    section("Raid mode (300 messages from 100 raiders in one chat)")
+    chat_id = -1
+    raid = [(1000 + i % 100, i) for i in range(1, 301)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Before: warn, count and maybe ban per message, one API call per action
+        db = Database(os.path.join(tmp, "per_message.db"))
+        await db.initialize()
+        bot = FakeBot(latency=0.002)
+        start = time.perf_counter()
+        for user_id, message_id in raid:
+            await bot.delete_message(chat_id, message_id)
+            if await db.add_warning(user_id, chat_id, f"raider{user_id}", "Flood/Spam", bot.id) >= 3:
+                await bot.ban_chat_member(chat_id, user_id)
+                await db.add_ban(user_id, chat_id, f"raider{user_id}", "Flood/Spam", bot.id, 3600)
+        elapsed = time.perf_counter() - start
+        await db.close()
+        print(f"{'per message':<12} {len(bot.calls):>4} API calls   {elapsed * 1000:>8.0f} ms")
+
+        db = Database(os.path.join(tmp, "sweep.db"))
+        await db.initialize()
+        bot = FakeBot(latency=0.002)
+        actions = ActionScheduler(global_rate=1000, chat_per_minute=6000)
+        actions.start(bot)
+        raid_mode = RaidMode(db, actions, sweep_delay=3600)
+        for user_id, message_id in raid:
+            raid_mode.collect(chat_id, user_id, f"raider{user_id}", message_id)
+        report = await raid_mode.sweep(chat_id)
+        await actions.stop()
+        await db.close()
+        print(f"{'raid sweep':<12} {len(bot.calls):>4} API calls   {report['seconds'] * 1000:>8.0f} ms   "
+              f"({report['messages']} messages, {report['users']} bans, 1 insert)")
+
+
+# =================================================================
+# Batched model classifier
+# =================================================================
+
+async def bench_classifier(args):
+    """Throughput and p99 latency of the micro-batching classifier per batch size"""
+    section("Model classifier micro-batching")
+    corpus = synthetic_corpus(args.messages)
+    if args.model:
+        model = TransformerClassifier()
+    else:
+        # Rough CPU cost shape of a small transformer: fixed per batch + per text
+        model = DummyClassifier(batch_cost=0.004, item_cost=0.0005)
+    print(f"model: {model.model_name}, burst of {len(corpus)} messages")
+
+    for batch_size in (1, 4, 8, 16, 32):
+        classifier = BatchingClassifier(model, max_batch=batch_size, max_wait=0.01)
+        classifier.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(classifier.classify(text) for text in corpus))
+        elapsed = time.perf_counter() - start
+        await classifier.stop()
+
+        latencies = sorted(latency for _, latency in classifier._latencies)
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+        print(f"batch {batch_size:>3}   {len(corpus) / elapsed:>8.0f} msg/s   p99 {p99:>8.1f} ms")
+
+
+# =================================================================
+# Analysis execution modes
+# =================================================================
+
+async def _loop_lag(stop: asyncio.Event, lags: list, interval: float = 0.005):
+    """Record how late a periodic tick fires, i.e. how long the loop was blocked"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def bench_analysis(args):
+    """Throughput and event-loop stall per ANALYSIS_MODE"""
+    section("Analysis execution modes")
+    corpus = synthetic_corpus(args.messages)
+    moderator = AIContentModerator()
+
+    for mode in ('inline', 'thread', 'process'):
+        executor = AnalysisExecutor(moderator, mode=mode)
+        await executor.start()
+
+        stop, lags = asyncio.Event(), []
+        ticker = asyncio.create_task(_loop_lag(stop, lags))
+        start = time.perf_counter()
+        await asyncio.gather(*(executor.analyze(text) for text in corpus))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await ticker
+        await executor.stop()
+
+        print(f"{mode:<10} {len(corpus) / elapsed:>8.0f} msg/s   "
+              f"max loop stall {max(lags, default=0) * 1000:>8.1f} ms")
+
+
+# =================================================================
+# End-to-end replay
+# =================================================================
+
+async def bench_replay(args):
+    """handle_message and admin commands over a generated corpus, per write mode"""
+    section("Replay (generated chat traffic through ModeratorBot)")
+    corpus = generate_corpus(args.messages)
+
+    for label, write_behind, concurrency, latency in (("direct", False, 1, 0.0),
+                                                      ("write-behind", True, 1, 0.0),
+                                                      ("direct x32, 20 ms API", False, 32, 0.02)):
+        result = await replay(corpus, api_latency=latency, concurrency=concurrency,
+                              write_behind=write_behind)
+        print(f"{label:<22} {result['per_second']:>7.0f} updates/s   "
+              f"p50 {result['p50_ms']:>6.2f} ms   p95 {result['p95_ms']:>6.2f} ms   "
+              f"p99 {result['p99_ms']:>6.2f} ms   {result['db_ops_per_update']:.2f} db ops/update")
+
+
+def _replay_shard(corpus, db_path):
+    """Process pool entry point: replay one shard's updates"""
+    return asyncio.run(replay(corpus, db_path=db_path))
+
+
+async def bench_sharding(args):
+    """Replay throughput with chats split over 1, 2 and 4 worker processes"""
+    section(f"Sharded workers ({os.cpu_count()} CPUs, one shared database)")
+    corpus = generate_corpus(args.messages * 2)
+    loop = asyncio.get_running_loop()
+
+    for workers in (1, 2, 4):
+        shards = [[update for update in corpus
+                   if shard_for(update['message']['chat']['id'], workers) == index]
+                  for index in range(workers)]
+        with tempfile.TemporaryDirectory() as tmp, \
+                ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            db_path = os.path.join(tmp, "sharded.db")
+            results = await asyncio.gather(*(
+                loop.run_in_executor(pool, _replay_shard, shard, db_path) for shard in shards
+            ))
+        # Handling time only; process start-up is excluded
+        elapsed = max(result['seconds'] for result in results)
+        handled = sum(result['updates'] for result in results)
+        print(f"{workers} worker(s)   {handled / elapsed:>8.0f} updates/s   "
+              f"slowest shard p99 {max(result['p99_ms'] for result in results):>6.2f} ms")
+
+
+# =================================================================
+# Storage backends
+# =================================================================
+
+async def bench_storage(args):
+    """The same workload against each storage backend"""
+    section("Storage backends")
+    load = synthetic_load(args.messages)
+    backends = [("sqlite", lambda tmp: Database(os.path.join(tmp, "storage.db"))),
+                ("sqlite write-behind",
+                 lambda tmp: Database(os.path.join(tmp, "storage_wb.db"), write_behind=True)),
+                ("memory", lambda tmp: MemoryDatabase())]
+    if Config.POSTGRES_DSN:
+        from postgres_database import PostgresDatabase
+        backends += [("postgres", lambda tmp: PostgresDatabase(Config.POSTGRES_DSN)),
+                     ("postgres write-behind",
+                      lambda tmp: PostgresDatabase(Config.POSTGRES_DSN, write_behind=True))]
+    else:
+        print("(set POSTGRES_DSN to include a postgres server)")
+
+    for label, factory in backends:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = factory(tmp)
+            await db.initialize()
+            hot_path = await _drive_hot_path(db, load)
+
+            start = time.perf_counter()
+            for user_id, chat_id in load:
+                await db.add_warning(user_id, chat_id, "user", "Spam", 0)
+            await db.flush()
+            warnings = len(load) / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await db.add_bans([(user_id, chat_id, "raider") for user_id, chat_id in load[:500]],
+                              "Raid", 0, duration=600)
+            await db.flush()
+            batch_ms = (time.perf_counter() - start) * 1000
+            await db.close()
+        print(f"{label:<22} {hot_path:>8.0f} msg/s   {warnings:>8.0f} warnings/s   "
+              f"500 bans in {batch_ms:>6.1f} ms")
+
+
+# =================================================================
+# Shared state
+# =================================================================
+
+async def bench_shared_state(args):
+    """Per-message flood and admin lookups, in process and in (fake) Redis"""
+    section("Shared state")
+    load = synthetic_load(args.messages)
+    server = FakeRedisServer()
+    await server.start()
+    try:
+        for label, state in (("in-process", InProcessState()), ("redis", RedisState(server.url))):
+            await state.start()
+            for chat_id in {chat_id for _, chat_id in load}:
+                await state.set_admins(chat_id, frozenset({0}))
+
+            start = time.perf_counter()
+            for user_id, chat_id in load:
+                await state.record_message(chat_id, user_id, 10)
+            sequential = len(load) / (time.perf_counter() - start)
+
+            # Concurrent handlers share the connection's pipeline
+            before = state.stats().get('round_trips', 0)
+            start = time.perf_counter()
+            await asyncio.gather(*(state.record_message(chat_id, user_id, 10) for user_id, chat_id in load))
+            concurrent = len(load) / (time.perf_counter() - start)
+            round_trips = (state.stats().get('round_trips', 0) - before) / len(load)
+            await state.close()
+            print(f"{label:<12} {sequential:>8.0f} msg/s sequential   {concurrent:>8.0f} msg/s concurrent   "
+                  f"{round_trips:.2f} round-trips/msg")
+    finally:
+        await server.stop()
+
+
+# =================================================================
+# Record memory
+# =================================================================
+
+class DictModerator(AIContentModerator):
+    """Analysis results as the dicts they used to be"""
+
+    def _create_result(self, is_toxic, is_spam, has_profanity, confidence, reason, should_flag=False):
+        return {'is_toxic': is_toxic, 'is_spam': is_spam, 'has_profanity': has_profanity,
+                'confidence': confidence, 'reason': reason, 'should_flag': should_flag}
+
+
+def _bytes_per_item(build, n: int) -> float:
+    """Memory still allocated after building n items, per item"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [build(i) for i in range(n)]
+    per_item = (tracemalloc.get_traced_memory()[0] - before) / n
+    tracemalloc.stop()
+    del items
+    return per_item
+
+
+async def bench_records(args):
+    """Allocation per analyzed message and per stored row, dicts vs slotted records"""
+    section("Record memory (bytes per item)")
+    n = args.messages * 10
+    # Distinct reasons, as a cache of real verdicts would hold
+    reasons = [f"Contains toxic keyword: word{i}" for i in range(n)]
+    dicts, records = DictModerator(), AIContentModerator()
+    config = asdict(default_chat_config(0))
+    row = (1, 12345, 67890, "user", "Spam", 99999, "2025-01-01 00:00:00")
+    columns = ('id', 'user_id', 'chat_id', 'username', 'reason', 'warned_by', 'timestamp')
+
+    rows = [
+        ("analysis result",
+         lambda i: dicts._create_result(True, False, False, 0.3, reasons[i], True),
+         lambda i: records._create_result(True, False, False, 0.3, reasons[i], True)),
+        ("chat config",
+         lambda i: MappingProxyType(dict(config, chat_id=i)),
+         lambda i: replace(default_chat_config(0), chat_id=i)),
+        ("warning row",
+         lambda i: dict(zip(columns, row)),
+         lambda i: WarningRecord(*row)),
+    ]
+    for label, legacy, compact in rows:
+        before, after = _bytes_per_item(legacy, n), _bytes_per_item(compact, n)
+        print(f"{label:<16} dict {before:>6.0f} B   record {after:>6.0f} B   "
+              f"({1 - after / before:.0%} less)")
+
+    # Whole analysis, keeping every verdict the way the verdict cache does
+    corpus = [f"{text} #{i}" for i, text in enumerate(synthetic_corpus(args.messages))]
+    for moderator in (dicts, records):
+        for text in corpus[:50]:
+            moderator.analyze_message(text)
+    before = _bytes_per_item(lambda i: dicts.analyze_message(corpus[i]), len(corpus))
+    after = _bytes_per_item(lambda i: records.analyze_message(corpus[i]), len(corpus))
+    print(f"{'per message':<16} dict {before:>6.0f} B   record {after:>6.0f} B   "
+          f"({1 - after / before:.0%} less)")
+
+
+# =================================================================
+# Metrics
+# =================================================================
+
+async def bench_metrics(args):
+    """Per-observation overhead of the latency histograms and scrape cost"""
+    section("Metrics overhead")
+    registry = Registry()
+    histogram = registry.histogram('bench_seconds', "Benchmark latency", ['phase'])
+    n = args.messages * 100
+
+    start = time.perf_counter()
+    for _ in range(n):
+        pass
+    baseline = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(n):
+        histogram.observe(0.001, 'db')
+    observe = (time.perf_counter() - start - baseline) / n
+
+    start = time.perf_counter()
+    for _ in range(n):
+        with histogram.time('db'):
+            pass
+    timer = (time.perf_counter() - start - baseline) / n
+
+    # Roughly what the bot exports: a dozen timed phases and DB methods
+    for phase in range(12):
+        histogram.observe(0.001, f"phase{phase}")
+    start = time.perf_counter()
+    for _ in range(100):
+        text = registry.render()
+    render = (time.perf_counter() - start) / 100
+
+    print(f"observe()        {observe * 1e9:>8.0f} ns")
+    print(f"time() block     {timer * 1e9:>8.0f} ns")
+    print(f"scrape           {render * 1000:>8.2f} ms ({len(text)} bytes)")
+
+
+SCENARIOS = {
+    'connections': bench_connections,
+    'writes': bench_writes,
+    'indexes': bench_indexes,
+    'maintenance': bench_maintenance,
+    'rules': bench_rules,
+    'stages': bench_stages,
+    'verdicts': bench_verdicts,
+    'campaigns': bench_campaigns,
+    'dispatch': bench_dispatch,
+    'actions': bench_actions,
+    'raid': bench_raid,
+    'classifier': bench_classifier,
+    'analysis': bench_analysis,
+    'replay': bench_replay,
+    'sharding': bench_sharding,
+    'storage': bench_storage,
+    'shared_state': bench_shared_state,
+    'records': bench_records,
+    'metrics': bench_metrics,
+}
+
+
+async def main():
+    """Main benchmark runner"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scenario', nargs='*',
+                        help=f"one of: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--messages', type=int, default=2000,
+                        help="synthetic messages per scenario")
+    parser.add_argument('--rows', type=lambda v: [int(n) for n in v.split(',')],
+                        default=[10000, 1000000, 10000000],
+                        help="comma-separated warning table sizes for 'indexes'")
+    parser.add_argument('--model', action='store_true',
+                        help="use the real AI_MODEL_NAME transformer in 'classifier'")
+    args = parser.parse_args()
+
+    unknown = set(args.scenario) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    for name in args.scenario or SCENARIOS:
+        await SCENARIOS[name](args)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(1)
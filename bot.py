@@ -2,11 +2,15 @@
 Main Telegram Moderator Bot
 Modern 2025 implementation with AI-powered moderation
 """
+import asyncio
 import logging
-from typing import Optional
+import signal
+import time
+from typing import Optional, Tuple
 from telegram import Update, ChatMember
 from telegram.ext import (
     Application,
+    ChatMemberHandler,
     CommandHandler,
     MessageHandler,
     filters,
@@ -15,9 +19,23 @@ from telegram.ext import (
 from telegram.error import TelegramError
 
 from config import Config
-from database import Database
+from records import AnalysisResult, ChatConfig
+from storage import Storage, create_storage
 from ai_moderator import AIContentModerator
+from action_scheduler import ActionScheduler, SchedulerStopped
 from admin_commands import AdminCommands
+from analysis_executor import AnalysisExecutor
+from ban_expiry import BanExpiryScheduler
+from campaign_detector import CampaignDetector
+from maintenance import Maintenance
+from metrics import REGISTRY, MetricsServer
+from raid_mode import RaidMode
+from shared_state import create_shared_state
+from sharding import ShardedBot, shard_for
+from toxicity_classifier import BatchingClassifier, load_classifier
+from update_processor import KeyedUpdateProcessor
+from verdict_cache import VerdictCache
+from webhook_server import WebhookServer
 
 # Configure logging
 logging.basicConfig(
@@ -26,24 +44,68 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+HANDLER_SECONDS = REGISTRY.histogram(
+    'moderator_handler_seconds', "handle_message latency, in total and per phase", ['phase']
+)
+
 
 class ModeratorBot:
     """Main bot class"""
     
-    def __init__(self):
-        """Initialize the bot"""
+    def __init__(self, db: Optional[Storage] = None, shard: Tuple[int, int] = (0, 1)):
+        """
+        Initialize the bot
+        
+        Args:
+            db: Storage to use instead of the configured backend
+            shard: (index, count) when this process is one of several workers
+        """
         Config.validate()
         
-        self.db = Database()
+        self.shard = shard
+        # Flood windows, admin lists and write-behind warning counts
+        self.state = create_shared_state()
+        self.db = db or create_storage(state=self.state)
         self.ai_moderator = AIContentModerator()
-        self.admin_commands = AdminCommands(self.db)
+        self.analyzer = AnalysisExecutor(self.ai_moderator)
+        self.admin_commands = AdminCommands(self.db, self.state)
+        self.classifier: Optional[BatchingClassifier] = None
+        if Config.ENABLE_MODEL_CLASSIFIER:
+            self.classifier = BatchingClassifier(load_classifier())
+        self.verdict_cache = VerdictCache(version=self._verdict_version)
+        # Telegram's global limit is per bot token, so workers split it
+        self.actions = ActionScheduler(global_rate=Config.API_GLOBAL_PER_SECOND / shard[1])
+        self.ban_expiry = BanExpiryScheduler(self.db, self.actions, owns=self.owns_chat)
+        self.maintenance = Maintenance(self.db)
+        self.raid = RaidMode(self.db, self.actions, expiry=self.ban_expiry)
+        self.campaign_detector: Optional[CampaignDetector] = None
+        if Config.ENABLE_CAMPAIGN_DETECTION:
+            self.campaign_detector = CampaignDetector()
+        
+        self.update_processor = KeyedUpdateProcessor()
+        self.webhook_server: Optional[WebhookServer] = None
+        self.metrics_server: Optional[MetricsServer] = None
         
         # Build application
-        self.app = Application.builder().token(Config.BOT_TOKEN).build()
+        self.app = (
+            Application.builder()
+            .token(Config.BOT_TOKEN)
+            .concurrent_updates(self.update_processor)
+            .build()
+        )
         
         # Register handlers
         self._register_handlers()
     
+    def owns_chat(self, chat_id: int) -> bool:
+        """Whether this worker handles `chat_id` (always, unless sharded)"""
+        return shard_for(chat_id, self.shard[1]) == self.shard[0]
+    
+    def _verdict_version(self):
+        """Cached verdicts are only valid for the current rules and model"""
+        model = self.classifier.model.model_name if self.classifier else None
+        return self.ai_moderator.rules_version, model
+    
     def _register_handlers(self):
         """Register all command and message handlers"""
         
@@ -57,6 +119,7 @@ class ModeratorBot:
         self.app.add_handler(CommandHandler("kick", self.cmd_kick))
         self.app.add_handler(CommandHandler("mute", self.cmd_mute))
         self.app.add_handler(CommandHandler("unmute", self.cmd_unmute))
+        self.app.add_handler(CommandHandler("raid", self.cmd_raid))
         
         # Configuration commands
         self.app.add_handler(CommandHandler("setwarnlimit", self.admin_commands.set_warn_limit))
@@ -79,6 +142,12 @@ class ModeratorBot:
             filters.StatusUpdate.NEW_CHAT_MEMBERS,
             self.handle_new_member
         ))
+        
+        # Admin promotions/demotions keep the admin cache fresh
+        self.app.add_handler(ChatMemberHandler(
+            self.admin_commands.handle_chat_member_update,
+            ChatMemberHandler.ANY_CHAT_MEMBER
+        ))
     
     async def cmd_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
@@ -121,6 +190,7 @@ Version: {Config.BOT_VERSION}
 /mute - Mute a user temporarily
 /unmute - Unmute a user
 /unban - Unban a user
+/raid [on [minutes]|off] - Raid mode: remove offenders in bulk
 
 **⚙️ Configuration Commands (Admin Only):**
 /setwarnlimit <number> - Set warnings before ban
@@ -163,33 +233,30 @@ Users will be warned automatically, and after reaching the warning limit, they w
         reason = ' '.join(context.args) if context.args else "No reason provided"
         
         # Add warning
-        await self.db.add_warning(
+        warn_count = await self.db.add_warning(
             target_user.id,
             update.effective_chat.id,
             target_user.username or target_user.first_name,
             reason,
             update.effective_user.id
         )
-        
-        # Get warning count
         config = await self.db.get_chat_config(update.effective_chat.id)
-        warn_count = await self.db.get_warning_count(target_user.id, update.effective_chat.id)
         
         # Send warning message
         await update.message.reply_text(
             f"⚠️ User @{target_user.username or target_user.first_name} has been warned!\n"
             f"Reason: {reason}\n"
-            f"Warnings: {warn_count}/{config['warn_limit']}"
+            f"Warnings: {warn_count}/{config.warn_limit}"
         )
         
         # Check if should ban
-        if warn_count >= config['warn_limit']:
+        if warn_count >= config.warn_limit:
             await self._ban_user(
                 update,
                 context,
                 target_user,
                 f"Exceeded warning limit ({warn_count} warnings)",
-                config['ban_duration']
+                config.ban_duration
             )
     
     async def cmd_unwarn(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -246,6 +313,8 @@ Users will be warned automatically, and after reaching the warning limit, they w
         
         try:
             await context.bot.unban_chat_member(update.effective_chat.id, target_user_id)
+            await self.db.remove_ban(target_user_id, update.effective_chat.id)
+            self.ban_expiry.cancel(update.effective_chat.id, target_user_id)
             await update.message.reply_text(f"✅ User has been unbanned")
         except TelegramError as e:
             await update.message.reply_text(f"❌ Error: {str(e)}")
@@ -335,8 +404,52 @@ Users will be warned automatically, and after reaching the warning limit, they w
         except TelegramError as e:
             await update.message.reply_text(f"❌ Error: {str(e)}")
     
+    async def cmd_raid(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show or switch raid mode"""
+        if not await self.admin_commands.is_admin(update, context):
+            await update.message.reply_text("❌ This command is only for admins.")
+            return
+        
+        chat_id = update.effective_chat.id
+        action = context.args[0].lower() if context.args else 'status'
+        
+        if action == 'on':
+            try:
+                minutes = float(context.args[1]) if len(context.args) > 1 else None
+            except ValueError:
+                await update.message.reply_text("Usage: /raid [on [minutes]|off]")
+                return
+            self.raid.activate(chat_id, minutes * 60 if minutes else None)
+            await update.message.reply_text(
+                f"🛡️ Raid mode ON for {self.raid.remaining(chat_id) / 60:.0f} min: "
+                f"flagged users are banned in bulk"
+            )
+        elif action == 'off':
+            self.raid.deactivate(chat_id)
+            report = await self.raid.sweep(chat_id)
+            await update.message.reply_text(
+                f"✅ Raid mode OFF (last sweep: {report['messages']} messages, {report['users']} users)"
+            )
+        elif action == 'status':
+            messages, users = self.raid.pending(chat_id)
+            report = self.raid.reports.get(chat_id)
+            status = (f"ON, {self.raid.remaining(chat_id) / 60:.0f} min left"
+                      if self.raid.is_active(chat_id) else "OFF")
+            text = f"🛡️ Raid mode: {status}\nPending: {messages} messages, {users} users"
+            if report:
+                text += (f"\nLast sweep: {report['messages']} messages, {report['users']} users "
+                         f"in {report['seconds'] * 1000:.0f} ms")
+            await update.message.reply_text(text)
+        else:
+            await update.message.reply_text("Usage: /raid [on [minutes]|off]")
+    
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle incoming messages for moderation"""
+        with HANDLER_SECONDS.time('total'):
+            await self._moderate_message(update, context)
+    
+    async def _moderate_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Moderation pipeline of one message, with each phase timed"""
         if not update.message or not update.effective_user:
             return
         
@@ -344,179 +457,370 @@ Users will be warned automatically, and after reaching the warning limit, they w
         if update.effective_user.is_bot:
             return
         
-        # Skip admin messages
-        if await self.admin_commands.is_admin(update, context):
-            return
-        
         user_id = update.effective_user.id
         chat_id = update.effective_chat.id
         
-        # Track message for flood detection
-        await self.db.track_message(user_id, chat_id)
-        
         # Get chat config
-        config = await self.db.get_chat_config(chat_id)
+        with HANDLER_SECONDS.time('db'):
+            config = await self.db.get_chat_config(chat_id)
         
-        # Check for flood
-        recent_msgs = await self.db.get_recent_message_count(
-            user_id, chat_id, config['flood_time_window']
-        )
+        # Track the message; the chat's admin list comes back with the count
+        with HANDLER_SECONDS.time('shared_state'):
+            recent_msgs, admins = await self.state.record_message(
+                chat_id, user_id, config.flood_time_window
+            )
         
+        # Skip admin messages
+        with HANDLER_SECONDS.time('admin_check'):
+            is_admin = await self.admin_commands.is_admin(update, context, admins=admins)
+        if is_admin:
+            return
+        
+        # Check for flood
         if self.ai_moderator.check_user_behavior(
             recent_msgs, 
-            config['flood_time_window'], 
-            config['flood_threshold']
+            config.flood_time_window, 
+            config.flood_threshold
         ):
             await self._handle_flood(update, context, config)
             return
         
+        # Cross-chat campaigns: every message feeds the sketches
+        if self.campaign_detector and update.message.text:
+            with HANDLER_SECONDS.time('analysis'):
+                campaign = self.campaign_detector.observe(chat_id, user_id, update.message.text)
+            if campaign and config.enable_ai_moderation:
+                analysis = self.ai_moderator.campaign_result(campaign)
+                await self._handle_flagged_message(update, context, analysis, config)
+                return
+        
         # AI moderation
-        if config['enable_ai_moderation'] and update.message.text:
-            analysis = self.ai_moderator.analyze_message(update.message.text)
+        if config.enable_ai_moderation and update.message.text:
+            with HANDLER_SECONDS.time('analysis'):
+                analysis = await self._analyze(update.message.text)
             
-            if analysis['should_flag']:
+            if analysis.should_flag:
                 await self._handle_flagged_message(update, context, analysis, config)
     
+    async def _analyze(self, text: str) -> AnalysisResult:
+        """Full verdict for a message text, reusing cached verdicts for repeats"""
+        analysis = self.verdict_cache.get(text)
+        if analysis is not None:
+            return analysis
+        
+        analysis = await self.analyzer.analyze(text)
+        
+        # Model stage only for messages the rules consider clean
+        if not analysis.should_flag and self.classifier:
+            score = await self.classifier.classify(text)
+            analysis = self.ai_moderator.apply_model_score(analysis, score)
+        
+        self.verdict_cache.put(text, analysis)
+        return analysis
+    
     async def handle_new_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle new members joining"""
-        config = await self.db.get_chat_config(update.effective_chat.id)
+        chat_id = update.effective_chat.id
+        if self.raid.record_joins(chat_id, len(update.message.new_chat_members)):
+            self.actions.reply(chat_id, "🛡️ Join spike detected, raid mode enabled", coalesce='raid')
+        if self.raid.is_active(chat_id):
+            # No greetings for raiders
+            return
+        
+        config = await self.db.get_chat_config(chat_id)
         
-        if config.get('welcome_message'):
-            await update.message.reply_text(config['welcome_message'])
+        # Coalesced: a wave of joins gets one welcome and one greeting
+        if config.welcome_message:
+            self.actions.reply(chat_id, config.welcome_message, coalesce='welcome')
         
         # Show rules if available
-        if config.get('rules'):
+        if config.rules:
             for new_member in update.message.new_chat_members:
-                await update.message.reply_text(
+                self.actions.reply(
+                    chat_id,
                     f"Welcome @{new_member.username or new_member.first_name}! "
-                    f"Please read our rules: /rules"
+                    f"Please read our rules: /rules",
+                    coalesce='greeting'
                 )
     
     async def _ban_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
                        target_user, reason: str, duration: Optional[int] = None):
         """Ban a user"""
+        chat_id = update.effective_chat.id
         try:
-            await context.bot.ban_chat_member(
-                update.effective_chat.id,
-                target_user.id
-            )
+            with HANDLER_SECONDS.time('telegram_api'):
+                if duration:
+                    # Telegram lifts it too if the bot is down when it expires
+                    await self.actions.ban(chat_id, target_user.id, until_date=int(time.time() + duration))
+                else:
+                    await self.actions.ban(chat_id, target_user.id)
             
             # Record ban
-            await self.db.add_ban(
-                target_user.id,
-                update.effective_chat.id,
-                target_user.username or target_user.first_name,
-                reason,
-                update.effective_user.id,
-                duration
-            )
+            with HANDLER_SECONDS.time('db'):
+                await self.db.add_ban(
+                    target_user.id,
+                    update.effective_chat.id,
+                    target_user.username or target_user.first_name,
+                    reason,
+                    update.effective_user.id,
+                    duration
+                )
+            self.ban_expiry.schedule(chat_id, target_user.id, duration)
             
             ban_type = "temporarily banned" if duration else "permanently banned"
             time_info = f" for {duration // 3600}h" if duration else ""
             
-            await update.message.reply_text(
+            self.actions.reply(
+                chat_id,
                 f"🚫 @{target_user.username or target_user.first_name} has been {ban_type}{time_info}!\n"
-                f"Reason: {reason}"
+                f"Reason: {reason}",
+                coalesce='bans'
             )
         except TelegramError as e:
-            await update.message.reply_text(f"❌ Error banning user: {str(e)}")
+            self.actions.reply(chat_id, f"❌ Error banning user: {str(e)}")
+        except SchedulerStopped:
+            # Shutting down; nobody is left to send a reply either
+            logger.warning(f"Ban of {target_user.id} in {chat_id} dropped at shutdown")
+    
+    def _collect_raid_offender(self, update: Update) -> bool:
+        """Count the offence; in raid mode queue it for the next bulk sweep"""
+        chat_id = update.effective_chat.id
+        if self.raid.record_flag(chat_id):
+            self.actions.reply(chat_id, "🛡️ Flag spike detected, raid mode enabled", coalesce='raid')
+        if not self.raid.is_active(chat_id):
+            return False
+        
+        user = update.effective_user
+        self.raid.collect(chat_id, user.id, user.username or user.first_name,
+                          update.message.message_id)
+        return True
     
-    async def _handle_flood(self, update: Update, context: ContextTypes.DEFAULT_TYPE, config):
+    async def _handle_flood(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                            config: ChatConfig):
         """Handle flood detection"""
+        if self._collect_raid_offender(update):
+            return
+        
         user = update.effective_user
         
         # Delete the message
-        try:
-            await update.message.delete()
-        except:
-            pass
+        self.actions.delete(update.effective_chat.id, update.message.message_id)
         
         # Warn the user
-        await self.db.add_warning(
-            user.id,
-            update.effective_chat.id,
-            user.username or user.first_name,
-            "Flood/Spam (too many messages)",
-            context.bot.id
-        )
-        
-        warn_count = await self.db.get_warning_count(user.id, update.effective_chat.id)
+        with HANDLER_SECONDS.time('db'):
+            warn_count = await self.db.add_warning(
+                user.id,
+                update.effective_chat.id,
+                user.username or user.first_name,
+                "Flood/Spam (too many messages)",
+                context.bot.id
+            )
         
         # Check if should ban
-        if warn_count >= config['warn_limit']:
+        if warn_count >= config.warn_limit:
             await self._ban_user(
                 update,
                 context,
                 user,
                 f"Flood/Spam - {warn_count} warnings",
-                config['ban_duration']
+                config.ban_duration
             )
         else:
-            await update.message.reply_text(
+            self.actions.reply(
+                update.effective_chat.id,
                 f"⚠️ @{user.username or user.first_name} slow down! "
-                f"Warning {warn_count}/{config['warn_limit']}"
+                f"Warning {warn_count}/{config.warn_limit}",
+                coalesce='flood'
             )
     
     async def _handle_flagged_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
-                                     analysis: dict, config):
+                                     analysis: AnalysisResult, config: ChatConfig):
         """Handle AI-flagged message"""
+        if self._collect_raid_offender(update):
+            return
+        
         user = update.effective_user
         
         # Delete the message if spam
-        if analysis['is_spam'] or analysis['has_profanity']:
-            try:
-                await update.message.delete()
-            except:
-                pass
+        if analysis.is_spam or analysis.has_profanity:
+            self.actions.delete(update.effective_chat.id, update.message.message_id)
         
         # Add warning
-        await self.db.add_warning(
-            user.id,
-            update.effective_chat.id,
-            user.username or user.first_name,
-            f"AI Detection: {analysis['reason']}",
-            context.bot.id
-        )
-        
-        warn_count = await self.db.get_warning_count(user.id, update.effective_chat.id)
+        with HANDLER_SECONDS.time('db'):
+            warn_count = await self.db.add_warning(
+                user.id,
+                update.effective_chat.id,
+                user.username or user.first_name,
+                f"AI Detection: {analysis.reason}",
+                context.bot.id
+            )
         
         # Check if should ban
-        if warn_count >= config['warn_limit']:
+        if warn_count >= config.warn_limit:
             await self._ban_user(
                 update,
                 context,
                 user,
                 f"Multiple violations - {warn_count} warnings",
-                config['ban_duration']
+                config.ban_duration
             )
         else:
-            await update.message.reply_text(
+            self.actions.reply(
+                update.effective_chat.id,
                 f"⚠️ @{user.username or user.first_name} your message was flagged!\n"
-                f"Reason: {analysis['reason']}\n"
-                f"Warning {warn_count}/{config['warn_limit']}"
+                f"Reason: {analysis.reason}\n"
+                f"Warning {warn_count}/{config.warn_limit}",
+                coalesce='flagged'
             )
     
+    def _collect_metrics(self):
+        """Counters the components keep anyway, read when metrics are scraped"""
+        stages = self.ai_moderator.stage_stats()
+        yield ('moderator_stage_runs_total', 'counter', "Analysis stage runs",
+               [({'stage': name}, stats['runs']) for name, stats in stages.items()])
+        yield ('moderator_stage_skips_total', 'counter', "Analysis stages skipped by early exit",
+               [({'stage': name}, stats['skips']) for name, stats in stages.items()])
+        yield ('moderator_stage_seconds_total', 'counter', "Time spent in each analysis stage",
+               [({'stage': name}, stats['runs'] * stats['avg_us'] / 1e6) for name, stats in stages.items()])
+        
+        caches = {name: cache.stats() for name, cache in self.state.caches().items()}
+        if self.db.state is not None and self.db.state is not self.state:
+            caches.update((name, cache.stats()) for name, cache in self.db.state.caches().items())
+        caches['chat_config'] = self.db.config_cache.stats()
+        caches['verdict'] = self.verdict_cache.stats()
+        for field, kind, help_text in (('hits', 'counter', "Cache hits"),
+                                       ('misses', 'counter', "Cache misses"),
+                                       ('hit_ratio', 'gauge', "Cache hit ratio since start"),
+                                       ('size', 'gauge', "Cached entries")):
+            name = f"moderator_cache_{field}" + ('_total' if kind == 'counter' else '')
+            yield (name, kind, help_text,
+                   [({'cache': cache}, stats[field]) for cache, stats in caches.items()])
+        
+        shared = self.state.stats()
+        if 'round_trips' in shared:
+            yield ('moderator_shared_state_round_trips_total', 'counter', "Requests sent to Redis",
+                   [({}, shared['round_trips'])])
+            yield ('moderator_shared_state_errors_total', 'counter',
+                   "Redis requests that failed over to in-process state", [({}, shared['errors'])])
+        
+        analysis = self.analyzer.stats()
+        updates = self.update_processor.stats()
+        depths = {
+            'analysis_waiting': analysis['waiting'],
+            'analysis_in_flight': analysis['in_flight'],
+            'updates_running': updates['running'],
+            'updates_busy_keys': updates['busy_keys'],
+            'actions_pending': self.actions.pending(),
+            'ban_expiries': self.ban_expiry.pending(),
+        }
+        if self.db.write_queue:
+            depths['write_behind'] = self.db.write_queue.depth
+        if self.webhook_server:
+            depths['webhook'] = self.webhook_server.queue.qsize()
+        yield ('moderator_queue_depth', 'gauge', "Items waiting or in flight per queue",
+               [({'queue': queue}, depth) for queue, depth in depths.items()])
+        
+        actions = self.actions.stats()
+        yield ('moderator_api_calls_total', 'counter', "Telegram API calls sent by the action scheduler",
+               [({'action': kind}, count) for kind, count in actions['calls'].items()])
+        yield ('moderator_api_rate_limited_total', 'counter', "429 responses from Telegram",
+               [({}, actions['rate_limited'])])
+        yield ('moderator_actions_coalesced_total', 'counter', "Actions merged into pending ones",
+               [({}, actions['coalesced'])])
+        yield ('moderator_rows_purged_total', 'counter', "Rows removed by database maintenance",
+               [({}, self.maintenance.total_purged)])
+    
     async def post_init(self, application: Application):
         """Initialize database after app starts"""
         await self.db.initialize()
         logger.info("Database initialized")
+        await self.state.start()
+        # Registered only while running, so bots built for tests and replays
+        # don't pile duplicate families into the global registry
+        REGISTRY.register(self._collect_metrics)
+        await self.admin_commands.warm_start()
+        await self.analyzer.start()
+        self.actions.start(application.bot)
+        await self.ban_expiry.start()
+        # One worker is enough to look after the shared database
+        if self.shard[0] == 0:
+            self.maintenance.start()
+        if Config.ENABLE_METRICS:
+            self.metrics_server = MetricsServer()
+            await self.metrics_server.start(port=Config.METRICS_PORT + self.shard[0])
+        if self.classifier:
+            self.classifier.start()
+            logger.info(f"Model classifier started ({self.classifier.model.model_name})")
+    
+    async def post_shutdown(self, application: Application):
+        """Close database connections after the app stops"""
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        REGISTRY.unregister(self._collect_metrics)
+        await self.maintenance.stop()
+        await self.raid.stop()
+        await self.ban_expiry.stop()
+        await self.actions.stop()
+        if self.classifier:
+            await self.classifier.stop()
+        await self.analyzer.stop()
+        await self.db.close()
+        logger.info("Database closed")
+        await self.state.close()
     
     def run(self):
         """Run the bot"""
         logger.info(f"Starting {Config.BOT_NAME} v{Config.BOT_VERSION}")
         
-        # Add post init callback
+        # Add lifecycle callbacks
         self.app.post_init = self.post_init
+        self.app.post_shutdown = self.post_shutdown
         
         # Run bot
-        self.app.run_polling(allowed_updates=Update.ALL_TYPES)
+        if Config.RUN_MODE == 'webhook':
+            asyncio.run(self._run_webhook())
+        else:
+            self.app.run_polling(allowed_updates=Update.ALL_TYPES)
+    
+    async def _run_webhook(self):
+        """Receive updates through the embedded webhook server until stopped"""
+        server = self.webhook_server = WebhookServer(
+            self.app.update_queue,
+            decode=lambda data: Update.de_json(data, self.app.bot),
+        )
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        
+        async with self.app:
+            await self.post_init(self.app)
+            try:
+                await server.start()
+                await self.app.bot.set_webhook(
+                    Config.WEBHOOK_URL,
+                    allowed_updates=Update.ALL_TYPES,
+                    secret_token=Config.WEBHOOK_SECRET_TOKEN,
+                    max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                )
+                await self.app.start()
+                logger.info(f"Webhook set to {Config.WEBHOOK_URL}")
+                await stop.wait()
+            finally:
+                await server.stop()
+                if self.app.running:
+                    await self.app.stop()
+                await self.post_shutdown(self.app)
 
 
 def main():
     """Main entry point"""
     try:
-        bot = ModeratorBot()
-        bot.run()
+        if Config.WORKERS > 1:
+            ShardedBot().run()
+        else:
+            bot = ModeratorBot()
+            bot.run()
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
@@ -0,0 +1,260 @@
+"""
+Cross-chat spam campaign detection module
+Fixed-memory streaming sketches of recent message fingerprints and URLs
+"""
+import hashlib
+import re
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+from cache import TTLCache
+from config import Config
+from verdict_cache import normalize_for_similarity
+
+_URL = re.compile(r'https?://[^\s<>"]+', re.IGNORECASE)
+
+
+def _digest(key: bytes) -> Tuple[int, int]:
+    """Two independent 64-bit hashes for double hashing"""
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+
+
+class CountMinSketch:
+    """Count-Min sketch; sketches of equal shape can be subtracted"""
+
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('I', bytes(4 * width)) for _ in range(depth)]
+
+    def cells(self, key: bytes) -> List[int]:
+        """Counter index per row; sketches of equal shape can share them"""
+        h1, h2 = _digest(key)
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, cells: List[int]):
+        for row, cell in zip(self.rows, cells):
+            row[cell] += 1
+
+    def estimate(self, cells: List[int]) -> int:
+        return min(row[cell] for row, cell in zip(self.rows, cells))
+
+    def subtract(self, other: 'CountMinSketch'):
+        """Remove another sketch's counts, e.g. an expired time slice"""
+        for row, expired in zip(self.rows, other.rows):
+            for i, count in enumerate(expired):
+                if count:
+                    row[i] -= count
+
+    def clear(self):
+        for row in self.rows:
+            row[:] = array('I', bytes(4 * self.width))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter"""
+
+    def __init__(self, bits: int, hashes: int):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray((bits + 7) // 8)
+
+    def positions(self, key: bytes) -> List[int]:
+        """Bit positions of a key; filters of equal size can share them"""
+        h1, h2 = _digest(key)
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def contains(self, positions: List[int]) -> bool:
+        data = self.data
+        return all(data[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def add(self, positions: List[int]):
+        for p in positions:
+            self.data[p >> 3] |= 1 << (p & 7)
+
+    def clear(self):
+        self.data[:] = bytes(len(self.data))
+
+
+class _SubWindow:
+    """One time slice: distinct chat/user counts added during it"""
+
+    def __init__(self, width: int, depth: int, bloom_bits: int):
+        self.epoch = -1
+        self.chats = CountMinSketch(width, depth)
+        self.users = CountMinSketch(width, depth)
+        self.seen = BloomFilter(bloom_bits, 4)
+
+    def clear(self):
+        self.epoch = -1
+        self.chats.clear()
+        self.users.clear()
+        self.seen.clear()
+
+
+class CampaignDetector:
+    """
+    Flags content that shows up in many chats or from many users at once.
+
+    Every message contributes fingerprints: one per URL and, for longer
+    texts, one for the normalized content. Each fingerprint counts distinct
+    chats and distinct users over a sliding window made of `subwindows`
+    time slices; a Bloom filter of (fingerprint, chat) and (fingerprint,
+    user) pairs keeps repeats from inflating the counts, and a running total
+    sketch has each slice subtracted when it expires. A Space-Saving table
+    tracks the heaviest fingerprints for reporting; its counts are re-read
+    from the sketch as slices expire, and fingerprints not seen for a whole
+    window leave it. Memory is fixed by the sketch dimensions, whatever the
+    traffic.
+    """
+
+    def __init__(self, chat_threshold: int = Config.CAMPAIGN_CHAT_THRESHOLD,
+                 user_threshold: int = Config.CAMPAIGN_USER_THRESHOLD,
+                 window: float = Config.CAMPAIGN_WINDOW,
+                 width: int = Config.CAMPAIGN_SKETCH_WIDTH,
+                 depth: int = 4, subwindows: int = 4,
+                 bloom_bits: int = 1 << 17, heavy_hitters: int = 32,
+                 min_words: int = Config.CAMPAIGN_MIN_WORDS):
+        self.chat_threshold = chat_threshold
+        self.user_threshold = user_threshold
+        self.window = window
+        self.min_words = min_words
+        self._slice = window / subwindows
+        self._windows = [_SubWindow(width, depth, bloom_bits) for _ in range(subwindows)]
+        # Sums of the live slices
+        self._chats = CountMinSketch(width, depth)
+        self._users = CountMinSketch(width, depth)
+
+        # Space-Saving top-k: fingerprint -> [chats, users, label, cells, last epoch seen]
+        self.heavy_hitters = heavy_hitters
+        self._top: Dict[bytes, List[Any]] = {}
+        self._floor = 0
+        # Campaigns already detected stay flagged for a window
+        self._now = 0.0
+        self._flagged = TTLCache(heavy_hitters * 8, window, clock=lambda: self._now)
+
+        # Metrics
+        self.observed = 0
+        self.campaigns_flagged = 0
+
+    def _rotate(self, now: float) -> Tuple[_SubWindow, List[_SubWindow]]:
+        """Expire old slices; return the current slice and every live one"""
+        epoch = int(now // self._slice)
+        oldest = epoch - len(self._windows) + 1
+        current = self._windows[epoch % len(self._windows)]
+        if current.epoch == epoch:
+            return current, [w for w in self._windows if w.epoch >= oldest]
+
+        for window in self._windows:
+            if window.epoch != -1 and (window.epoch < oldest or window is current):
+                self._chats.subtract(window.chats)
+                self._users.subtract(window.users)
+                window.clear()
+        current.epoch = epoch
+        self._floor = 0
+        self._age_heavy_hitters(oldest)
+        return current, [w for w in self._windows if w.epoch >= oldest]
+
+    def _age_heavy_hitters(self, oldest: int):
+        """Drop fingerprints last seen before the window, recount the rest"""
+        for fingerprint, entry in list(self._top.items()):
+            if entry[4] < oldest:
+                del self._top[fingerprint]
+            else:
+                entry[0], entry[1] = self._chats.estimate(entry[3]), self._users.estimate(entry[3])
+
+    def fingerprints(self, text: str) -> List[Tuple[bytes, str]]:
+        """(fingerprint, label) pairs for the URLs and content of a message"""
+        found = []
+        for url in _URL.findall(text or ''):
+            url = url.rstrip('.,!?)').lower()
+            found.append((b'u' + hashlib.blake2b(url.encode(), digest_size=8).digest(), url))
+
+        content = normalize_for_similarity(text or '')
+        if content.count(' ') + 1 >= self.min_words:
+            found.append((b'c' + hashlib.blake2b(content.encode(), digest_size=8).digest(),
+                          content[:60]))
+        return found
+
+    def _count_distinct(self, current: _SubWindow, live: List[_SubWindow],
+                        fingerprint: bytes, cells: List[int], tag: bytes, member: int,
+                        slice_sketch: CountMinSketch, total: CountMinSketch) -> int:
+        positions = current.seen.positions(fingerprint + tag + member.to_bytes(8, 'big', signed=True))
+        if not any(w.seen.contains(positions) for w in live):
+            current.seen.add(positions)
+            slice_sketch.add(cells)
+            total.add(cells)
+        return total.estimate(cells)
+
+    def _track_heavy_hitter(self, fingerprint: bytes, cells: List[int], epoch: int,
+                            chats: int, users: int, label: str):
+        entry = self._top.get(fingerprint)
+        if entry is not None:
+            entry[0], entry[1], entry[4] = chats, users, epoch
+            return
+        if len(self._top) >= self.heavy_hitters:
+            if chats + users <= self._floor:
+                return
+            weakest = min(self._top, key=lambda key: self._top[key][0] + self._top[key][1])
+            weight = self._top[weakest][0] + self._top[weakest][1]
+            if chats + users <= weight:
+                self._floor = weight
+                return
+            del self._top[weakest]
+        self._top[fingerprint] = [chats, users, label, cells, epoch]
+
+    def observe(self, chat_id: int, user_id: int, text: str,
+                now: Optional[float] = None) -> Optional[str]:
+        """
+        Record a message and return a reason if it belongs to a campaign
+
+        Args:
+            chat_id: Chat the message was sent in
+            user_id: Sender
+            text: Message text
+            now: Monotonic timestamp, defaults to time.monotonic()
+        """
+        if now is None:
+            now = time.monotonic()
+        self._now = now
+        self.observed += 1
+
+        fingerprints = self.fingerprints(text)
+        if not fingerprints:
+            return None
+
+        current, live = self._rotate(now)
+
+        reason = None
+        for fingerprint, label in fingerprints:
+            cells = self._chats.cells(fingerprint)
+            chats = self._count_distinct(current, live, fingerprint, cells, b'c', chat_id,
+                                         current.chats, self._chats)
+            users = self._count_distinct(current, live, fingerprint, cells, b'u', user_id,
+                                         current.users, self._users)
+            if chats > 1 or users > 1:
+                self._track_heavy_hitter(fingerprint, cells, current.epoch, chats, users, label)
+
+            flagged = self._flagged.get(fingerprint)
+            if flagged is not None:
+                reason = reason or flagged
+            elif chats >= self.chat_threshold or users >= self.user_threshold:
+                kind = "link" if fingerprint[:1] == b'u' else "message"
+                reason = reason or f"Cross-chat campaign: same {kind} in {chats} chats from {users} users"
+                self._flagged.set(fingerprint, reason)
+                self.campaigns_flagged += 1
+        return reason
+
+    def top(self, n: int = 10) -> List[Dict[str, Any]]:
+        """Heaviest fingerprints seen recently"""
+        ranked = sorted(self._top.values(), key=lambda e: e[0] + e[1], reverse=True)
+        return [{'chats': chats, 'users': users, 'label': label}
+                for chats, users, label, _, _ in ranked[:n]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'observed': self.observed,
+            'campaigns_flagged': self.campaigns_flagged,
+            'tracked_heavy_hitters': len(self._top),
+        }
@@ -13,23 +13,123 @@ class Config:
     # Telegram Bot Token (get from @BotFather)
     BOT_TOKEN = os.getenv('BOT_TOKEN', '')
     
+    # Update delivery: polling or webhook
+    RUN_MODE = os.getenv('RUN_MODE', 'polling')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # public HTTPS URL Telegram posts to
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))  # 1-100, set by Telegram
+    
+    # Metrics endpoint (Prometheus text format)
+    ENABLE_METRICS = os.getenv('ENABLE_METRICS', 'false').lower() == 'true'
+    METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+    
+    # Update dispatch: handlers in flight across chats (1 = sequential)
+    CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+    MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', '4096'))  # admitted, incl. waiting
+    
+    # Worker processes; above 1 chats are sharded across them by chat id
+    WORKERS = int(os.getenv('WORKERS', '1'))
+    WORKER_RESTART_DELAY = float(os.getenv('WORKER_RESTART_DELAY', '1'))  # seconds, doubles on crash loops
+    
+    # Outbound API budget (Telegram: ~30 msg/s overall, 20 msg/min per group)
+    API_GLOBAL_PER_SECOND = float(os.getenv('API_GLOBAL_PER_SECOND', '30'))
+    API_CHAT_PER_MINUTE = float(os.getenv('API_CHAT_PER_MINUTE', '20'))
+    API_MAX_IN_FLIGHT = int(os.getenv('API_MAX_IN_FLIGHT', '16'))  # concurrent API requests
+    
     # Database
+    DATABASE_BACKEND = os.getenv('DATABASE_BACKEND', 'sqlite')  # sqlite or memory (nothing persisted)
     DATABASE_PATH = 'bot_database.db'
+    POSTGRES_DSN = os.getenv('POSTGRES_DSN', '')  # benchmark.py only; the backend is experimental
+    POSTGRES_POOL_SIZE = int(os.getenv('POSTGRES_POOL_SIZE', '10'))  # connections per process
+    DATABASE_READERS = int(os.getenv('DATABASE_READERS', '2'))  # pooled read connections
+    DATABASE_CACHE_KB = int(os.getenv('DATABASE_CACHE_KB', '16384'))  # page cache per connection
+    WRITE_BEHIND = os.getenv('WRITE_BEHIND', 'true').lower() == 'true'
+    WRITE_FLUSH_INTERVAL_MS = int(os.getenv('WRITE_FLUSH_INTERVAL_MS', '50'))
+    WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '200'))  # rows per flush
+    WARNING_COUNT_CACHE_SIZE = int(os.getenv('WARNING_COUNT_CACHE_SIZE', '100000'))  # (chat, user) counters kept with write-behind
+    
+    # Shared state (flood windows, admin lists, warning counters) for several instances
+    SHARED_STATE = os.getenv('SHARED_STATE', 'local')  # local or redis
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    REDIS_PREFIX = os.getenv('REDIS_PREFIX', 'moderator:')
+    REDIS_TIMEOUT = float(os.getenv('REDIS_TIMEOUT', '0.5'))  # seconds before falling back to local state
+    WARNING_COUNT_TTL = int(os.getenv('WARNING_COUNT_TTL', '86400'))  # seconds a shared counter outlives its last change
+    
+    # Database maintenance: retention (0 = keep forever), statistics, vacuum
+    MAINTENANCE_INTERVAL = int(os.getenv('MAINTENANCE_INTERVAL', '3600'))  # seconds between runs
+    MESSAGE_RETENTION_HOURS = int(os.getenv('MESSAGE_RETENTION_HOURS', '24'))
+    WARNING_RETENTION_DAYS = int(os.getenv('WARNING_RETENTION_DAYS', '0'))  # purging lowers warning counts
+    BAN_HISTORY_RETENTION_DAYS = int(os.getenv('BAN_HISTORY_RETENTION_DAYS', '0'))
+    MAINTENANCE_CHUNK_SIZE = int(os.getenv('MAINTENANCE_CHUNK_SIZE', '1000'))  # rows per delete transaction
+    MAINTENANCE_ANALYZE_EVERY = int(os.getenv('MAINTENANCE_ANALYZE_EVERY', '24'))  # runs between ANALYZE
+    MAINTENANCE_VACUUM_PAGES = int(os.getenv('MAINTENANCE_VACUUM_PAGES', '2000'))  # pages released per run
     
     # Default moderation settings (can be overridden by admins)
     DEFAULT_WARN_LIMIT = int(os.getenv('DEFAULT_WARN_LIMIT', '3'))
     DEFAULT_BAN_DURATION = int(os.getenv('DEFAULT_BAN_DURATION', '3600'))  # seconds
     
+    # Admin status cache
+    ADMIN_CACHE_TTL = int(os.getenv('ADMIN_CACHE_TTL', '600'))  # seconds
+    ADMIN_CACHE_SIZE = int(os.getenv('ADMIN_CACHE_SIZE', '10000'))  # cached chats
+    ADMIN_LIST_RETRY = int(os.getenv('ADMIN_LIST_RETRY', '60'))  # seconds before retrying a failed admin list load
+    
+    # Chat settings cache
+    CHAT_CONFIG_CACHE_SIZE = int(os.getenv('CHAT_CONFIG_CACHE_SIZE', '10000'))  # cached chats
+    
     # AI Moderation
     ENABLE_AI_MODERATION = os.getenv('ENABLE_AI_MODERATION', 'true').lower() == 'true'
     
+    # Analysis execution: inline, thread or process
+    ANALYSIS_MODE = os.getenv('ANALYSIS_MODE', 'thread')
+    ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', str(min(4, os.cpu_count() or 1))))
+    ANALYSIS_MAX_PENDING = int(os.getenv('ANALYSIS_MAX_PENDING', '64'))  # analyses in flight
+    # Skipping stages after a spam/profanity hit changes is_toxic, reason and confidence
+    ANALYSIS_EARLY_EXIT = os.getenv('ANALYSIS_EARLY_EXIT', 'false').lower() == 'true'
+    
     # Flood Protection
     FLOOD_THRESHOLD = int(os.getenv('FLOOD_THRESHOLD', '5'))  # messages
     FLOOD_TIME_WINDOW = int(os.getenv('FLOOD_TIME_WINDOW', '10'))  # seconds
+    FLOOD_TRACKER_MAX_KEYS = int(os.getenv('FLOOD_TRACKER_MAX_KEYS', '100000'))  # (chat, user) pairs
+    
+    # Raid mode: bulk removal during join/flag spikes
+    RAID_JOIN_THRESHOLD = int(os.getenv('RAID_JOIN_THRESHOLD', '10'))  # joins per window
+    RAID_FLAG_THRESHOLD = int(os.getenv('RAID_FLAG_THRESHOLD', '8'))  # flagged messages per window
+    RAID_WINDOW = int(os.getenv('RAID_WINDOW', '30'))  # seconds
+    RAID_DURATION = int(os.getenv('RAID_DURATION', '600'))  # seconds raid mode stays on
+    RAID_SWEEP_DELAY_MS = int(os.getenv('RAID_SWEEP_DELAY_MS', '2000'))  # offenders collected per sweep
+    RAID_MAX_CHATS = int(os.getenv('RAID_MAX_CHATS', '10000'))  # chats with spike counters kept
+    
+    # Verdict cache for repeated messages
+    VERDICT_CACHE_SIZE = int(os.getenv('VERDICT_CACHE_SIZE', '50000'))  # cached texts
+    VERDICT_CACHE_TTL = int(os.getenv('VERDICT_CACHE_TTL', '3600'))  # seconds
+    VERDICT_NEAR_DUPLICATES = os.getenv('VERDICT_NEAR_DUPLICATES', 'false').lower() == 'true'
+    VERDICT_SIMHASH_DISTANCE = int(os.getenv('VERDICT_SIMHASH_DISTANCE', '8'))  # max differing bits
+    VERDICT_SIMHASH_INDEX_SIZE = int(os.getenv('VERDICT_SIMHASH_INDEX_SIZE', '10000'))  # flagged texts
+    VERDICT_SIMHASH_MIN_WORDS = int(os.getenv('VERDICT_SIMHASH_MIN_WORDS', '5'))
+    
+    # Cross-chat campaign detection
+    # Off by default: it deletes every message the thresholds match, popular links included
+    ENABLE_CAMPAIGN_DETECTION = os.getenv('ENABLE_CAMPAIGN_DETECTION', 'false').lower() == 'true'
+    CAMPAIGN_CHAT_THRESHOLD = int(os.getenv('CAMPAIGN_CHAT_THRESHOLD', '5'))  # distinct chats
+    CAMPAIGN_USER_THRESHOLD = int(os.getenv('CAMPAIGN_USER_THRESHOLD', '10'))  # distinct users
+    CAMPAIGN_WINDOW = int(os.getenv('CAMPAIGN_WINDOW', '600'))  # seconds
+    CAMPAIGN_SKETCH_WIDTH = int(os.getenv('CAMPAIGN_SKETCH_WIDTH', '4096'))  # counters per row
+    CAMPAIGN_MIN_WORDS = int(os.getenv('CAMPAIGN_MIN_WORDS', '8'))  # shorter texts only count URLs
     
     # AI Model Settings
-    AI_MODEL_NAME = "distilbert-base-uncased"  # Lightweight, free model
+    # A sequence classifier fine-tuned for toxicity; a base model's head scores at random
+    AI_MODEL_NAME = os.getenv('AI_MODEL_NAME', "martin-ha/toxic-comment-model")  # Lightweight, free model
+    MODEL_TOXIC_LABEL = os.getenv('MODEL_TOXIC_LABEL', '')  # label to score (default: the one named "toxic")
     TOXICITY_THRESHOLD = 0.7  # 0-1, higher = more strict
+    ENABLE_MODEL_CLASSIFIER = os.getenv('ENABLE_MODEL_CLASSIFIER', 'false').lower() == 'true'
+    MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'transformers')  # transformers or dummy
+    MODEL_LOCAL_FILES_ONLY = os.getenv('MODEL_LOCAL_FILES_ONLY', 'false').lower() == 'true'
+    MODEL_BATCH_SIZE = int(os.getenv('MODEL_BATCH_SIZE', '16'))  # messages per batch
+    MODEL_MAX_WAIT_MS = int(os.getenv('MODEL_MAX_WAIT_MS', '20'))  # batching delay
     
     # Bot Info
     BOT_VERSION = "1.0.0"
@@ -40,5 +140,17 @@ class Config:
         """Validate configuration"""
         if not cls.BOT_TOKEN:
             raise ValueError("BOT_TOKEN is required. Please set it in .env file")
+        if cls.RUN_MODE not in ('polling', 'webhook'):
+            raise ValueError(f"RUN_MODE must be polling or webhook, got {cls.RUN_MODE!r}")
+        if cls.WORKERS < 1:
+            raise ValueError(f"WORKERS must be at least 1, got {cls.WORKERS}")
+        if cls.DATABASE_BACKEND not in ('sqlite', 'memory'):
+            raise ValueError(f"DATABASE_BACKEND must be sqlite or memory, got {cls.DATABASE_BACKEND!r}")
+        if cls.SHARED_STATE not in ('local', 'redis'):
+            raise ValueError(f"SHARED_STATE must be local or redis, got {cls.SHARED_STATE!r}")
+        if cls.DATABASE_BACKEND == 'memory' and cls.WORKERS > 1:
+            raise ValueError("DATABASE_BACKEND=memory can't be shared by WORKERS > 1")
+        if cls.RUN_MODE == 'webhook' and not (cls.WEBHOOK_URL and cls.WEBHOOK_SECRET_TOKEN):
+            raise ValueError("RUN_MODE=webhook needs WEBHOOK_URL and WEBHOOK_SECRET_TOKEN")
         return True
 
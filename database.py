@@ -3,252 +3,696 @@ Database module for storing warnings, bans, and configurations
 """
 import aiosqlite
 import asyncio
+import logging
+import sqlite3
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Tuple, AsyncIterator, Any, Set, Iterable, Hashable
 from config import Config
+from metrics import timed
+from migrations import apply_pragmas, migrate
+from records import CHAT_CONFIG_FIELDS, ChatConfig, WarningRecord
+from shared_state import InProcessState, SharedState
+from storage import DB_QUERY_SECONDS, Storage, utc_timestamp
 
+logger = logging.getLogger(__name__)
 
-class Database:
-    """Async SQLite database manager"""
+
+# Multi-row upsert into active_bans: a new ban replaces the current one
+_ACTIVE_BAN_UPSERT = 'INSERT INTO active_bans (chat_id, user_id, username, ban_until) VALUES '
+_ACTIVE_BAN_CONFLICT = (' ON CONFLICT (chat_id, user_id) DO UPDATE SET '
+                        'username = excluded.username, ban_until = excluded.ban_until')
+
+
+class ConnectionPool:
+    """
+    Long-lived aiosqlite connections: one writer plus a small reader pool.
+    
+    Every aiosqlite connection owns a worker thread, so opening one per query
+    is expensive. The writer is guarded by a lock so transactions never
+    interleave; readers are handed out from a queue.
+    """
     
-    def __init__(self, db_path: str = Config.DATABASE_PATH):
+    def __init__(self, db_path: str, readers: int = Config.DATABASE_READERS):
         self.db_path = db_path
+        # In-memory databases are private to a connection, so readers
+        # would not see the writer's tables
+        self.reader_count = 0 if db_path == ':memory:' else max(readers, 0)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle_readers: Optional[asyncio.Queue] = None
+        self._open_lock = asyncio.Lock()
     
-    async def initialize(self):
-        """Initialize database tables"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Warnings table
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS warnings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    chat_id INTEGER NOT NULL,
-                    username TEXT,
-                    reason TEXT,
-                    warned_by INTEGER,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Bans table
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS bans (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    chat_id INTEGER NOT NULL,
-                    username TEXT,
-                    reason TEXT,
-                    banned_by INTEGER,
-                    ban_until DATETIME,
-                    is_permanent BOOLEAN DEFAULT 0,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+    
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        await apply_pragmas(conn)
+        return conn
+    
+    async def open(self):
+        """Open the writer and reader connections (idempotent)"""
+        async with self._open_lock:
+            if self.is_open:
+                return
             
-            # Chat configurations table
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS chat_config (
-                    chat_id INTEGER PRIMARY KEY,
-                    warn_limit INTEGER DEFAULT 3,
-                    ban_duration INTEGER DEFAULT 3600,
-                    enable_ai_moderation BOOLEAN DEFAULT 1,
-                    flood_threshold INTEGER DEFAULT 5,
-                    flood_time_window INTEGER DEFAULT 10,
-                    auto_delete_spam BOOLEAN DEFAULT 1,
-                    welcome_message TEXT,
-                    rules TEXT
-                )
-            ''')
+            self._writer = await self._connect()
+            self._idle_readers = asyncio.Queue()
+            for _ in range(self.reader_count):
+                conn = await self._connect()
+                self._readers.append(conn)
+                self._idle_readers.put_nowait(conn)
+    
+    async def close(self):
+        """Close all connections"""
+        async with self._open_lock:
+            if not self.is_open:
+                return
             
-            # User message tracking (for flood protection)
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS user_messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    chat_id INTEGER NOT NULL,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            async with self._writer_lock:
+                for conn in self._readers:
+                    await conn.close()
+                self._readers = []
+                self._idle_readers = None
+                
+                await self._writer.close()
+                self._writer = None
+    
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Exclusive access to the writer connection"""
+        if not self.is_open:
+            await self.open()
+        
+        async with self._writer_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                # Never leave a half-finished transaction for the next caller
+                await self._writer.rollback()
+                raise
+    
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a reader connection, falling back to the writer"""
+        if not self.is_open:
+            await self.open()
+        
+        if not self.reader_count:
+            async with self.writer() as conn:
+                yield conn
+            return
+        
+        conn = await self._idle_readers.get()
+        try:
+            yield conn
+        finally:
+            self._idle_readers.put_nowait(conn)
+
+
+class WriteBehindQueue:
+    """
+    Batches INSERTs and flushes them in a single transaction.
+    
+    Rows are flushed every `flush_interval` seconds or as soon as `max_batch`
+    rows are pending, whichever comes first. Keys of pending rows are tracked
+    so reads for the same (user_id, chat_id) can force a flush first.
+    """
+    
+    def __init__(self, pool: ConnectionPool,
+                 flush_interval: float = Config.WRITE_FLUSH_INTERVAL_MS / 1000,
+                 max_batch: int = Config.WRITE_BATCH_SIZE):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._pending_keys: Counter = Counter()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.rows_failed = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+    
+    @property
+    def depth(self) -> int:
+        """Rows waiting to be written"""
+        return self.queue.qsize()
+    
+    def start(self):
+        """Start the background flusher"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background flusher and write everything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    async def put(self, sql: str, params: Tuple, key: Tuple[int, int]):
+        """Queue a row for insertion, flushing once a full batch is waiting"""
+        await self.put_many([(sql, params, key)])
+    
+    async def put_many(self, statements: List[Tuple[str, Tuple, Hashable]]):
+        """Queue (sql, params, key) statements that must be written in the same transaction"""
+        self.start()
+        # No await between puts, so one flush always takes all of them
+        for sql, params, key in statements:
+            self.queue.put_nowait((sql, params, key))
+            self._pending_keys[key] += 1
+        if self.queue.qsize() >= self.max_batch:
+            await self.flush()
+    
+    def has_pending(self, key: Hashable) -> bool:
+        return self._pending_keys[key] > 0
+    
+    async def flush_for(self, key: Hashable):
+        """Durability point: make pending rows for `key` visible to readers"""
+        if self.has_pending(key):
+            await self.flush()
+    
+    async def flush(self):
+        """Write all queued rows in one transaction"""
+        async with self._flush_lock:
+            batch = []
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            if not batch:
+                return
             
-            # Admin list
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS admins (
-                    user_id INTEGER NOT NULL,
-                    chat_id INTEGER NOT NULL,
-                    added_by INTEGER,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (user_id, chat_id)
-                )
-            ''')
+            start = time.perf_counter()
+            try:
+                async with self.pool.writer() as db:
+                    # Group consecutive rows sharing a statement to keep insert order
+                    group_sql, group = None, []
+                    for sql, params, _ in batch:
+                        if sql != group_sql and group:
+                            await db.executemany(group_sql, group)
+                            group = []
+                        group_sql = sql
+                        group.append(params)
+                    await db.executemany(group_sql, group)
+                    await db.commit()
+                self.rows_flushed += len(batch)
+            except Exception as e:
+                self.rows_failed += len(batch)
+                logger.error(f"Write-behind flush of {len(batch)} rows failed: {str(e)}")
+            finally:
+                for _, _, key in batch:
+                    self._pending_keys[key] -= 1
+                    if self._pending_keys[key] <= 0:
+                        del self._pending_keys[key]
             
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+    
+    async def _run(self):
+        """Flush whatever is queued every flush_interval"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Shielded so stop() never cancels a batch halfway through
+            await asyncio.shield(self.flush())
+    
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and flush latency metrics"""
+        return {
+            'queue_depth': self.depth,
+            'flushes': self.flushes,
+            'rows_flushed': self.rows_flushed,
+            'rows_failed': self.rows_failed,
+            'last_flush_ms': self.last_flush_ms,
+            'max_flush_ms': self.max_flush_ms,
+            'avg_flush_ms': self._total_flush_ms / self.flushes if self.flushes else 0.0,
+        }
+
+
+class Database(Storage):
+    """Async SQLite database manager"""
+    
+    def __init__(self, db_path: str = Config.DATABASE_PATH,
+                 readers: int = Config.DATABASE_READERS,
+                 write_behind: bool = False, state: Optional[SharedState] = None):
+        super().__init__()
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path, readers)
+        # When enabled, warnings, bans and message tracking are batched
+        self.write_queue = WriteBehindQueue(self.pool) if write_behind else None
+        # With write-behind, warning counts are kept in the shared state
+        # (seeded lazily from warning_counts) so add_warning can answer
+        # without forcing a flush
+        self.state = (state or InProcessState()) if write_behind else None
+    
+    async def initialize(self):
+        """Open the connection pool and bring the schema up to date"""
+        await self.pool.open()
+        
+        async with self.pool.writer() as db:
+            await migrate(db)
+        
+        if self.write_queue:
+            self.write_queue.start()
+    
+    async def close(self):
+        """Flush queued writes and close the connection pool"""
+        if self.write_queue:
+            await self.write_queue.stop()
+        await self.pool.close()
+    
+    async def _insert(self, sql: str, params: Tuple, user_id: int, chat_id: int) -> Optional[int]:
+        """
+        Insert a row, either immediately or through the write-behind queue
+        
+        Returns:
+            The new row id, or None if the write was queued
+        """
+        if self.write_queue:
+            await self.write_queue.put(sql, params, (user_id, chat_id))
+            return None
+        
+        async with self.pool.writer() as db:
+            cursor = await db.execute(sql, params)
             await db.commit()
+            return cursor.lastrowid
     
+    async def _flush_for(self, user_id: int, chat_id: int):
+        """Make queued writes for this user visible before reading"""
+        if self.write_queue:
+            await self.write_queue.flush_for((user_id, chat_id))
+    
+    @timed(DB_QUERY_SECONDS)
+    async def flush(self):
+        """Write everything still queued"""
+        if self.write_queue:
+            await self.write_queue.flush()
+    
+    @timed(DB_QUERY_SECONDS)
     async def add_warning(self, user_id: int, chat_id: int, username: str, 
                          reason: str, warned_by: int) -> int:
-        """Add a warning for a user"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute('''
-                INSERT INTO warnings (user_id, chat_id, username, reason, warned_by)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, chat_id, username, reason, warned_by))
-            await db.commit()
-            return cursor.lastrowid
+        """
+        Add a warning for a user
+        
+        Returns:
+            The user's warning count in the chat, including this warning
+        """
+        insert = ('''
+            INSERT INTO warnings (user_id, chat_id, username, reason, warned_by, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, chat_id, username, reason, warned_by, utc_timestamp()))
+        
+        if self.state is None:
+            # The writer lock serializes concurrent warnings, so every caller
+            # gets a distinct count
+            async with self.pool.writer() as db:
+                await db.execute(*insert)
+                async with db.execute('''
+                    INSERT INTO warning_counts (chat_id, user_id, count) VALUES (?, ?, 1)
+                    ON CONFLICT (chat_id, user_id) DO UPDATE SET count = count + 1
+                    RETURNING count
+                ''', (chat_id, user_id)) as cursor:
+                    count = (await cursor.fetchone())[0]
+                await db.commit()
+            return count
+        
+        # Write-behind: count in the shared state, then queue the row and the
+        # increment for the same flush. Increments (not totals) keep the
+        # stored counter right when retention purges run between queueing
+        # and flushing
+        count = await self.state.incr_warnings(chat_id, user_id, self._warning_seed(user_id, chat_id))
+        await self.write_queue.put_many([insert + ((user_id, chat_id),), ('''
+            INSERT INTO warning_counts (chat_id, user_id, count) VALUES (?, ?, 1)
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET count = count + 1
+        ''', (chat_id, user_id), ('warning_counts', chat_id, user_id))])
+        return count
     
-    async def get_warnings(self, user_id: int, chat_id: int) -> List[Dict]:
+    def _warning_seed(self, user_id: int, chat_id: int):
+        """Loader of the stored count, for when the shared state has none"""
+        async def seed() -> int:
+            # Only queued counter rows matter here (the state may have
+            # dropped the key before they were flushed), not the user's
+            # other writes
+            await self.write_queue.flush_for(('warning_counts', chat_id, user_id))
+            return await self._stored_warning_count(user_id, chat_id)
+        return seed
+    
+    async def _stored_warning_count(self, user_id: int, chat_id: int) -> int:
+        async with self.pool.reader() as db:
+            async with db.execute('''
+                SELECT count FROM warning_counts
+                WHERE chat_id = ? AND user_id = ?
+            ''', (chat_id, user_id)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else 0
+    
+    @timed(DB_QUERY_SECONDS)
+    async def get_warnings(self, user_id: int, chat_id: int) -> List[WarningRecord]:
         """Get all warnings for a user in a chat"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        await self._flush_for(user_id, chat_id)
+        async with self.pool.reader() as db:
             async with db.execute('''
-                SELECT * FROM warnings 
+                SELECT id, user_id, chat_id, username, reason, warned_by, timestamp
+                FROM warnings 
                 WHERE user_id = ? AND chat_id = ?
                 ORDER BY timestamp DESC
             ''', (user_id, chat_id)) as cursor:
                 rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                return [WarningRecord(*row) for row in rows]
     
+    @timed(DB_QUERY_SECONDS)
     async def get_warning_count(self, user_id: int, chat_id: int) -> int:
         """Get warning count for a user"""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute('''
-                SELECT COUNT(*) FROM warnings 
-                WHERE user_id = ? AND chat_id = ?
-            ''', (user_id, chat_id)) as cursor:
-                result = await cursor.fetchone()
-                return result[0] if result else 0
+        if self.state is not None:
+            return await self.state.get_warnings(chat_id, user_id, self._warning_seed(user_id, chat_id))
+        return await self._stored_warning_count(user_id, chat_id)
     
+    @timed(DB_QUERY_SECONDS)
     async def clear_warnings(self, user_id: int, chat_id: int) -> int:
         """Clear all warnings for a user"""
-        async with aiosqlite.connect(self.db_path) as db:
+        if self.state is not None:
+            # Reset and queue the deletes in one step, so warnings added
+            # concurrently land either before the deletes or after the reset
+            cleared = await self.state.reset_warnings(chat_id, user_id,
+                                                      self._warning_seed(user_id, chat_id))
+            await self.write_queue.put_many([
+                ('DELETE FROM warnings WHERE user_id = ? AND chat_id = ?', (user_id, chat_id),
+                 (user_id, chat_id)),
+                ('DELETE FROM warning_counts WHERE chat_id = ? AND user_id = ?', (chat_id, user_id),
+                 ('warning_counts', chat_id, user_id)),
+            ])
+            await self._flush_for(user_id, chat_id)
+            return cleared
+        
+        async with self.pool.writer() as db:
             cursor = await db.execute('''
-                DELETE FROM warnings 
+                DELETE FROM warnings
                 WHERE user_id = ? AND chat_id = ?
             ''', (user_id, chat_id))
+            await db.execute('''
+                DELETE FROM warning_counts
+                WHERE chat_id = ? AND user_id = ?
+            ''', (chat_id, user_id))
             await db.commit()
             return cursor.rowcount
     
+    @timed(DB_QUERY_SECONDS)
     async def add_ban(self, user_id: int, chat_id: int, username: str,
-                     reason: str, banned_by: int, duration: Optional[int] = None) -> int:
-        """Add a ban record"""
+                     reason: str, banned_by: int, duration: Optional[int] = None) -> Optional[int]:
+        """
+        Add a ban record and mark the user as banned
+        
+        Returns:
+            The history row id, or None if the write was queued
+        """
         ban_until = None
         is_permanent = duration is None
+        expires = time.time() + duration if duration else None
         
         if duration:
             ban_until = (datetime.now() + timedelta(seconds=duration)).isoformat()
         
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute('''
-                INSERT INTO bans (user_id, chat_id, username, reason, banned_by, 
-                                 ban_until, is_permanent)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, chat_id, username, reason, banned_by, ban_until, is_permanent))
+        history = ('''
+            INSERT INTO bans (user_id, chat_id, username, reason, banned_by, 
+                             ban_until, is_permanent, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, chat_id, username, reason, banned_by, ban_until, is_permanent,
+              utc_timestamp()))
+        active = (_ACTIVE_BAN_UPSERT + '(?, ?, ?, ?)' + _ACTIVE_BAN_CONFLICT,
+                  (chat_id, user_id, username, expires))
+        
+        if self.write_queue:
+            await self.write_queue.put_many([history + ((user_id, chat_id),),
+                                             active + ((user_id, chat_id),)])
+            return None
+        
+        async with self.pool.writer() as db:
+            cursor = await db.execute(*history)
+            await db.execute(*active)
             await db.commit()
             return cursor.lastrowid
     
+    @timed(DB_QUERY_SECONDS)
+    async def add_bans(self, bans: Iterable[Tuple[int, int, str]], reason: str,
+                       banned_by: int, duration: Optional[int] = None) -> int:
+        """
+        Record many bans in one transaction with multi-row INSERTs
+        
+        Args:
+            bans: (user_id, chat_id, username) per banned user
+            
+        Returns:
+            Number of rows written
+        """
+        ban_until = None
+        if duration:
+            ban_until = (datetime.now() + timedelta(seconds=duration)).isoformat()
+        expires = time.time() + duration if duration else None
+        timestamp = utc_timestamp()
+        rows = [(user_id, chat_id, username, reason, banned_by, ban_until, duration is None, timestamp)
+                for user_id, chat_id, username in bans]
+        if not rows:
+            return 0
+        
+        async with self.pool.writer() as db:
+            # 8 columns x 100 rows stays under SQLite's default 999 variable limit
+            for start in range(0, len(rows), 100):
+                chunk = rows[start:start + 100]
+                await db.execute(
+                    'INSERT INTO bans (user_id, chat_id, username, reason, banned_by, '
+                    'ban_until, is_permanent, timestamp) VALUES '
+                    + ', '.join(['(?, ?, ?, ?, ?, ?, ?, ?)'] * len(chunk)),
+                    [value for row in chunk for value in row]
+                )
+                await db.execute(
+                    _ACTIVE_BAN_UPSERT + ', '.join(['(?, ?, ?, ?)'] * len(chunk)) + _ACTIVE_BAN_CONFLICT,
+                    [value for row in chunk for value in (row[1], row[0], row[2], expires)]
+                )
+            await db.commit()
+        return len(rows)
+    
+    @timed(DB_QUERY_SECONDS)
     async def is_banned(self, user_id: int, chat_id: int) -> bool:
         """Check if user is currently banned"""
-        async with aiosqlite.connect(self.db_path) as db:
+        await self._flush_for(user_id, chat_id)
+        async with self.pool.reader() as db:
             async with db.execute('''
-                SELECT is_permanent, ban_until FROM bans
-                WHERE user_id = ? AND chat_id = ?
-                ORDER BY timestamp DESC LIMIT 1
-            ''', (user_id, chat_id)) as cursor:
+                SELECT ban_until FROM active_bans
+                WHERE chat_id = ? AND user_id = ?
+            ''', (chat_id, user_id)) as cursor:
                 result = await cursor.fetchone()
-                if not result:
-                    return False
-                
-                is_permanent, ban_until = result
-                if is_permanent:
-                    return True
-                
-                if ban_until:
-                    ban_time = datetime.fromisoformat(ban_until)
-                    return datetime.now() < ban_time
-                
-                return False
+                # Expired bans count as lifted even before the scheduler removes them
+                return result is not None and (result[0] is None or result[0] > time.time())
     
-    async def get_chat_config(self, chat_id: int) -> Dict:
-        """Get configuration for a chat"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+    @timed(DB_QUERY_SECONDS)
+    async def remove_ban(self, user_id: int, chat_id: int) -> bool:
+        """Mark a user as no longer banned (the history is kept)"""
+        await self._flush_for(user_id, chat_id)
+        async with self.pool.writer() as db:
+            cursor = await db.execute('''
+                DELETE FROM active_bans
+                WHERE chat_id = ? AND user_id = ?
+            ''', (chat_id, user_id))
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    @timed(DB_QUERY_SECONDS)
+    async def get_expiring_bans(self) -> List[Tuple[int, int, float]]:
+        """(chat_id, user_id, ban_until) of every temporary ban still active"""
+        await self.flush()
+        async with self.pool.reader() as db:
             async with db.execute('''
-                SELECT * FROM chat_config WHERE chat_id = ?
+                SELECT chat_id, user_id, ban_until FROM active_bans
+                WHERE ban_until IS NOT NULL
+            ''') as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+    
+    @timed(DB_QUERY_SECONDS)
+    async def lift_expired_bans(self, bans: Iterable[Tuple[int, int]], now: float) -> int:
+        """
+        Remove temporary bans that ran out by `now`
+        
+        A ban renewed meanwhile expires later than `now` and is left alone.
+        """
+        await self.flush()
+        async with self.pool.writer() as db:
+            cursor = await db.executemany('''
+                DELETE FROM active_bans
+                WHERE chat_id = ? AND user_id = ? AND ban_until <= ?
+            ''', [(chat_id, user_id, now) for chat_id, user_id in bans])
+            await db.commit()
+            return cursor.rowcount
+    
+    async def _load_chat_config(self, chat_id: int) -> Optional[ChatConfig]:
+        """The stored settings of a chat, or None"""
+        async with self.pool.reader() as db:
+            async with db.execute(f'''
+                SELECT {', '.join(CHAT_CONFIG_FIELDS)} FROM chat_config WHERE chat_id = ?
             ''', (chat_id,)) as cursor:
                 row = await cursor.fetchone()
-                if row:
-                    return dict(row)
-                else:
-                    # Return defaults if no config exists
-                    return {
-                        'chat_id': chat_id,
-                        'warn_limit': Config.DEFAULT_WARN_LIMIT,
-                        'ban_duration': Config.DEFAULT_BAN_DURATION,
-                        'enable_ai_moderation': Config.ENABLE_AI_MODERATION,
-                        'flood_threshold': Config.FLOOD_THRESHOLD,
-                        'flood_time_window': Config.FLOOD_TIME_WINDOW,
-                        'auto_delete_spam': True,
-                        'welcome_message': None,
-                        'rules': None
-                    }
-    
-    async def set_chat_config(self, chat_id: int, **kwargs):
-        """Update chat configuration"""
-        async with aiosqlite.connect(self.db_path) as db:
+                return ChatConfig.from_row(row) if row else None
+    
+    async def _store_chat_config(self, chat_id: int, settings: Dict[str, Any]):
+        """Create the chat's settings row if needed and update `settings` in it"""
+        async with self.pool.writer() as db:
             # First, ensure config exists
             await db.execute('''
                 INSERT OR IGNORE INTO chat_config (chat_id) VALUES (?)
             ''', (chat_id,))
             
             # Update provided settings
-            for key, value in kwargs.items():
-                if key != 'chat_id':
-                    await db.execute(f'''
-                        UPDATE chat_config 
-                        SET {key} = ?
-                        WHERE chat_id = ?
-                    ''', (value, chat_id))
+            for key, value in settings.items():
+                await db.execute(f'''
+                    UPDATE chat_config 
+                    SET {key} = ?
+                    WHERE chat_id = ?
+                ''', (value, chat_id))
             
             await db.commit()
     
+    @timed(DB_QUERY_SECONDS)
     async def track_message(self, user_id: int, chat_id: int):
-        """Track a user message for flood detection"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                INSERT INTO user_messages (user_id, chat_id)
-                VALUES (?, ?)
-            ''', (user_id, chat_id))
-            await db.commit()
+        """Track a user message (flood detection itself uses FloodTracker)"""
+        await self._insert('''
+            INSERT INTO user_messages (user_id, chat_id, timestamp)
+            VALUES (?, ?, ?)
+        ''', (user_id, chat_id, utc_timestamp()), user_id, chat_id)
     
+    @timed(DB_QUERY_SECONDS)
     async def get_recent_message_count(self, user_id: int, chat_id: int, 
                                        time_window: int) -> int:
         """Get message count in time window"""
-        cutoff_time = (datetime.now() - timedelta(seconds=time_window)).isoformat()
-        
-        async with aiosqlite.connect(self.db_path) as db:
+        await self._flush_for(user_id, chat_id)
+        # Compare in SQLite's own UTC format that CURRENT_TIMESTAMP writes
+        async with self.pool.reader() as db:
             async with db.execute('''
                 SELECT COUNT(*) FROM user_messages
                 WHERE user_id = ? AND chat_id = ? 
-                AND timestamp > ?
-            ''', (user_id, chat_id, cutoff_time)) as cursor:
+                AND timestamp > datetime('now', ?)
+            ''', (user_id, chat_id, f'-{int(time_window)} seconds')) as cursor:
                 result = await cursor.fetchone()
                 return result[0] if result else 0
     
-    async def cleanup_old_messages(self, hours: int = 24):
-        """Clean up old message tracking records"""
-        cutoff_time = (datetime.now() - timedelta(hours=hours)).isoformat()
+    async def _purge(self, table: str, before: str, limit: int) -> int:
+        # Queued rows must not escape a purge whose cutoff covers them
+        await self.flush()
+        async with self.pool.writer() as db:
+            cursor = await db.execute(f'''
+                DELETE FROM {table} WHERE id IN (
+                    SELECT id FROM {table} WHERE timestamp < ? LIMIT ?
+                )
+            ''', (before, limit))
+            await db.commit()
+            return cursor.rowcount
+    
+    @timed(DB_QUERY_SECONDS)
+    async def purge_messages(self, before: str, limit: int) -> int:
+        """Delete up to `limit` message tracking rows older than `before`"""
+        return await self._purge('user_messages', before, limit)
+    
+    @timed(DB_QUERY_SECONDS)
+    async def purge_ban_history(self, before: str, limit: int) -> int:
+        """Delete up to `limit` ban history rows older than `before` (active bans stay)"""
+        return await self._purge('bans', before, limit)
+    
+    @timed(DB_QUERY_SECONDS)
+    async def purge_warnings(self, before: str, limit: int) -> int:
+        """Delete up to `limit` warnings older than `before`, keeping counters in step"""
+        await self.flush()
+        async with self.pool.writer() as db:
+            async with db.execute('''
+                DELETE FROM warnings WHERE id IN (
+                    SELECT id FROM warnings WHERE timestamp < ? LIMIT ?
+                )
+                RETURNING chat_id, user_id
+            ''', (before, limit)) as cursor:
+                removed = Counter(tuple(row) for row in await cursor.fetchall())
+            await db.executemany('''
+                UPDATE warning_counts SET count = count - ?
+                WHERE chat_id = ? AND user_id = ?
+            ''', [(n, chat_id, user_id) for (chat_id, user_id), n in removed.items()])
+            await db.executemany('''
+                DELETE FROM warning_counts
+                WHERE chat_id = ? AND user_id = ? AND count <= 0
+            ''', list(removed))
+            await db.commit()
         
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                DELETE FROM user_messages WHERE timestamp < ?
-            ''', (cutoff_time,))
+        if self.state is not None and removed:
+            # The stored counters are exact again; reload them on next use
+            await self.state.forget_warnings(removed)
+        return sum(removed.values())
+    
+    @timed(DB_QUERY_SECONDS)
+    async def optimize(self, analyze: bool = False):
+        """Refresh the query planner's statistics (PRAGMA optimize, optionally ANALYZE)"""
+        async with self.pool.writer() as db:
+            # Sample indexes instead of reading them whole
+            await db.execute('PRAGMA analysis_limit = 1000')
+            if analyze:
+                await db.execute('ANALYZE')
+            await db.execute('PRAGMA optimize')
             await db.commit()
     
-    async def get_user_stats(self, user_id: int, chat_id: int) -> Dict:
-        """Get statistics for a user"""
-        warnings = await self.get_warning_count(user_id, chat_id)
-        is_banned = await self.is_banned(user_id, chat_id)
+    @timed(DB_QUERY_SECONDS)
+    async def incremental_vacuum(self, pages: int) -> Optional[int]:
+        """
+        Release up to `pages` free pages back to the filesystem
         
-        return {
-            'warnings': warnings,
-            'is_banned': is_banned
-        }
-
+        Returns:
+            Pages released, or None if the database isn't in incremental
+            auto-vacuum mode
+        """
+        async with self.pool.writer() as db:
+            async with db.execute('PRAGMA auto_vacuum') as cursor:
+                if (await cursor.fetchone())[0] != 2:
+                    return None
+            async with db.execute('PRAGMA freelist_count') as cursor:
+                free = (await cursor.fetchone())[0]
+            # Pages are only released while the pragma's result is stepped through
+            async with db.execute(f'PRAGMA incremental_vacuum({int(pages)})') as cursor:
+                await cursor.fetchall()
+            await db.commit()
+            async with db.execute('PRAGMA freelist_count') as cursor:
+                return free - (await cursor.fetchone())[0]
+    
+    @timed(DB_QUERY_SECONDS)
+    async def get_admins(self) -> Dict[int, Set[int]]:
+        """Get the last known admin set of every chat"""
+        admins: Dict[int, Set[int]] = {}
+        async with self.pool.reader() as db:
+            async with db.execute('''
+                SELECT chat_id, user_id FROM admins
+            ''') as cursor:
+                async for chat_id, user_id in cursor:
+                    admins.setdefault(chat_id, set()).add(user_id)
+        return admins
+    
+    @timed(DB_QUERY_SECONDS)
+    async def set_chat_admins(self, chat_id: int, user_ids: Iterable[int],
+                              added_by: Optional[int] = None):
+        """Replace the stored admin set of a chat"""
+        async with self.pool.writer() as db:
+            await db.execute('''
+                DELETE FROM admins WHERE chat_id = ?
+            ''', (chat_id,))
+            await db.executemany('''
+                INSERT INTO admins (user_id, chat_id, added_by)
+                VALUES (?, ?, ?)
+            ''', [(user_id, chat_id, added_by) for user_id in user_ids])
+            await db.commit()
@@ -0,0 +1,104 @@
+"""
+Fake Telegram Bot module
+Offline stand-in for telegram.Bot that records calls and simulates rate limits
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+from telegram import ChatMemberMember, ChatMemberOwner, User
+from telegram.error import BadRequest, RetryAfter
+
+
+class FakeBot:
+    """
+    Records every API call instead of contacting Telegram.
+
+    `latency` is awaited on each call. With `chat_limit` set, a chat that
+    receives more than `chat_limit` calls within `limit_window` seconds gets
+    RetryAfter, like Telegram's 429 responses. Message ids listed in
+    `missing_messages` fail deletion with BadRequest. `admins` maps a chat
+    id to the user ids its administrator list reports.
+    """
+
+    # Message.reply_text and friends look for the bot's defaults
+    defaults = None
+
+    def __init__(self, bot_id: int = 1, latency: float = 0.0,
+                 chat_limit: Optional[int] = None, limit_window: float = 60.0,
+                 retry_after: int = 1, admins: Optional[Dict[int, Iterable[int]]] = None):
+        self.id = bot_id
+        self.username = 'fake_moderator_bot'
+        self.admins = {chat_id: set(user_ids) for chat_id, user_ids in (admins or {}).items()}
+        self.latency = latency
+        self.chat_limit = chat_limit
+        self.limit_window = limit_window
+        self.retry_after = retry_after
+        self.missing_messages = set()
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.rate_limited = 0
+        self._recent: Dict[int, Deque[float]] = {}
+        self._next_message_id = 1
+
+    def calls_to(self, method: str) -> List[Dict[str, Any]]:
+        """Arguments of every successful call to `method`"""
+        return [kwargs for name, kwargs in self.calls if name == method]
+
+    async def _call(self, method: str, chat_id: int, **kwargs) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.chat_limit is not None:
+            now = time.monotonic()
+            recent = self._recent.setdefault(chat_id, deque())
+            while recent and recent[0] <= now - self.limit_window:
+                recent.popleft()
+            if len(recent) >= self.chat_limit:
+                self.rate_limited += 1
+                raise RetryAfter(self.retry_after)
+            recent.append(now)
+
+        self.calls.append((method, dict(kwargs, chat_id=chat_id)))
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await self._call('send_message', chat_id, text=text, **kwargs)
+        self._next_message_id += 1
+        return self._next_message_id
+
+    async def delete_message(self, chat_id: int, message_id: int, **kwargs) -> bool:
+        if message_id in self.missing_messages:
+            raise BadRequest("Message to delete not found")
+        await self._call('delete_message', chat_id, message_id=message_id, **kwargs)
+        return True
+
+    async def delete_messages(self, chat_id: int, message_ids, **kwargs) -> bool:
+        # Like Telegram, messages that can't be found are skipped silently
+        await self._call('delete_messages', chat_id, message_ids=list(message_ids), **kwargs)
+        return True
+
+    async def ban_chat_member(self, chat_id: int, user_id: int, **kwargs) -> bool:
+        await self._call('ban_chat_member', chat_id, user_id=user_id, **kwargs)
+        return True
+
+    async def unban_chat_member(self, chat_id: int, user_id: int, **kwargs) -> bool:
+        await self._call('unban_chat_member', chat_id, user_id=user_id, **kwargs)
+        return True
+
+    async def restrict_chat_member(self, chat_id: int, user_id: int, permissions, **kwargs) -> bool:
+        await self._call('restrict_chat_member', chat_id, user_id=user_id,
+                         permissions=permissions, **kwargs)
+        return True
+
+    async def get_chat_administrators(self, chat_id: int, **kwargs):
+        await self._call('get_chat_administrators', chat_id, **kwargs)
+        return tuple(
+            ChatMemberOwner(User(user_id, f"Admin{user_id}", False), is_anonymous=False)
+            for user_id in sorted(self.admins.get(chat_id, ()))
+        )
+
+    async def get_chat_member(self, chat_id: int, user_id: int, **kwargs):
+        await self._call('get_chat_member', chat_id, user_id=user_id, **kwargs)
+        user = User(user_id, f"User{user_id}", False)
+        if user_id in self.admins.get(chat_id, ()):
+            return ChatMemberOwner(user, is_anonymous=False)
+        return ChatMemberMember(user)
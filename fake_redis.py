@@ -0,0 +1,241 @@
+"""
+Fake Redis server module
+A local RESP server with the handful of commands the shared state uses
+"""
+import asyncio
+import fnmatch
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from redis_client import RedisError, read_reply
+
+
+def _encode(reply: Any) -> bytes:
+    if isinstance(reply, RedisError):
+        return b'-%s\r\n' % str(reply).encode()
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, bool):
+        return b':%d\r\n' % reply
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+    if isinstance(reply, list):
+        return b'*%d\r\n' % len(reply) + b''.join(_encode(item) for item in reply)
+    if isinstance(reply, str):
+        return b'+%s\r\n' % reply.encode()
+    return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+
+def _score(value: bytes) -> float:
+    text = value.decode().lstrip('(')
+    return {'-inf': float('-inf'), '+inf': float('inf'), 'inf': float('inf')}.get(text) or float(text)
+
+
+class FakeRedisServer:
+    """
+    In-process stand-in for a Redis server, for tests and benchmarks.
+
+    Speaks RESP over TCP so the real client code runs unchanged, including
+    pipelining and MULTI/EXEC. Supports strings, counters, sorted sets, key
+    expiry and transactions. Every executed command is kept in `commands`.
+    """
+
+    def __init__(self):
+        self.server: Optional[asyncio.AbstractServer] = None
+        # key -> bytes (strings) or {member: score} (sorted sets)
+        self.data: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, float] = {}
+        self.commands: List[Tuple[bytes, ...]] = []
+        self.clients = 0
+        # Open connections and the tasks serving them
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"redis://{host}:{port}/0"
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+
+    async def stop(self):
+        """Stop listening and drop every client connection"""
+        if self.server is not None:
+            self.server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    def _alive(self, key: bytes) -> bool:
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            del self.expires[key]
+        return key in self.data
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients += 1
+        self._connections[writer] = asyncio.current_task()
+        queued: Optional[List[List[bytes]]] = None
+        try:
+            while True:
+                command = await read_reply(reader)
+                name = command[0].upper()
+                if name == b'MULTI':
+                    queued, reply = [], 'OK'
+                elif name == b'EXEC':
+                    reply = [self._run(queued_command) for queued_command in queued or []]
+                    queued = None
+                elif name == b'DISCARD':
+                    queued, reply = None, 'OK'
+                elif queued is not None:
+                    queued.append(command)
+                    reply = 'QUEUED'
+                else:
+                    reply = self._run(command)
+                writer.write(_encode(reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    def _run(self, command: List[bytes]) -> Any:
+        self.commands.append(tuple(command))
+        name, args = command[0].upper().decode(), command[1:]
+        handler = getattr(self, f'_cmd_{name.lower()}', None)
+        if handler is None:
+            return RedisError(f"ERR unknown command '{name}'")
+        try:
+            return handler(*args)
+        except (TypeError, ValueError, IndexError):
+            return RedisError(f"ERR wrong number or type of arguments for '{name}'")
+
+    def _string(self, key: bytes) -> Optional[bytes]:
+        if not self._alive(key):
+            return None
+        value = self.data[key]
+        if not isinstance(value, bytes):
+            raise ValueError(key)
+        return value
+
+    def _zset(self, key: bytes) -> Dict[bytes, float]:
+        if not self._alive(key):
+            self.data[key] = {}
+        return self.data[key]
+
+    def _cmd_ping(self, *args):
+        return args[0] if args else 'PONG'
+
+    def _cmd_auth(self, *args):
+        return 'OK'
+
+    def _cmd_select(self, database):
+        return 'OK'
+
+    def _cmd_flushall(self):
+        self.data.clear()
+        self.expires.clear()
+        return 'OK'
+
+    def _cmd_get(self, key):
+        return self._string(key)
+
+    def _cmd_set(self, key, value, *options):
+        options = [option.upper() for option in options]
+        if b'NX' in options and self._alive(key):
+            return None
+        if b'XX' in options and not self._alive(key):
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if b'PX' in options:
+            self.expires[key] = time.monotonic() + int(options[options.index(b'PX') + 1]) / 1000
+        elif b'EX' in options:
+            self.expires[key] = time.monotonic() + int(options[options.index(b'EX') + 1])
+        return 'OK'
+
+    def _cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                removed += 1
+        return removed
+
+    def _cmd_exists(self, *keys):
+        return sum(self._alive(key) for key in keys)
+
+    def _cmd_keys(self, pattern):
+        return [key for key in list(self.data) if self._alive(key)
+                and fnmatch.fnmatchcase(key.decode(), pattern.decode())]
+
+    def _cmd_incrby(self, key, amount):
+        value = int(self._string(key) or 0) + int(amount)
+        self.data[key] = str(value).encode()
+        return value
+
+    def _cmd_incr(self, key):
+        return self._cmd_incrby(key, b'1')
+
+    def _cmd_decrby(self, key, amount):
+        return self._cmd_incrby(key, str(-int(amount)).encode())
+
+    def _cmd_pexpire(self, key, milliseconds):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = time.monotonic() + int(milliseconds) / 1000
+        return 1
+
+    def _cmd_pttl(self, key):
+        if not self._alive(key):
+            return -2
+        deadline = self.expires.get(key)
+        return -1 if deadline is None else int((deadline - time.monotonic()) * 1000)
+
+    def _cmd_zadd(self, key, *pairs):
+        zset = self._zset(key)
+        added = 0
+        for score, member in zip(pairs[::2], pairs[1::2]):
+            added += member not in zset
+            zset[member] = _score(score)
+        return added
+
+    def _cmd_zcard(self, key):
+        return len(self.data[key]) if self._alive(key) else 0
+
+    def _cmd_zremrangebyscore(self, key, low, high):
+        if not self._alive(key):
+            return 0
+        zset = self.data[key]
+        low_open, high_open = low.startswith(b'('), high.startswith(b'(')
+        low, high = _score(low), _score(high)
+        doomed = [member for member, score in zset.items()
+                  if (score > low if low_open else score >= low)
+                  and (score < high if high_open else score <= high)]
+        for member in doomed:
+            del zset[member]
+        if not zset:
+            self._cmd_del(key)
+        return len(doomed)
+
+    def _cmd_zremrangebyrank(self, key, start, stop):
+        if not self._alive(key):
+            return 0
+        zset = self.data[key]
+        ranked = sorted(zset, key=lambda member: (zset[member], member))
+        start, stop = int(start), int(stop)
+        if start < 0:
+            start += len(ranked)
+        if stop < 0:
+            stop += len(ranked)
+        # Out-of-range bounds select nothing rather than wrapping around
+        doomed = ranked[max(start, 0):stop + 1] if stop >= 0 else []
+        for member in doomed:
+            del zset[member]
+        if not zset:
+            self._cmd_del(key)
+        return len(doomed)
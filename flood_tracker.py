@@ -0,0 +1,88 @@
+"""
+In-memory flood tracking module
+Sliding-window message counters keyed by (chat_id, user_id)
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Optional, Tuple
+from config import Config
+
+
+class FloodTracker:
+    """Per-user sliding windows of monotonic message timestamps"""
+
+    # setfloodlimit caps the threshold at 50, so older events never matter
+    MAX_EVENTS_PER_KEY = 64
+
+    def __init__(self, max_keys: int = Config.FLOOD_TRACKER_MAX_KEYS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        # Least recently active key first, so idle keys are evicted from the front
+        self._windows: 'OrderedDict[Tuple[int, int], Deque[float]]' = OrderedDict()
+        # Longest window ever asked for; a key idle for longer counts as zero
+        self._max_window = 0
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def record(self, chat_id: int, user_id: int, time_window: int,
+               now: Optional[float] = None) -> int:
+        """
+        Record a message and return how many the user sent in the window
+
+        Args:
+            chat_id: Chat the message was sent in
+            user_id: Sender
+            time_window: Window length in seconds (per-chat flood_time_window)
+            now: Monotonic timestamp, defaults to the tracker's clock
+
+        Returns:
+            Message count in the window, including this one
+        """
+        if now is None:
+            now = self.clock()
+        self._max_window = max(self._max_window, time_window)
+
+        key = (chat_id, user_id)
+        window = self._windows.get(key)
+        if window is None:
+            window = deque(maxlen=self.MAX_EVENTS_PER_KEY)
+            self._windows[key] = window
+        else:
+            self._windows.move_to_end(key)
+
+        window.append(now)
+        cutoff = now - time_window
+        while window and window[0] <= cutoff:
+            window.popleft()
+
+        self._evict(now)
+        return len(window)
+
+    def count(self, chat_id: int, user_id: int, time_window: int,
+              now: Optional[float] = None) -> int:
+        """Return the message count in the window without recording"""
+        if now is None:
+            now = self.clock()
+
+        window = self._windows.get((chat_id, user_id))
+        if not window:
+            return 0
+
+        cutoff = now - time_window
+        return sum(1 for ts in window if ts > cutoff)
+
+    def reset(self, chat_id: int, user_id: int):
+        """Forget a user's history in a chat"""
+        self._windows.pop((chat_id, user_id), None)
+
+    def _evict(self, now: float):
+        """Drop idle keys and keep the key count bounded"""
+        idle_cutoff = now - self._max_window
+        while self._windows:
+            key, window = next(iter(self._windows.items()))
+            if len(self._windows) > self.max_keys or not window or window[-1] <= idle_cutoff:
+                del self._windows[key]
+            else:
+                break
@@ -0,0 +1,152 @@
+"""
+Webhook load generator for Telegram Moderator Bot
+POSTs synthetic updates to measure webhook throughput without Telegram
+
+Usage:
+    python loadgen.py                       # against an in-process webhook server
+    python loadgen.py --url http://127.0.0.1:8443/telegram --secret TOKEN
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List
+from urllib.parse import urlsplit
+
+from telegram import Bot, Update
+
+from webhook_server import SECRET_HEADER, WebhookServer
+
+TEXTS = [
+    "hey everyone, how is it going?",
+    "does anyone know when the next meetup is?",
+    "can someone share the link to the docs please",
+    "Check out http://cheap-crypto.example and http://win.example",
+    "I think the new release fixed the login bug",
+    "lol that's hilarious",
+]
+
+
+def synthetic_update(update_id: int, rng: random.Random, chats: int = 50,
+                     users: int = 500) -> Dict[str, Any]:
+    """A text message update as Telegram would post it"""
+    chat_id = -1001000000000 - rng.randrange(chats)
+    user_id = 1000 + rng.randrange(users)
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': f"Chat {chat_id}"},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+            'text': rng.choice(TEXTS),
+        },
+    }
+
+
+async def post(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+               host: str, path: str, secret: str, body: bytes) -> int:
+    """Send one POST on a keep-alive connection and return the status code"""
+    writer.write(
+        f"POST {path} HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"{SECRET_HEADER}: {secret}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def run_load(url: str, secret: str, updates: int, connections: int,
+                   seed: int = 42) -> Dict[str, Any]:
+    """POST `updates` synthetic updates over `connections` parallel connections"""
+    parts = urlsplit(url)
+    rng = random.Random(seed)
+    bodies = [json.dumps(synthetic_update(i, rng)).encode() for i in range(1, updates + 1)]
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+
+    async def worker(share: List[bytes]):
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        try:
+            for body in share:
+                start = time.perf_counter()
+                status = await post(reader, writer, parts.netloc, parts.path or '/', secret, body)
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(bodies[i::connections]) for i in range(connections)))
+    return {'elapsed': time.perf_counter() - start, 'latencies': latencies, 'statuses': statuses}
+
+
+def report(result: Dict[str, Any]):
+    latencies = sorted(result['latencies'])
+    sent = len(latencies)
+
+    def pct(p):
+        return latencies[min(sent - 1, int(sent * p))] * 1000
+
+    print(f"updates      {sent} ({', '.join(f'{n} x {s}' for s, n in sorted(result['statuses'].items()))})")
+    print(f"throughput   {sent / result['elapsed']:>8.0f} updates/s")
+    print(f"latency      p50 {pct(0.50):.2f} ms   p95 {pct(0.95):.2f} ms   p99 {pct(0.99):.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="webhook URL of a running bot (default: in-process server)")
+    parser.add_argument('--secret', default='loadgen-secret', help="webhook secret token")
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--connections', type=int, default=40,
+                        help="parallel keep-alive connections, like WEBHOOK_MAX_CONNECTIONS")
+    args = parser.parse_args()
+
+    if args.url:
+        report(await run_load(args.url, args.secret, args.updates, args.connections))
+        return
+
+    # In-process: server -> Update.de_json -> queue -> consumer, no Telegram involved
+    bot = Bot('123456:LOADGEN')
+    queue: asyncio.Queue = asyncio.Queue()
+    server = WebhookServer(queue, decode=lambda data: Update.de_json(data, bot),
+                           path='/telegram', secret_token=args.secret)
+    await server.start('127.0.0.1', 0)
+    delivered = 0
+
+    async def consume():
+        nonlocal delivered
+        while True:
+            update = await queue.get()
+            delivered += bool(update.message and update.message.text)
+
+    consumer = asyncio.create_task(consume())
+    try:
+        result = await run_load(f"http://127.0.0.1:{server.port}/telegram", args.secret,
+                                args.updates, args.connections)
+        await asyncio.sleep(0)
+    finally:
+        consumer.cancel()
+        await server.stop()
+    report(result)
+    print(f"delivered    {delivered} updates to the consumer")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
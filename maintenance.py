@@ -0,0 +1,134 @@
+"""
+Database maintenance module
+Periodic retention purges, planner statistics and incremental vacuum
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from config import Config
+from storage import Storage, retention_cutoff
+
+logger = logging.getLogger(__name__)
+
+
+class Maintenance:
+    """
+    Runs database housekeeping every `interval` seconds.
+
+    Each run purges rows past their retention (message tracking, warnings
+    and optionally ban history) in chunks of `chunk_size` rows, one short
+    writer transaction per chunk, so moderation writes queue behind at most
+    one chunk. It then refreshes planner statistics (PRAGMA optimize, plus a
+    sampled ANALYZE every `analyze_every` runs) and releases up to
+    `vacuum_pages` free pages with incremental vacuum. A retention of 0
+    keeps that table forever.
+    """
+
+    def __init__(self, db: Storage,
+                 interval: float = Config.MAINTENANCE_INTERVAL,
+                 message_retention_hours: float = Config.MESSAGE_RETENTION_HOURS,
+                 warning_retention_days: float = Config.WARNING_RETENTION_DAYS,
+                 ban_history_retention_days: float = Config.BAN_HISTORY_RETENTION_DAYS,
+                 chunk_size: int = Config.MAINTENANCE_CHUNK_SIZE,
+                 analyze_every: int = Config.MAINTENANCE_ANALYZE_EVERY,
+                 vacuum_pages: int = Config.MAINTENANCE_VACUUM_PAGES):
+        self.db = db
+        self.interval = interval
+        # table -> (retention in seconds, chunk purge)
+        self.retention: Dict[str, Any] = {
+            'user_messages': (message_retention_hours * 3600, db.purge_messages),
+            'warnings': (warning_retention_days * 86400, db.purge_warnings),
+            'bans': (ban_history_retention_days * 86400, db.purge_ban_history),
+        }
+        self.chunk_size = chunk_size
+        self.analyze_every = max(analyze_every, 1)
+        self.vacuum_pages = vacuum_pages
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.runs = 0
+        self.last_report: Dict[str, Any] = {}
+        self.total_purged = 0
+
+    def start(self):
+        """Run maintenance now and then every `interval` seconds"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # Cancelling mid-chunk is safe: the writer rolls the chunk back
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Database maintenance failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def _purge(self, purge: Callable[[str, int], Awaitable[int]], seconds: float,
+                     report: Dict[str, Any]) -> int:
+        before = retention_cutoff(seconds)
+        total = 0
+        while True:
+            start = time.perf_counter()
+            removed = await purge(before, self.chunk_size)
+            report['chunks'] += 1
+            report['max_chunk_ms'] = max(report['max_chunk_ms'], (time.perf_counter() - start) * 1000)
+            total += removed
+            if removed < self.chunk_size:
+                return total
+            # Let queued writers in between chunks
+            await asyncio.sleep(0)
+
+    async def run_once(self) -> Dict[str, Any]:
+        """One maintenance pass; returns what it did and how long each step took"""
+        started = time.perf_counter()
+        report: Dict[str, Any] = {'purged': {}, 'seconds': {}, 'chunks': 0, 'max_chunk_ms': 0.0}
+
+        for table, (seconds, purge) in self.retention.items():
+            if seconds <= 0:
+                continue
+            start = time.perf_counter()
+            report['purged'][table] = await self._purge(purge, seconds, report)
+            report['seconds'][table] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        report['analyzed'] = self.runs % self.analyze_every == 0
+        await self.db.optimize(analyze=report['analyzed'])
+        report['seconds']['optimize'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        report['vacuumed_pages'] = await self.db.incremental_vacuum(self.vacuum_pages)
+        report['seconds']['vacuum'] = time.perf_counter() - start
+        if report['vacuumed_pages'] is None and self.runs == 0:
+            logger.info("Database was created without auto_vacuum=INCREMENTAL; "
+                        "free pages are only reclaimed by a manual VACUUM")
+
+        report['total_seconds'] = time.perf_counter() - started
+        self.runs += 1
+        self.total_purged += sum(report['purged'].values())
+        self.last_report = report
+        logger.info(
+            f"Database maintenance: purged {report['purged']} in {report['chunks']} chunks "
+            f"(longest {report['max_chunk_ms']:.1f} ms), vacuumed {report['vacuumed_pages'] or 0} pages, "
+            f"{report['total_seconds']:.2f}s total"
+        )
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'runs': self.runs,
+            'total_purged': self.total_purged,
+            'last_report': self.last_report,
+        }
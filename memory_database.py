@@ -0,0 +1,215 @@
+"""
+In-memory storage module
+Storage kept in plain dicts, for tests, benchmarks and replays
+"""
+import itertools
+import logging
+import time
+from collections import Counter
+from dataclasses import replace
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from metrics import timed
+from records import BanRecord, ChatConfig, WarningRecord
+from storage import DB_QUERY_SECONDS, Storage, retention_cutoff, utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryDatabase(Storage):
+    """
+    Storage that lives and dies with the process.
+
+    Behaves like the SQL backends (same return values, ordering, retention
+    and counter semantics) without any I/O, so the storage tests run
+    without a server and benchmarks can separate database cost from the
+    rest of the hot path. Nothing is shared between processes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._ids = itertools.count(1)
+        # (chat_id, user_id) -> rows, oldest first
+        self.warnings: Dict[Tuple[int, int], List[WarningRecord]] = {}
+        self.warning_totals: Counter = Counter()
+        self.bans: List[BanRecord] = []
+        # (chat_id, user_id) -> (username, ban_until or None)
+        self.active_bans: Dict[Tuple[int, int], Tuple[str, Optional[float]]] = {}
+        self.chat_configs: Dict[int, ChatConfig] = {}
+        # (user_id, chat_id, utc_timestamp()), oldest first
+        self.messages: List[Tuple[int, int, str]] = []
+        self.admins: Dict[int, Set[int]] = {}
+
+    async def initialize(self):
+        """Nothing to connect to"""
+
+    async def close(self):
+        """Nothing to disconnect; the data is kept until the object goes away"""
+
+    @timed(DB_QUERY_SECONDS)
+    async def add_warning(self, user_id: int, chat_id: int, username: str,
+                          reason: str, warned_by: int) -> int:
+        """Add a warning for a user, returning the user's new warning count"""
+        self.warnings.setdefault((chat_id, user_id), []).append(WarningRecord(
+            next(self._ids), user_id, chat_id, username, reason, warned_by, utc_timestamp()
+        ))
+        self.warning_totals[(chat_id, user_id)] += 1
+        return self.warning_totals[(chat_id, user_id)]
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_warnings(self, user_id: int, chat_id: int) -> List[WarningRecord]:
+        """Get all warnings for a user in a chat"""
+        # Records are immutable, so callers can share the stored ones
+        return self.warnings.get((chat_id, user_id), [])[::-1]
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_warning_count(self, user_id: int, chat_id: int) -> int:
+        """Get warning count for a user"""
+        return self.warning_totals.get((chat_id, user_id), 0)
+
+    @timed(DB_QUERY_SECONDS)
+    async def clear_warnings(self, user_id: int, chat_id: int) -> int:
+        """Clear all warnings for a user"""
+        self.warning_totals.pop((chat_id, user_id), None)
+        return len(self.warnings.pop((chat_id, user_id), []))
+
+    @timed(DB_QUERY_SECONDS)
+    async def add_ban(self, user_id: int, chat_id: int, username: str,
+                      reason: str, banned_by: int, duration: Optional[int] = None) -> Optional[int]:
+        """Add a ban record and mark the user as banned, returning the history id"""
+        self._record_bans([(user_id, chat_id, username)], reason, banned_by, duration)
+        return self.bans[-1].id
+
+    @timed(DB_QUERY_SECONDS)
+    async def add_bans(self, bans: Iterable[Tuple[int, int, str]], reason: str,
+                       banned_by: int, duration: Optional[int] = None) -> int:
+        """Record many bans, returning how many were written"""
+        return self._record_bans(bans, reason, banned_by, duration)
+
+    def _record_bans(self, bans: Iterable[Tuple[int, int, str]], reason: str,
+                     banned_by: int, duration: Optional[int]) -> int:
+        ban_until = (datetime.now() + timedelta(seconds=duration)).isoformat() if duration else None
+        expires = time.time() + duration if duration else None
+        timestamp = utc_timestamp()
+        written = 0
+        for user_id, chat_id, username in bans:
+            self.bans.append(BanRecord(next(self._ids), user_id, chat_id, username, reason,
+                                       banned_by, ban_until, duration is None, timestamp))
+            self.active_bans[(chat_id, user_id)] = (username, expires)
+            written += 1
+        return written
+
+    @timed(DB_QUERY_SECONDS)
+    async def is_banned(self, user_id: int, chat_id: int) -> bool:
+        """Check if user is currently banned"""
+        ban = self.active_bans.get((chat_id, user_id))
+        return ban is not None and (ban[1] is None or ban[1] > time.time())
+
+    @timed(DB_QUERY_SECONDS)
+    async def remove_ban(self, user_id: int, chat_id: int) -> bool:
+        """Mark a user as no longer banned (the history is kept)"""
+        return self.active_bans.pop((chat_id, user_id), None) is not None
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_expiring_bans(self) -> List[Tuple[int, int, float]]:
+        """(chat_id, user_id, ban_until) of every temporary ban still active"""
+        return [(chat_id, user_id, until)
+                for (chat_id, user_id), (_, until) in self.active_bans.items() if until is not None]
+
+    @timed(DB_QUERY_SECONDS)
+    async def lift_expired_bans(self, bans: Iterable[Tuple[int, int]], now: float) -> int:
+        """Remove temporary bans that ran out by `now`"""
+        lifted = 0
+        for key in bans:
+            ban = self.active_bans.get(key)
+            if ban is not None and ban[1] is not None and ban[1] <= now:
+                del self.active_bans[key]
+                lifted += 1
+        return lifted
+
+    async def _load_chat_config(self, chat_id: int) -> Optional[ChatConfig]:
+        """The stored settings of a chat, or None"""
+        return self.chat_configs.get(chat_id)
+
+    async def _store_chat_config(self, chat_id: int, settings: Dict[str, Any]):
+        """Create the chat's settings if needed and update `settings` in them"""
+        config = self.chat_configs.get(chat_id) or self._default_chat_config(chat_id)
+        self.chat_configs[chat_id] = replace(config, **settings)
+
+    @timed(DB_QUERY_SECONDS)
+    async def track_message(self, user_id: int, chat_id: int):
+        """Track a user message (flood detection itself uses FloodTracker)"""
+        self.messages.append((user_id, chat_id, utc_timestamp()))
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_recent_message_count(self, user_id: int, chat_id: int,
+                                       time_window: int) -> int:
+        """Get message count in time window"""
+        since = retention_cutoff(int(time_window))
+        count = 0
+        for message in reversed(self.messages):
+            if message[2] <= since:
+                break
+            if message[0] == user_id and message[1] == chat_id:
+                count += 1
+        return count
+
+    @timed(DB_QUERY_SECONDS)
+    async def purge_messages(self, before: str, limit: int) -> int:
+        """Delete up to `limit` message tracking rows older than `before`"""
+        removed = 0
+        while removed < limit and removed < len(self.messages) and self.messages[removed][2] < before:
+            removed += 1
+        del self.messages[:removed]
+        return removed
+
+    @timed(DB_QUERY_SECONDS)
+    async def purge_ban_history(self, before: str, limit: int) -> int:
+        """Delete up to `limit` ban history rows older than `before` (active bans stay)"""
+        removed = 0
+        while removed < limit and removed < len(self.bans) and self.bans[removed].timestamp < before:
+            removed += 1
+        del self.bans[:removed]
+        return removed
+
+    @timed(DB_QUERY_SECONDS)
+    async def purge_warnings(self, before: str, limit: int) -> int:
+        """Delete up to `limit` warnings older than `before`, keeping counters in step"""
+        removed = 0
+        for key in list(self.warnings):
+            rows = self.warnings[key]
+            old = 0
+            while old < len(rows) and removed < limit and rows[old].timestamp < before:
+                old += 1
+                removed += 1
+            if not old:
+                continue
+            del rows[:old]
+            if not rows:
+                del self.warnings[key]
+            self.warning_totals[key] -= old
+            if self.warning_totals[key] <= 0:
+                del self.warning_totals[key]
+        return removed
+
+    @timed(DB_QUERY_SECONDS)
+    async def optimize(self, analyze: bool = False):
+        """No query planner to refresh"""
+
+    @timed(DB_QUERY_SECONDS)
+    async def incremental_vacuum(self, pages: int) -> Optional[int]:
+        """No pages to release"""
+        return 0
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_admins(self) -> Dict[int, Set[int]]:
+        """Get the last known admin set of every chat"""
+        return {chat_id: set(user_ids) for chat_id, user_ids in self.admins.items()}
+
+    @timed(DB_QUERY_SECONDS)
+    async def set_chat_admins(self, chat_id: int, user_ids: Iterable[int],
+                              added_by: Optional[int] = None):
+        """Replace the stored admin set of a chat"""
+        self.admins[chat_id] = set(user_ids)
+        if not self.admins[chat_id]:
+            del self.admins[chat_id]
@@ -0,0 +1,252 @@
+"""
+Metrics module
+Counters and latency histograms exported in the Prometheus text format
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans cache hits (~10 us) to slow API calls
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (name, type, help, [(labels, value), ...]) as returned by collectors
+Family = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample(name: str, labels: Dict[str, Any], value: float) -> str:
+    if labels:
+        name += '{' + ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items()) + '}'
+    return f"{name} {float(value)!r}"
+
+
+class Counter:
+    """Monotonic counter, one series per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    @property
+    def family(self) -> str:
+        """Name in the HELP/TYPE lines, matching the samples"""
+        return self.name + '_total'
+
+    def collect(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield _sample(self.family, dict(zip(self.labelnames, labels)), value)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: 'Histogram', labels: Tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, one series per label combination.
+
+    observe() is a dict lookup, a bisect and three increments; cumulative
+    bucket counts are only computed when the metrics are scraped.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple, List[Any]] = {}
+
+    @property
+    def family(self) -> str:
+        """Name in the HELP/TYPE lines; samples add _bucket, _sum and _count"""
+        return self.name
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels) -> _Timer:
+        """Context manager observing the elapsed time of its block"""
+        return _Timer(self, labels)
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def counts(self) -> Dict[Tuple, int]:
+        """Observation count per label combination"""
+        return {labels: series[2] for labels, series in self._series.items()}
+
+    def collect(self) -> Iterable[str]:
+        for labels, (counts, total, count) in self._series.items():
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield _sample(self.name + '_bucket', dict(base, le=le), cumulative)
+            yield _sample(self.name + '_sum', base, total)
+            yield _sample(self.name + '_count', base, count)
+
+
+class Registry:
+    """Metrics recorded in-process plus collectors polled at scrape time"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def _get(self, cls, name: str, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, labelnames, buckets)
+
+    def register(self, collector: Callable[[], Iterable[Family]]):
+        """
+        Add a callback returning (name, type, help, samples) families
+
+        Lets components that already keep counters (caches, queues) be
+        exported without touching their hot paths.
+        """
+        self._collectors.append(collector)
+
+    def unregister(self, collector: Callable[[], Iterable[Family]]):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.family} {metric.documentation}")
+            lines.append(f"# TYPE {metric.family} {metric.kind}")
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {str(e)}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(_sample(name, labels, value) for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def timed(histogram: Histogram):
+    """Record the latency of an async method, labelled with its name"""
+    def decorate(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorate
+
+
+class MetricsServer:
+    """Serves GET /metrics from a registry on a local port"""
+
+    def __init__(self, registry: Registry = REGISTRY, path: str = '/metrics'):
+        self.registry = registry
+        self.path = path
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def port(self) -> Optional[int]:
+        if self.server is None or not self.server.sockets:
+            return None
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = Config.METRICS_LISTEN, port: int = Config.METRICS_PORT):
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Metrics available at http://{host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            # Headers are not needed; read past them
+            while await reader.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            method, target, _ = request_line.decode('latin-1').split()
+            if target.split('?', 1)[0] != self.path:
+                status, body = '404 Not Found', b''
+            elif method != 'GET':
+                status, body = '405 Method Not Allowed', b''
+            else:
+                status, body = '200 OK', self.registry.render().encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
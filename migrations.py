@@ -0,0 +1,228 @@
+"""
+Schema migration module
+Ordered, versioned schema changes for the SQLite store
+"""
+import logging
+from typing import List, Optional, Tuple
+import aiosqlite
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+# (version, description, statements) - append new steps, never edit applied ones
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "Initial schema", [
+        # Warnings table
+        '''
+        CREATE TABLE IF NOT EXISTS warnings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            username TEXT,
+            reason TEXT,
+            warned_by INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Bans table
+        '''
+        CREATE TABLE IF NOT EXISTS bans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            username TEXT,
+            reason TEXT,
+            banned_by INTEGER,
+            ban_until DATETIME,
+            is_permanent BOOLEAN DEFAULT 0,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Chat configurations table
+        '''
+        CREATE TABLE IF NOT EXISTS chat_config (
+            chat_id INTEGER PRIMARY KEY,
+            warn_limit INTEGER DEFAULT 3,
+            ban_duration INTEGER DEFAULT 3600,
+            enable_ai_moderation BOOLEAN DEFAULT 1,
+            flood_threshold INTEGER DEFAULT 5,
+            flood_time_window INTEGER DEFAULT 10,
+            auto_delete_spam BOOLEAN DEFAULT 1,
+            welcome_message TEXT,
+            rules TEXT
+        )
+        ''',
+        # User message tracking
+        '''
+        CREATE TABLE IF NOT EXISTS user_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Admin list
+        '''
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            added_by INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, chat_id)
+        )
+        ''',
+    ]),
+    (2, "Per-user lookup indexes", [
+        # get_warnings / get_warning_count / clear_warnings
+        '''
+        CREATE INDEX IF NOT EXISTS idx_warnings_chat_user_ts
+        ON warnings (chat_id, user_id, timestamp)
+        ''',
+        # is_banned (latest ban first)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_bans_chat_user_ts
+        ON bans (chat_id, user_id, timestamp)
+        ''',
+        # get_recent_message_count
+        '''
+        CREATE INDEX IF NOT EXISTS idx_user_messages_chat_user_ts
+        ON user_messages (chat_id, user_id, timestamp)
+        ''',
+        # cleanup_old_messages range deletes
+        '''
+        CREATE INDEX IF NOT EXISTS idx_user_messages_ts
+        ON user_messages (timestamp)
+        ''',
+    ]),
+    (3, "Maintained warning counters", [
+        # add_warning / get_warning_count without a COUNT(*) scan
+        '''
+        CREATE TABLE IF NOT EXISTS warning_counts (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+        # Seed from the warnings already on record
+        '''
+        INSERT OR REPLACE INTO warning_counts (chat_id, user_id, count)
+        SELECT chat_id, user_id, COUNT(*) FROM warnings GROUP BY chat_id, user_id
+        ''',
+    ]),
+    (4, "Active bans", [
+        # Current bans only; the bans table stays as the audit history.
+        # ban_until is a Unix timestamp, NULL for permanent bans
+        '''
+        CREATE TABLE IF NOT EXISTS active_bans (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            ban_until REAL,
+            PRIMARY KEY (chat_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+        # Loading pending expiries at startup
+        '''
+        CREATE INDEX IF NOT EXISTS idx_active_bans_until
+        ON active_bans (ban_until) WHERE ban_until IS NOT NULL
+        ''',
+        # Seed from each user's latest ban that hasn't run out (history
+        # stores ban_until as local ISO time)
+        '''
+        INSERT OR REPLACE INTO active_bans (chat_id, user_id, username, ban_until)
+        SELECT chat_id, user_id, username,
+               CASE WHEN is_permanent THEN NULL
+                    ELSE CAST(strftime('%s', ban_until, 'utc') AS REAL) END
+        FROM bans AS latest
+        WHERE id = (
+            SELECT id FROM bans
+            WHERE chat_id = latest.chat_id AND user_id = latest.user_id
+            ORDER BY timestamp DESC, id DESC LIMIT 1
+        )
+        AND (is_permanent OR CAST(strftime('%s', ban_until, 'utc') AS REAL) > CAST(strftime('%s', 'now') AS REAL))
+        ''',
+    ]),
+    (5, "Retention indexes", [
+        # Maintenance range deletes of old warnings and ban history
+        '''
+        CREATE INDEX IF NOT EXISTS idx_warnings_ts
+        ON warnings (timestamp)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_bans_ts
+        ON bans (timestamp)
+        ''',
+    ]),
+]
+
+
+async def apply_pragmas(db: aiosqlite.Connection):
+    """Per-connection tuning: WAL journal, relaxed fsync, larger page cache"""
+    # Only takes effect on a new database (before the first table exists);
+    # lets maintenance hand free pages back with incremental_vacuum
+    await db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    await db.execute('PRAGMA journal_mode = WAL')
+    # Safe with WAL: a power loss can only roll back the last transactions
+    await db.execute('PRAGMA synchronous = NORMAL')
+    # Negative value is in KiB rather than pages
+    await db.execute(f'PRAGMA cache_size = -{int(Config.DATABASE_CACHE_KB)}')
+    await db.execute('PRAGMA temp_store = MEMORY')
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    """Return the highest applied migration version (0 for a fresh database)"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    async with db.execute('SELECT MAX(version) FROM schema_version') as cursor:
+        result = await cursor.fetchone()
+        return result[0] or 0
+
+
+async def migrate(db: aiosqlite.Connection, target: Optional[int] = None) -> int:
+    """
+    Apply pending migrations in order, one transaction per step
+
+    Args:
+        db: Writer connection
+        target: Stop after this version (default: latest)
+
+    Returns:
+        The schema version after migrating
+    """
+    current = await get_schema_version(db)
+    await db.commit()
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+
+        try:
+            # Explicit BEGIN so DDL is part of the step's transaction too;
+            # IMMEDIATE takes the write lock up front, so when several
+            # worker processes start at once each step is applied only once
+            await db.execute('BEGIN IMMEDIATE')
+            current = await get_schema_version(db)
+            if version <= current:
+                await db.rollback()
+                continue
+            for statement in statements:
+                await db.execute(statement)
+            await db.execute('''
+                INSERT INTO schema_version (version, description) VALUES (?, ?)
+            ''', (version, description))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        current = version
+        logger.info(f"Applied schema migration {version}: {description}")
+
+    return current
@@ -0,0 +1,606 @@
+"""
+PostgreSQL storage module
+Storage on a shared PostgreSQL server through an asyncpg connection pool
+
+Experimental: not offered by create_storage until the storage tests have
+passed against a real server (run test_bot.py with TEST_POSTGRES_DSN set).
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from config import Config
+from metrics import timed
+from records import ChatConfig, WarningRecord
+from storage import DB_QUERY_SECONDS, Storage
+
+logger = logging.getLogger(__name__)
+
+# Any constant works; every instance migrating against the same server takes it
+MIGRATION_LOCK_ID = 0x6d6f6462
+
+# (version, description, statements) - append new steps, never edit applied ones.
+# Mirrors the SQLite schema in migrations.py as it stands after its step 5;
+# timestamps are UTC without a time zone, ids and chat ids are BIGINT
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "Initial schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS warnings (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            username TEXT,
+            reason TEXT,
+            warned_by BIGINT,
+            timestamp TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS bans (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            username TEXT,
+            reason TEXT,
+            banned_by BIGINT,
+            ban_until TIMESTAMP,
+            is_permanent BOOLEAN NOT NULL DEFAULT FALSE,
+            timestamp TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS chat_config (
+            chat_id BIGINT PRIMARY KEY,
+            warn_limit INTEGER DEFAULT 3,
+            ban_duration INTEGER DEFAULT 3600,
+            enable_ai_moderation BOOLEAN DEFAULT TRUE,
+            flood_threshold INTEGER DEFAULT 5,
+            flood_time_window INTEGER DEFAULT 10,
+            auto_delete_spam BOOLEAN DEFAULT TRUE,
+            welcome_message TEXT,
+            rules TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_messages (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            timestamp TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            added_by BIGINT,
+            timestamp TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            PRIMARY KEY (user_id, chat_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS warning_counts (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, user_id)
+        )
+        ''',
+        # ban_until is a Unix timestamp, NULL for permanent bans
+        '''
+        CREATE TABLE IF NOT EXISTS active_bans (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            username TEXT,
+            ban_until DOUBLE PRECISION,
+            PRIMARY KEY (chat_id, user_id)
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_warnings_chat_user_ts
+        ON warnings (chat_id, user_id, timestamp)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_user_messages_chat_user_ts
+        ON user_messages (chat_id, user_id, timestamp)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_active_bans_until
+        ON active_bans (ban_until) WHERE ban_until IS NOT NULL
+        ''',
+        # Retention range deletes
+        'CREATE INDEX IF NOT EXISTS idx_warnings_ts ON warnings (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_bans_ts ON bans (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_user_messages_ts ON user_messages (timestamp)',
+    ]),
+]
+
+_ACTIVE_BAN_CONFLICT = (' ON CONFLICT (chat_id, user_id) DO UPDATE SET '
+                        'username = excluded.username, ban_until = excluded.ban_until')
+
+
+def _utc_now() -> datetime:
+    """Naive UTC datetime, as the TIMESTAMP columns store it"""
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def _parse_timestamp(value: str) -> datetime:
+    """A utc_timestamp() string as a TIMESTAMP parameter"""
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+
+def _rowcount(status: str) -> int:
+    """Rows affected, from a command tag such as 'DELETE 3'"""
+    return int(status.rsplit(' ', 1)[-1])
+
+
+async def migrate(conn, target: Optional[int] = None) -> int:
+    """
+    Apply pending migrations in order, one transaction per step
+
+    Each step holds a transaction-level advisory lock, so instances
+    starting together against the same server apply it only once.
+
+    Returns:
+        The schema version after migrating
+    """
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+        )
+    ''')
+    current = 0
+    for version, description, statements in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        async with conn.transaction():
+            await conn.execute('SELECT pg_advisory_xact_lock($1)', MIGRATION_LOCK_ID)
+            current = await conn.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+            if version <= current:
+                continue
+            for statement in statements:
+                await conn.execute(statement)
+            await conn.execute('''
+                INSERT INTO schema_version (version, description) VALUES ($1, $2)
+            ''', version, description)
+        current = version
+        logger.info(f"Applied PostgreSQL schema migration {version}: {description}")
+    return current
+
+
+class MessageBuffer:
+    """
+    Message tracking rows waiting for the next COPY.
+
+    Rows are flushed every `flush_interval` seconds or as soon as `max_batch`
+    are pending. Only user_messages goes through here: warnings and bans are
+    a single statement each already.
+    """
+
+    def __init__(self, db: 'PostgresDatabase',
+                 flush_interval: float = Config.WRITE_FLUSH_INTERVAL_MS / 1000,
+                 max_batch: int = Config.WRITE_BATCH_SIZE):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.rows: List[Tuple[int, int, datetime]] = []
+        self._pending_keys: Counter = Counter()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.rows_failed = 0
+
+    @property
+    def depth(self) -> int:
+        """Rows waiting to be written"""
+        return len(self.rows)
+
+    def start(self):
+        """Start the background flusher"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background flusher and write everything still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def put(self, row: Tuple[int, int, datetime]):
+        """Buffer a row, flushing once a full batch is waiting"""
+        self.start()
+        self.rows.append(row)
+        self._pending_keys[row[:2]] += 1
+        if len(self.rows) >= self.max_batch:
+            await self.flush()
+
+    async def flush(self):
+        """COPY all buffered rows"""
+        async with self._flush_lock:
+            batch, self.rows = self.rows, []
+            if not batch:
+                return
+            self._pending_keys = Counter()
+            try:
+                async with self.db.pool.acquire() as conn:
+                    await conn.copy_records_to_table(
+                        'user_messages', records=batch,
+                        columns=('user_id', 'chat_id', 'timestamp'),
+                    )
+                self.rows_flushed += len(batch)
+            except Exception as e:
+                self.rows_failed += len(batch)
+                logger.error(f"Message tracking flush of {len(batch)} rows failed: {str(e)}")
+            self.flushes += 1
+
+    async def flush_for(self, user_id: int, chat_id: int):
+        """Make buffered rows of this user visible before reading"""
+        # A COPY in progress may hold them too; flush() waits for it
+        if self._pending_keys[(user_id, chat_id)] > 0 or self._flush_lock.locked():
+            await self.flush()
+
+    async def _run(self):
+        """Flush whatever is buffered every flush_interval"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Shielded so stop() never cancels a COPY halfway through
+            await asyncio.shield(self.flush())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': self.depth,
+            'flushes': self.flushes,
+            'rows_flushed': self.rows_flushed,
+            'rows_failed': self.rows_failed,
+        }
+
+
+class PostgresDatabase(Storage):
+    """
+    Storage on PostgreSQL, shareable by bot instances on several hosts.
+
+    Queries run on an asyncpg pool; asyncpg prepares each statement once per
+    connection and reuses it from its statement cache. Every method is one
+    round-trip: the history row and the counter or active-ban upsert go in
+    a single statement with data-modifying CTEs, and batches (mass bans,
+    admin lists, expired bans) are sent as arrays and expanded with unnest.
+    With write-behind, message tracking rows are buffered and COPYed in.
+    """
+
+    def __init__(self, dsn: str = Config.POSTGRES_DSN,
+                 pool_size: int = Config.POSTGRES_POOL_SIZE,
+                 write_behind: bool = False):
+        try:
+            import asyncpg
+        except ImportError as e:
+            raise ImportError(
+                "The postgres storage backend needs 'asyncpg' (pip install asyncpg)"
+            ) from e
+
+        super().__init__()
+        self._asyncpg = asyncpg
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self.pool = None
+        self.write_queue = MessageBuffer(self) if write_behind else None
+
+    @timed(DB_QUERY_SECONDS)
+    async def initialize(self):
+        """Open the connection pool and bring the schema up to date"""
+        self.pool = await self._asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        async with self.pool.acquire() as conn:
+            await migrate(conn)
+        if self.write_queue:
+            self.write_queue.start()
+
+    async def close(self):
+        """Flush buffered rows and close the connection pool"""
+        if self.pool is None:
+            return
+        if self.write_queue:
+            await self.write_queue.stop()
+        await self.pool.close()
+        self.pool = None
+
+    @timed(DB_QUERY_SECONDS)
+    async def flush(self):
+        """Write everything still buffered"""
+        if self.write_queue:
+            await self.write_queue.flush()
+
+    @timed(DB_QUERY_SECONDS)
+    async def add_warning(self, user_id: int, chat_id: int, username: str,
+                          reason: str, warned_by: int) -> int:
+        """
+        Add a warning for a user
+
+        Returns:
+            The user's warning count in the chat, including this warning
+        """
+        # The upsert locks the counter row, so concurrent warnings (from any
+        # instance) each get a distinct count
+        return await self.pool.fetchval('''
+            WITH warning AS (
+                INSERT INTO warnings (user_id, chat_id, username, reason, warned_by, timestamp)
+                VALUES ($1, $2, $3, $4, $5, $6)
+            )
+            INSERT INTO warning_counts (chat_id, user_id, count) VALUES ($2, $1, 1)
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET count = warning_counts.count + 1
+            RETURNING count
+        ''', user_id, chat_id, username, reason, warned_by, _utc_now())
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_warnings(self, user_id: int, chat_id: int) -> List[WarningRecord]:
+        """Get all warnings for a user in a chat"""
+        rows = await self.pool.fetch('''
+            SELECT id, user_id, chat_id, username, reason, warned_by,
+                   to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS') AS timestamp
+            FROM warnings
+            WHERE chat_id = $1 AND user_id = $2
+            ORDER BY warnings.timestamp DESC, id DESC
+        ''', chat_id, user_id)
+        return [WarningRecord(*row) for row in rows]
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_warning_count(self, user_id: int, chat_id: int) -> int:
+        """Get warning count for a user"""
+        count = await self.pool.fetchval('''
+            SELECT count FROM warning_counts WHERE chat_id = $1 AND user_id = $2
+        ''', chat_id, user_id)
+        return count or 0
+
+    @timed(DB_QUERY_SECONDS)
+    async def clear_warnings(self, user_id: int, chat_id: int) -> int:
+        """Clear all warnings for a user"""
+        return await self.pool.fetchval('''
+            WITH counter AS (
+                DELETE FROM warning_counts WHERE chat_id = $1 AND user_id = $2
+            ), cleared AS (
+                DELETE FROM warnings WHERE chat_id = $1 AND user_id = $2 RETURNING 1
+            )
+            SELECT COUNT(*) FROM cleared
+        ''', chat_id, user_id)
+
+    @timed(DB_QUERY_SECONDS)
+    async def add_ban(self, user_id: int, chat_id: int, username: str,
+                      reason: str, banned_by: int, duration: Optional[int] = None) -> Optional[int]:
+        """
+        Add a ban record and mark the user as banned
+
+        Returns:
+            The history row id
+        """
+        # History keeps local time like the SQLite store; active_bans a Unix time
+        ban_until = datetime.now() + timedelta(seconds=duration) if duration else None
+        expires = time.time() + duration if duration else None
+        return await self.pool.fetchval('''
+            WITH active AS (
+                INSERT INTO active_bans (chat_id, user_id, username, ban_until)
+                VALUES ($2, $1, $3, $8)
+            ''' + _ACTIVE_BAN_CONFLICT + '''
+            )
+            INSERT INTO bans (user_id, chat_id, username, reason, banned_by,
+                              ban_until, is_permanent, timestamp)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $9)
+            RETURNING id
+        ''', user_id, chat_id, username, reason, banned_by, ban_until, duration is None,
+            expires, _utc_now())
+
+    @timed(DB_QUERY_SECONDS)
+    async def add_bans(self, bans: Iterable[Tuple[int, int, str]], reason: str,
+                       banned_by: int, duration: Optional[int] = None) -> int:
+        """
+        Record many bans in one statement, the rows sent as arrays
+
+        Args:
+            bans: (user_id, chat_id, username) per banned user
+
+        Returns:
+            Number of rows written
+        """
+        bans = list(bans)
+        if not bans:
+            return 0
+        ban_until = datetime.now() + timedelta(seconds=duration) if duration else None
+        expires = time.time() + duration if duration else None
+        user_ids, chat_ids, usernames = (list(column) for column in zip(*bans))
+        # ON CONFLICT can't touch a row twice per statement: keep the
+        # last entry for a user banned more than once in the batch
+        await self.pool.execute('''
+            WITH batch AS (
+                SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::text[])
+                    WITH ORDINALITY AS b (user_id, chat_id, username, position)
+            ), history AS (
+                INSERT INTO bans (user_id, chat_id, username, reason, banned_by,
+                                  ban_until, is_permanent, timestamp)
+                SELECT user_id, chat_id, username, $4::text, $5::bigint, $6::timestamp,
+                       $7::boolean, $9::timestamp
+                FROM batch ORDER BY position
+            )
+            INSERT INTO active_bans (chat_id, user_id, username, ban_until)
+            SELECT DISTINCT ON (chat_id, user_id) chat_id, user_id, username, $8::double precision
+            FROM batch ORDER BY chat_id, user_id, position DESC
+        ''' + _ACTIVE_BAN_CONFLICT, user_ids, chat_ids, usernames, reason, banned_by,
+            ban_until, duration is None, expires, _utc_now())
+        return len(bans)
+
+    @timed(DB_QUERY_SECONDS)
+    async def is_banned(self, user_id: int, chat_id: int) -> bool:
+        """Check if user is currently banned"""
+        # Expired bans count as lifted even before the scheduler removes them
+        return await self.pool.fetchval('''
+            SELECT EXISTS (
+                SELECT 1 FROM active_bans
+                WHERE chat_id = $1 AND user_id = $2 AND (ban_until IS NULL OR ban_until > $3)
+            )
+        ''', chat_id, user_id, time.time())
+
+    @timed(DB_QUERY_SECONDS)
+    async def remove_ban(self, user_id: int, chat_id: int) -> bool:
+        """Mark a user as no longer banned (the history is kept)"""
+        status = await self.pool.execute('''
+            DELETE FROM active_bans WHERE chat_id = $1 AND user_id = $2
+        ''', chat_id, user_id)
+        return _rowcount(status) > 0
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_expiring_bans(self) -> List[Tuple[int, int, float]]:
+        """(chat_id, user_id, ban_until) of every temporary ban still active"""
+        rows = await self.pool.fetch('''
+            SELECT chat_id, user_id, ban_until FROM active_bans
+            WHERE ban_until IS NOT NULL
+        ''')
+        return [tuple(row) for row in rows]
+
+    @timed(DB_QUERY_SECONDS)
+    async def lift_expired_bans(self, bans: Iterable[Tuple[int, int]], now: float) -> int:
+        """
+        Remove temporary bans that ran out by `now`
+
+        A ban renewed meanwhile expires later than `now` and is left alone.
+        """
+        bans = list(bans)
+        if not bans:
+            return 0
+        chat_ids, user_ids = (list(column) for column in zip(*bans))
+        status = await self.pool.execute('''
+            DELETE FROM active_bans AS a
+            USING unnest($1::bigint[], $2::bigint[]) AS e (chat_id, user_id)
+            WHERE a.chat_id = e.chat_id AND a.user_id = e.user_id AND a.ban_until <= $3
+        ''', chat_ids, user_ids, now)
+        return _rowcount(status)
+
+    async def _load_chat_config(self, chat_id: int) -> Optional[ChatConfig]:
+        """The stored settings of a chat, or None"""
+        row = await self.pool.fetchrow('SELECT * FROM chat_config WHERE chat_id = $1', chat_id)
+        return ChatConfig.from_row(row) if row else None
+
+    async def _store_chat_config(self, chat_id: int, settings: Dict[str, Any]):
+        """Create the chat's settings row if needed and update `settings` in it"""
+        if not settings:
+            await self.pool.execute('''
+                INSERT INTO chat_config (chat_id) VALUES ($1) ON CONFLICT (chat_id) DO NOTHING
+            ''', chat_id)
+            return
+        # Keys were checked against CHAT_CONFIG_COLUMNS by set_chat_config
+        columns = list(settings)
+        await self.pool.execute(
+            f"INSERT INTO chat_config (chat_id, {', '.join(columns)}) "
+            f"VALUES ($1, {', '.join(f'${i}' for i in range(2, len(columns) + 2))}) "
+            f"ON CONFLICT (chat_id) DO UPDATE SET "
+            f"{', '.join(f'{column} = excluded.{column}' for column in columns)}",
+            chat_id, *settings.values()
+        )
+
+    @timed(DB_QUERY_SECONDS)
+    async def track_message(self, user_id: int, chat_id: int):
+        """Track a user message (flood detection itself uses FloodTracker)"""
+        if self.write_queue:
+            await self.write_queue.put((user_id, chat_id, _utc_now()))
+            return
+        await self.pool.execute('''
+            INSERT INTO user_messages (user_id, chat_id, timestamp) VALUES ($1, $2, $3)
+        ''', user_id, chat_id, _utc_now())
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_recent_message_count(self, user_id: int, chat_id: int,
+                                       time_window: int) -> int:
+        """Get message count in time window"""
+        if self.write_queue:
+            await self.write_queue.flush_for(user_id, chat_id)
+        return await self.pool.fetchval('''
+            SELECT COUNT(*) FROM user_messages
+            WHERE chat_id = $1 AND user_id = $2 AND timestamp > $3
+        ''', chat_id, user_id, _utc_now() - timedelta(seconds=int(time_window)))
+
+    async def _purge(self, table: str, before: str, limit: int) -> int:
+        status = await self.pool.execute(f'''
+            DELETE FROM {table} WHERE id IN (
+                SELECT id FROM {table} WHERE timestamp < $1 LIMIT $2
+            )
+        ''', _parse_timestamp(before), limit)
+        return _rowcount(status)
+
+    @timed(DB_QUERY_SECONDS)
+    async def purge_messages(self, before: str, limit: int) -> int:
+        """Delete up to `limit` message tracking rows older than `before`"""
+        return await self._purge('user_messages', before, limit)
+
+    @timed(DB_QUERY_SECONDS)
+    async def purge_ban_history(self, before: str, limit: int) -> int:
+        """Delete up to `limit` ban history rows older than `before` (active bans stay)"""
+        return await self._purge('bans', before, limit)
+
+    @timed(DB_QUERY_SECONDS)
+    async def purge_warnings(self, before: str, limit: int) -> int:
+        """Delete up to `limit` warnings older than `before`, keeping counters in step"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                removed = await conn.fetch('''
+                    WITH removed AS (
+                        DELETE FROM warnings WHERE id IN (
+                            SELECT id FROM warnings WHERE timestamp < $1 LIMIT $2
+                        )
+                        RETURNING chat_id, user_id
+                    ), per_user AS (
+                        SELECT chat_id, user_id, COUNT(*) AS n FROM removed
+                        GROUP BY chat_id, user_id
+                    ), counters AS (
+                        UPDATE warning_counts AS w SET count = w.count - p.n
+                        FROM per_user AS p
+                        WHERE w.chat_id = p.chat_id AND w.user_id = p.user_id
+                    )
+                    SELECT chat_id, user_id, n FROM per_user
+                ''', _parse_timestamp(before), limit)
+                if removed:
+                    # A separate statement: CTEs don't see each other's updates
+                    await conn.execute('''
+                        DELETE FROM warning_counts AS w
+                        USING unnest($1::bigint[], $2::bigint[]) AS r (chat_id, user_id)
+                        WHERE w.chat_id = r.chat_id AND w.user_id = r.user_id AND w.count <= 0
+                    ''', [row['chat_id'] for row in removed], [row['user_id'] for row in removed])
+        return sum(row['n'] for row in removed)
+
+    @timed(DB_QUERY_SECONDS)
+    async def optimize(self, analyze: bool = False):
+        """Refresh the planner's statistics (autovacuum does this too; ANALYZE forces it)"""
+        if analyze:
+            await self.pool.execute('ANALYZE warnings, warning_counts, bans, active_bans, '
+                                    'user_messages, chat_config, admins')
+
+    @timed(DB_QUERY_SECONDS)
+    async def incremental_vacuum(self, pages: int) -> Optional[int]:
+        """Nothing to do: autovacuum makes freed space reusable on the server"""
+        return 0
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_admins(self) -> Dict[int, Set[int]]:
+        """Get the last known admin set of every chat"""
+        admins: Dict[int, Set[int]] = {}
+        for chat_id, user_id in await self.pool.fetch('SELECT chat_id, user_id FROM admins'):
+            admins.setdefault(chat_id, set()).add(user_id)
+        return admins
+
+    @timed(DB_QUERY_SECONDS)
+    async def set_chat_admins(self, chat_id: int, user_ids: Iterable[int],
+                              added_by: Optional[int] = None):
+        """Replace the stored admin set of a chat"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('DELETE FROM admins WHERE chat_id = $1', chat_id)
+                await conn.execute('''
+                    INSERT INTO admins (user_id, chat_id, added_by)
+                    SELECT DISTINCT unnest($2::bigint[]), $1::bigint, $3::bigint
+                ''', chat_id, list(user_ids), added_by)
@@ -0,0 +1,210 @@
+"""
+Raid mode module
+Detects join/flag spikes and removes offenders in batched sweeps
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from action_scheduler import ActionScheduler
+from ban_expiry import BanExpiryScheduler
+from cache import TTLCache
+from config import Config
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class _ChatRaid:
+    """Spike counters and collected offenders of one chat"""
+
+    def __init__(self):
+        self.joins: Deque[float] = deque()
+        self.flags: Deque[float] = deque()
+        self.active_until = 0.0
+        self.message_ids: List[int] = []
+        # user_id -> username
+        self.offenders: Dict[int, str] = {}
+        self.sweep: Optional[asyncio.Task] = None
+
+
+class RaidMode:
+    """
+    Per-chat raid mode.
+
+    A chat enters raid mode when joins or flagged messages spike (more than
+    the threshold within the window) or when an admin turns it on. While it
+    is active, offending messages are not handled one by one: their ids and
+    senders are collected for `sweep_delay` seconds and then removed in one
+    sweep - batched deletes and bans through the action scheduler and a
+    single multi-row insert into the bans table.
+
+    Chats are forgotten once idle (no spike in the window, raid mode off,
+    nothing waiting for a sweep), and at most `max_chats` are kept.
+    """
+
+    def __init__(self, db: Storage, actions: ActionScheduler,
+                 join_threshold: int = Config.RAID_JOIN_THRESHOLD,
+                 flag_threshold: int = Config.RAID_FLAG_THRESHOLD,
+                 window: float = Config.RAID_WINDOW,
+                 duration: float = Config.RAID_DURATION,
+                 sweep_delay: float = Config.RAID_SWEEP_DELAY_MS / 1000,
+                 expiry: Optional[BanExpiryScheduler] = None,
+                 max_chats: int = Config.RAID_MAX_CHATS,
+                 clock=time.monotonic):
+        self.db = db
+        self.actions = actions
+        self.expiry = expiry
+        self.join_threshold = join_threshold
+        self.flag_threshold = flag_threshold
+        self.window = window
+        self.duration = duration
+        self.sweep_delay = sweep_delay
+        self.clock = clock
+        self.max_chats = max_chats
+        # Least recently touched chat first, so idle chats are evicted from the front
+        self._chats: 'OrderedDict[int, _ChatRaid]' = OrderedDict()
+
+        # Last sweep report per chat
+        self.reports = TTLCache(max_chats)
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def _chat(self, chat_id: int) -> _ChatRaid:
+        self._evict()
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatRaid()
+        else:
+            self._chats.move_to_end(chat_id)
+        return state
+
+    def _idle(self, state: _ChatRaid, now: float) -> bool:
+        cutoff = now - self.window
+        return (state.sweep is None and state.active_until <= now
+                and (not state.joins or state.joins[-1] <= cutoff)
+                and (not state.flags or state.flags[-1] <= cutoff))
+
+    def _evict(self):
+        """Drop idle chats and make room for one more within max_chats"""
+        now = self.clock()
+        while self._chats:
+            chat_id, state = next(iter(self._chats.items()))
+            # A chat waiting for its sweep stays until the sweep has run
+            if state.sweep is None and (len(self._chats) >= self.max_chats or self._idle(state, now)):
+                del self._chats[chat_id]
+            else:
+                break
+
+    def _spike(self, events: Deque[float], count: int, threshold: int) -> bool:
+        now = self.clock()
+        events.extend([now] * count)
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        return len(events) >= threshold
+
+    def record_joins(self, chat_id: int, count: int = 1) -> bool:
+        """Count new members; return True if this starts raid mode"""
+        state = self._chat(chat_id)
+        if self._spike(state.joins, count, self.join_threshold) and not self.is_active(chat_id):
+            self.activate(chat_id)
+            return True
+        return False
+
+    def record_flag(self, chat_id: int) -> bool:
+        """Count a flagged message; return True if this starts raid mode"""
+        state = self._chat(chat_id)
+        if self._spike(state.flags, 1, self.flag_threshold) and not self.is_active(chat_id):
+            self.activate(chat_id)
+            return True
+        return False
+
+    def activate(self, chat_id: int, duration: Optional[float] = None):
+        """Turn raid mode on for `duration` seconds (default RAID_DURATION)"""
+        self._chat(chat_id).active_until = self.clock() + (duration or self.duration)
+        logger.warning(f"Raid mode enabled in chat {chat_id}")
+
+    def deactivate(self, chat_id: int):
+        state = self._chats.get(chat_id)
+        if state is not None:
+            state.active_until = 0.0
+            state.joins.clear()
+            state.flags.clear()
+
+    def is_active(self, chat_id: int) -> bool:
+        state = self._chats.get(chat_id)
+        return state is not None and state.active_until > self.clock()
+
+    def remaining(self, chat_id: int) -> float:
+        """Seconds of raid mode left"""
+        state = self._chats.get(chat_id)
+        return max(0.0, state.active_until - self.clock()) if state else 0.0
+
+    def collect(self, chat_id: int, user_id: int, username: str, message_id: int):
+        """Queue an offending message and its sender for the next sweep"""
+        state = self._chat(chat_id)
+        state.message_ids.append(message_id)
+        state.offenders.setdefault(user_id, username)
+        if state.sweep is None:
+            state.sweep = asyncio.create_task(self._sweep_later(chat_id))
+
+    def pending(self, chat_id: int) -> Tuple[int, int]:
+        """(messages, users) waiting for the next sweep"""
+        state = self._chats.get(chat_id)
+        return (len(state.message_ids), len(state.offenders)) if state else (0, 0)
+
+    async def _sweep_later(self, chat_id: int):
+        await asyncio.sleep(self.sweep_delay)
+        try:
+            await self.sweep(chat_id)
+        except Exception as e:
+            logger.error(f"Raid sweep in chat {chat_id} failed: {str(e)}", exc_info=True)
+
+    async def sweep(self, chat_id: int) -> Dict[str, Any]:
+        """Delete and ban everything collected for the chat, in bulk"""
+        state = self._chat(chat_id)
+        if state.sweep is not None and state.sweep is not asyncio.current_task():
+            state.sweep.cancel()
+        state.sweep = None
+        message_ids, state.message_ids = state.message_ids, []
+        offenders, state.offenders = state.offenders, {}
+
+        start = time.perf_counter()
+        config = await self.db.get_chat_config(chat_id)
+        futures = [self.actions.delete(chat_id, message_id) for message_id in message_ids]
+        duration = config.ban_duration
+        ban_kwargs = {'until_date': int(time.time() + duration)} if duration else {}
+        futures += [self.actions.ban(chat_id, user_id, **ban_kwargs) for user_id in offenders]
+        recorded = await self.db.add_bans(
+            ((user_id, chat_id, username) for user_id, username in offenders.items()),
+            "Raid sweep", getattr(self.actions.bot, 'id', 0), duration
+        )
+        if self.expiry is not None and duration:
+            for user_id in offenders:
+                self.expiry.schedule(chat_id, user_id, duration)
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+        report = {
+            'messages': len(message_ids),
+            'users': len(offenders),
+            'recorded': recorded,
+            'failed': sum(isinstance(result, Exception) for result in results),
+            'seconds': time.perf_counter() - start,
+        }
+        self.reports.set(chat_id, report)
+        if message_ids or offenders:
+            self.actions.reply(
+                chat_id,
+                f"🛡️ Raid sweep: removed {report['messages']} messages and banned "
+                f"{report['users']} users in {report['seconds'] * 1000:.0f} ms",
+                coalesce='raid'
+            )
+        return report
+
+    async def stop(self):
+        """Run sweeps that are still waiting"""
+        for chat_id, state in list(self._chats.items()):
+            if state.sweep is not None:
+                await self.sweep(chat_id)
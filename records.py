@@ -0,0 +1,91 @@
+"""
+Records module
+Compact, immutable records for the data the bot passes around per message and per user
+"""
+from dataclasses import dataclass, fields
+from typing import Any, Mapping, Optional
+
+
+@dataclass(frozen=True, slots=True)
+class ChatConfig:
+    """
+    Settings of one chat.
+
+    Cached and shared by every handler of the chat, hence immutable; use
+    Storage.set_chat_config to change them.
+    """
+
+    chat_id: int
+    warn_limit: int
+    ban_duration: int
+    enable_ai_moderation: bool
+    flood_threshold: int
+    flood_time_window: int
+    auto_delete_spam: bool = True
+    welcome_message: Optional[str] = None
+    rules: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: Mapping[str, Any]) -> 'ChatConfig':
+        """A stored chat_config row; SQLite's 0/1 flags become bools"""
+        values = {name: row[name] for name in CHAT_CONFIG_FIELDS}
+        for name in ('enable_ai_moderation', 'auto_delete_spam'):
+            if values[name] is not None:
+                values[name] = bool(values[name])
+        return cls(**values)
+
+
+CHAT_CONFIG_FIELDS = tuple(field.name for field in fields(ChatConfig))
+
+
+@dataclass(frozen=True, slots=True)
+class AnalysisResult:
+    """
+    Verdict on one message.
+
+    One is built per analyzed message and the verdict cache hands the same
+    instance to every repeat, so it must not change after it is built.
+    """
+
+    is_toxic: bool
+    is_spam: bool
+    has_profanity: bool
+    confidence: float
+    reason: str
+    should_flag: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class WarningRecord:
+    """One row of a user's warning history"""
+
+    id: int
+    user_id: int
+    chat_id: int
+    username: Optional[str]
+    reason: Optional[str]
+    warned_by: Optional[int]
+    timestamp: str
+
+
+@dataclass(frozen=True, slots=True)
+class BanRecord:
+    """One row of the ban history (the bans in force are tracked separately)"""
+
+    id: int
+    user_id: int
+    chat_id: int
+    username: Optional[str]
+    reason: Optional[str]
+    banned_by: Optional[int]
+    ban_until: Optional[str]
+    is_permanent: bool
+    timestamp: str
+
+
+@dataclass(frozen=True, slots=True)
+class UserStats:
+    """What /userstats reports about a user in a chat"""
+
+    warnings: int
+    is_banned: bool
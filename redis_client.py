@@ -0,0 +1,188 @@
+"""
+Redis client module
+A small asyncio client for the Redis protocol (RESP2), pipelined on one connection
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlparse
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class RedisError(Exception):
+    """Error reply from the server"""
+
+
+def encode_command(args: Sequence[Any]) -> bytes:
+    """A command as a RESP array of bulk strings"""
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, float):
+            data = repr(arg).encode()
+        else:
+            data = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """
+    One reply from the stream
+
+    Error replies are returned as RedisError instances rather than raised,
+    so one failed command doesn't hide the replies that follow it.
+    """
+    line = await reader.readuntil(b'\r\n')
+    kind, payload = line[:1], line[1:-2]
+    if kind == b'+':
+        return payload.decode()
+    if kind == b'-':
+        return RedisError(payload.decode())
+    if kind == b':':
+        return int(payload)
+    if kind == b'$':
+        length = int(payload)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b'*':
+        length = int(payload)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RedisError(f"Unexpected reply type {line!r}")
+
+
+class RedisClient:
+    """
+    One connection, shared by every caller.
+
+    Requests are written as soon as they are made and replies are matched
+    to callers in order, so concurrent handlers pipeline automatically and
+    a batch of commands (or a MULTI/EXEC transaction) costs one round-trip.
+    The connection is opened on first use and again after it drops.
+    """
+
+    def __init__(self, url: str = Config.REDIS_URL, timeout: float = Config.REDIS_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        # (replies expected, replies so far, future) per request in flight
+        self._waiting: Deque[Tuple[int, List[Any], asyncio.Future]] = deque()
+        self._connect_lock = asyncio.Lock()
+
+        # Metrics
+        self.round_trips = 0
+        self.commands = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def connect(self):
+        """Open the connection, authenticate and select the database (idempotent)"""
+        async with self._connect_lock:
+            if self.connected:
+                return
+            parsed = urlparse(self.url)
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(parsed.hostname or 'localhost', parsed.port or 6379),
+                self.timeout,
+            )
+            self._reader_task = asyncio.create_task(self._read_replies(self._reader))
+
+            setup = []
+            if parsed.password:
+                setup.append(('AUTH', unquote(parsed.username), unquote(parsed.password))
+                             if parsed.username else ('AUTH', unquote(parsed.password)))
+            database = parsed.path.strip('/')
+            if database and database != '0':
+                setup.append(('SELECT', database))
+            if setup:
+                for reply in await self._send(setup):
+                    if isinstance(reply, RedisError):
+                        await self.close()
+                        raise reply
+
+    async def close(self):
+        """Close the connection; requests still in flight fail"""
+        writer, self._writer = self._writer, None
+        if writer is None:
+            return
+        writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+        self._fail_waiting(ConnectionError("Redis connection closed"))
+
+    def _fail_waiting(self, error: Exception):
+        while self._waiting:
+            _, _, future = self._waiting.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def _read_replies(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                reply = await read_reply(reader)
+                count, replies, future = self._waiting[0]
+                replies.append(reply)
+                if len(replies) == count:
+                    self._waiting.popleft()
+                    # Callers that timed out have given up on their replies
+                    if not future.done():
+                        future.set_result(replies)
+        except (ConnectionError, asyncio.IncompleteReadError, IndexError) as e:
+            logger.warning(f"Redis connection lost: {str(e) or type(e).__name__}")
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._fail_waiting(ConnectionError("Redis connection lost"))
+
+    async def _send(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        future = asyncio.get_running_loop().create_future()
+        # Queued and written with no await in between, so replies stay in order
+        self._waiting.append((len(commands), [], future))
+        self._writer.write(b''.join(encode_command(command) for command in commands))
+        self.round_trips += 1
+        self.commands += len(commands)
+        return await asyncio.wait_for(future, self.timeout)
+
+    async def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """Send commands together and return their replies (RedisError for failures)"""
+        if not self.connected:
+            await self.connect()
+        return await self._send(commands)
+
+    async def execute(self, *args) -> Any:
+        """One command; error replies are raised"""
+        reply = (await self.pipeline([args]))[0]
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    async def transaction(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """
+        Run commands atomically (MULTI/EXEC) in one round-trip
+
+        Returns:
+            The commands' replies, in order
+        """
+        replies = await self.pipeline([('MULTI',), *commands, ('EXEC',)])
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        if replies[-1] is None:
+            raise RedisError("Transaction aborted")
+        return replies[-1]
@@ -0,0 +1,327 @@
+"""
+Offline replay harness for Telegram Moderator Bot
+Drives ModeratorBot's handlers with recorded or generated updates against a
+fake Bot and reports throughput, latency percentiles and DB work per message
+
+Usage:
+    python replay.py                            # 5000 generated updates
+    python replay.py --api-latency 0.05         # slow Telegram API
+    python replay.py --save corpus.jsonl        # keep the generated corpus
+    python replay.py --corpus corpus.jsonl      # replay a recorded corpus
+    python replay.py --backend memory           # without database I/O
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import CommandHandler
+
+from config import Config
+from database import Database
+from fake_bot import FakeBot
+from storage import DB_QUERY_SECONDS, create_storage
+from update_processor import KeyedUpdateProcessor
+
+# Every generated chat is moderated by this user
+ADMIN_ID = 1
+START_DATE = 1700000000
+
+# Chatter is assembled from fragments so that ordinary messages are (nearly)
+# unique, as they are in real chats, and not mistaken for a campaign
+OPENERS = ["hey", "hi all,", "morning!", "quick question:", "fwiw", "ok so", "lol", "btw",
+           "thanks, and", "hmm,"]
+TOPICS = ["does anyone know when the next meetup is", "the new release fixed the login bug",
+          "has anyone tried the beta build on android", "the build is green again",
+          "what time zone is the call in", "I pushed the docs update",
+          "the wifi at the venue was terrible", "who is bringing the projector",
+          "the api keeps timing out for me", "I finally got the tests passing"]
+CLOSERS = ["?", "!", "", " :)", " - any ideas?", " haha", " tbh", " again", " today", " already"]
+NAMES = ["alex", "sam", "kim", "jo", "max", "lee", "ana", "raj", "eva", "tom",
+         "noor", "li", "ben", "zoe", "ola", "dan", "mia", "ivo", "uma", "kai"]
+
+SPAM = [
+    "FREE CRYPTO GIVEAWAY visit http://cheap-crypto.example now",
+    "Check out http://cheap-crypto.example and http://win.example",
+    "DM @promo_bot @deals_bot @win_bot for offers!!!!!",
+    "Earn $$$ from home, sign up at https://get-rich.example",
+]
+
+ABUSE = [
+    "you are a stupid idiot and I hate you",
+    "go die, nobody wants you here",
+    "this is shit and you are an asshole",
+]
+
+# (command, needs a replied-to message, args)
+COMMANDS = [
+    ('warn', True, ['spamming']),
+    ('warn', True, []),
+    ('userstats', True, []),
+    ('unwarn', True, []),
+    ('config', False, []),
+    ('ban', True, ['raid']),
+]
+
+
+def _message(update_id: int, date: int, chat_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    return {
+        'message_id': update_id,
+        'date': date,
+        'chat': {'id': chat_id, 'type': 'supergroup', 'title': f"Chat {chat_id}"},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}",
+                 'username': f"user{user_id}"},
+        'text': text,
+    }
+
+
+def generate_corpus(updates: int, chats: int = 50, users: int = 500, rate: float = 20.0,
+                    seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Reproducible mix of updates as Telegram would send them
+
+    Mostly chatter, with spam, abuse, flood bursts (one user posting several
+    messages within a second or two) and admin commands replying to earlier
+    messages. Arrival times follow a Poisson process at `rate` messages/sec.
+    """
+    rng = random.Random(seed)
+    corpus: List[Dict[str, Any]] = []
+
+    def chatter() -> str:
+        return (f"{rng.choice(OPENERS)} @{rng.choice(NAMES)} {rng.choice(TOPICS)}"
+                f"{rng.choice(CLOSERS)}")
+
+    recent: Dict[int, List[Dict[str, Any]]] = {}
+    date = float(START_DATE)
+
+    def add(chat_id: int, user_id: int, text: str) -> Dict[str, Any]:
+        update_id = len(corpus) + 1
+        message = _message(update_id, int(date), chat_id, user_id, text)
+        corpus.append({'update_id': update_id, 'message': message})
+        return message
+
+    while len(corpus) < updates:
+        date += rng.expovariate(rate)
+        chat_id = -1001000000000 - rng.randrange(chats)
+        user_id = 1000 + rng.randrange(users)
+        roll = rng.random()
+        if roll < 0.003:
+            # Flood: a burst of messages from one user
+            for _ in range(rng.randint(6, 10)):
+                add(chat_id, user_id, chatter())
+                date += rng.uniform(0.05, 0.3)
+        elif roll < 0.02 and recent.get(chat_id):
+            command, needs_reply, args = rng.choice(COMMANDS)
+            message = add(chat_id, ADMIN_ID, ' '.join([f"/{command}"] + args))
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command) + 1}]
+            if needs_reply:
+                message['reply_to_message'] = rng.choice(recent[chat_id])
+        else:
+            text = (rng.choice(SPAM) if roll < 0.04 else rng.choice(ABUSE) if roll < 0.05
+                    else chatter())
+            message = add(chat_id, user_id, text)
+            recent.setdefault(chat_id, []).append(dict(message))
+            del recent[chat_id][:-20]
+    return corpus[:updates]
+
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    """Updates from a JSON-lines file, one Telegram update object per line"""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_corpus(path: str, corpus: List[Dict[str, Any]]):
+    with open(path, 'w', encoding='utf-8') as f:
+        for update in corpus:
+            f.write(json.dumps(update, ensure_ascii=False) + '\n')
+
+
+def _percentile(values: List[float], p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def replay(corpus: List[Dict[str, Any]], api_latency: float = 0.0, concurrency: int = 1,
+                 write_behind: bool = Config.WRITE_BEHIND,
+                 db_path: Optional[str] = None, backend: str = 'sqlite') -> Dict[str, Any]:
+    """
+    Run `corpus` through a fresh ModeratorBot and measure it
+
+    Updates are routed to the same handlers the Application would call, with
+    a FakeBot whose API calls take `api_latency` seconds. Flood and raid
+    detection run on the messages' dates rather than the wall clock, so
+    their verdicts (and the work that follows) do not depend on how fast
+    the replay runs. With `concurrency` 1 updates are handled one at a time and
+    the outcome is identical between runs; higher values dispatch them all
+    at once through a KeyedUpdateProcessor the way the bot does, and
+    latency then includes the wait for a slot.
+
+    Args:
+        corpus: Telegram update objects
+        api_latency: Seconds per fake API call
+        concurrency: Updates handled at once
+        write_behind: Database write mode
+        db_path: Database file (default: a throwaway one)
+        backend: 'sqlite' or 'memory'
+
+    Returns:
+        Report with throughput, latency percentiles, DB ops and API calls
+    """
+    # Imported here so the corpus helpers work without a configured token
+    from bot import ModeratorBot
+    if not Config.BOT_TOKEN:
+        Config.BOT_TOKEN = '123456:REPLAY'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if backend == 'sqlite':
+            db = Database(db_path or os.path.join(tmp, 'replay.db'), write_behind=write_behind)
+        else:
+            db = create_storage(backend, write_behind)
+        bot = ModeratorBot(db=db)
+        chats = {update['message']['chat']['id'] for update in corpus if 'message' in update}
+        fake = FakeBot(latency=api_latency, admins={chat_id: {ADMIN_ID} for chat_id in chats})
+
+        now = [float(START_DATE)]
+        bot.state.clock = bot.raid.clock = lambda: now[0]
+        commands = {
+            command: handler.callback
+            for handler in bot.app.handlers[0] if isinstance(handler, CommandHandler)
+            for command in handler.commands
+        }
+        updates = [Update.de_json(data, fake) for data in corpus]
+
+        # Like post_init, minus periodic maintenance, whose own DB work
+        # would show up in the numbers
+        await db.initialize()
+        await bot.admin_commands.warm_start()
+        await bot.analyzer.start()
+        bot.actions.start(fake)
+        await bot.ban_expiry.start()
+        if bot.classifier:
+            bot.classifier.start()
+
+        latencies: List[float] = []
+        errors = 0
+
+        async def handle(update: Update, coroutine):
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                await coroutine
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+        def dispatch(update: Update):
+            message = update.message
+            if message is None:
+                return None
+            now[0] = max(now[0], message.date.timestamp())
+            context = SimpleNamespace(bot=fake, args=[])
+            text = message.text or ''
+            if text.startswith('/'):
+                words = text.split()
+                callback = commands.get(words[0][1:].split('@')[0].lower())
+                if callback is None:
+                    return None
+                context.args = words[1:]
+                return callback(update, context)
+            if message.new_chat_members:
+                return bot.handle_new_member(update, context)
+            if text:
+                return bot.handle_message(update, context)
+            return None
+
+        db_ops_before = DB_QUERY_SECONDS.counts()
+        calls_before = len(fake.calls)
+        start = time.perf_counter()
+        try:
+            if concurrency <= 1:
+                for update in updates:
+                    coroutine = dispatch(update)
+                    if coroutine is not None:
+                        await handle(update, coroutine)
+            else:
+                processor = KeyedUpdateProcessor(max_concurrent_updates=concurrency)
+                tasks = []
+                for update in updates:
+                    coroutine = dispatch(update)
+                    if coroutine is not None:
+                        tasks.append(processor.process_update(update, handle(update, coroutine)))
+                await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+
+            db_ops = {
+                labels[0]: count - db_ops_before.get(labels, 0)
+                for labels, count in DB_QUERY_SECONDS.counts().items()
+                if count > db_ops_before.get(labels, 0)
+            }
+            handled_calls = len(fake.calls) - calls_before
+        finally:
+            # Drains queued API actions and writes
+            await bot.post_shutdown(None)
+
+    latencies.sort()
+    handled = len(latencies)
+    api_calls: Dict[str, int] = {}
+    for method, _ in fake.calls:
+        api_calls[method] = api_calls.get(method, 0) + 1
+    return {
+        'updates': handled,
+        'errors': errors,
+        'seconds': elapsed,
+        'per_second': handled / elapsed if elapsed else 0.0,
+        'p50_ms': _percentile(latencies, 0.50) * 1000,
+        'p95_ms': _percentile(latencies, 0.95) * 1000,
+        'p99_ms': _percentile(latencies, 0.99) * 1000,
+        'db_ops': db_ops,
+        'db_ops_per_update': sum(db_ops.values()) / handled if handled else 0.0,
+        'api_calls': api_calls,
+        'api_calls_during_replay': handled_calls,
+    }
+
+
+def report(result: Dict[str, Any]):
+    print(f"updates      {result['updates']} handled, {result['errors']} errors")
+    print(f"throughput   {result['per_second']:>8.0f} updates/s")
+    print(f"latency      p50 {result['p50_ms']:.2f} ms   p95 {result['p95_ms']:.2f} ms   "
+          f"p99 {result['p99_ms']:.2f} ms")
+    print(f"db ops       {result['db_ops_per_update']:.2f} per update")
+    for method, count in sorted(result['db_ops'].items(), key=lambda item: -item[1]):
+        print(f"  {method:<28} {count:>7}")
+    print(f"api calls    {sum(result['api_calls'].values())} "
+          f"({', '.join(f'{n} x {m}' for m, n in sorted(result['api_calls'].items()))})")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help="JSON-lines file of recorded updates (default: generated)")
+    parser.add_argument('--save', help="write the generated corpus to this file")
+    parser.add_argument('--updates', type=int, default=5000, help="generated updates")
+    parser.add_argument('--seed', type=int, default=42, help="generated corpus seed")
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help="seconds per fake Telegram API call")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="updates handled at once (1 = reproducible)")
+    parser.add_argument('--write-behind', action='store_true', default=Config.WRITE_BEHIND,
+                        help="batch database writes")
+    parser.add_argument('--backend', choices=('sqlite', 'memory'), default='sqlite',
+                        help="storage backend (sqlite: a throwaway file)")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else generate_corpus(args.updates, seed=args.seed)
+    if args.save:
+        save_corpus(args.save, corpus)
+    report(await replay(corpus, api_latency=args.api_latency, concurrency=args.concurrency,
+                        write_behind=args.write_behind, backend=args.backend))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
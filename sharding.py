@@ -0,0 +1,296 @@
+"""
+Sharding module
+Spreads chats over worker processes, each running its own ModeratorBot
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from telegram import Bot, Update
+from telegram.ext import Application, TypeHandler
+
+from config import Config
+from storage import create_storage
+from webhook_server import WebhookServer
+
+logger = logging.getLogger(__name__)
+
+# A worker that stays up this long is considered healthy again
+HEALTHY_UPTIME = 60.0
+
+
+def shard_for(chat_id: int, shards: int) -> int:
+    """Index of the worker that owns `chat_id`; stable across restarts"""
+    return chat_id % shards
+
+
+def update_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """Chat a raw update (Telegram's JSON) belongs to, if it has one"""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        # message, edited_message, chat_member, ... or callback_query.message
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return None
+
+
+def run_worker(index: int, shards: int, conn: Connection):
+    """Worker process entry point: a ModeratorBot fed updates through `conn`"""
+    # The front process handles Ctrl+C and shuts workers down in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Imported here: the front process never needs the moderation stack
+    from bot import ModeratorBot
+    bot = ModeratorBot(shard=(index, shards))
+    asyncio.run(_serve(bot, conn))
+
+
+async def _serve(bot, conn: Connection):
+    loop = asyncio.get_running_loop()
+    async with bot.app:
+        await bot.post_init(bot.app)
+        await bot.app.start()
+        logger.info(f"Worker {bot.shard[0] + 1}/{bot.shard[1]} ready")
+        try:
+            while True:
+                try:
+                    data = await loop.run_in_executor(None, conn.recv)
+                except EOFError:
+                    break
+                if data is None:
+                    break
+                await bot.app.update_queue.put(Update.de_json(data, bot.app.bot))
+        finally:
+            # Handles what is already queued before stopping
+            if bot.app.running:
+                await bot.app.stop()
+            await bot.post_shutdown(bot.app)
+
+
+class ShardedBot:
+    """
+    Front process for WORKERS > 1.
+
+    Receives updates (polling or the embedded webhook server) and forwards
+    each one, as raw JSON, to the worker process that owns its chat, so a
+    chat's messages are always handled by the same worker, in order, with
+    its caches, flood windows and writer connection. Updates without a chat
+    go to worker 0, which also runs database maintenance.
+
+    Updates wait in a per-worker queue in this process and cross a pipe one
+    at a time, so a worker that crashes loses at most the update it was
+    handling and whatever sat in the pipe buffer. Dead workers are started
+    again after `restart_delay` seconds, doubling (up to `max_restart_delay`)
+    while a worker keeps dying within a minute of starting.
+    """
+
+    def __init__(self, workers: int = Config.WORKERS,
+                 restart_delay: float = Config.WORKER_RESTART_DELAY,
+                 max_restart_delay: float = 30.0, check_interval: float = 0.5,
+                 target: Callable = run_worker, target_args: Tuple = ()):
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.check_interval = check_interval
+        # Worker entry point, called as target(index, workers, conn, *target_args)
+        self.target = target
+        self.target_args = target_args
+        # Fresh interpreters: forking would copy the front's event loop and threads
+        self._mp = multiprocessing.get_context('spawn')
+        self.processes: List[Optional[Any]] = [None] * workers
+        self._conns: List[Optional[Connection]] = [None] * workers
+        self._pending: List[asyncio.Queue] = []
+        self._started_at = [0.0] * workers
+        self._delays = [restart_delay] * workers
+        self._restart_at: Dict[int, float] = {}
+        self._senders: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+        # Metrics
+        self.routed = [0] * workers
+        self.restarts = [0] * workers
+
+    def _spawn(self, index: int):
+        receiver, sender = self._mp.Pipe(duplex=False)
+        process = self._mp.Process(
+            target=self.target,
+            args=(index, self.workers, receiver) + tuple(self.target_args),
+            name=f"moderator-worker-{index}",
+        )
+        process.start()
+        # Only the worker holds the read end, so sends fail once it is gone
+        receiver.close()
+        self.processes[index] = process
+        self._conns[index] = sender
+        self._started_at[index] = time.monotonic()
+
+    async def start(self):
+        """Start the workers and the tasks feeding and supervising them"""
+        self._senders = ThreadPoolExecutor(self.workers, thread_name_prefix='shard-send')
+        self._pending = [asyncio.Queue() for _ in range(self.workers)]
+        for index in range(self.workers):
+            self._spawn(index)
+            self._tasks.append(asyncio.create_task(self._forward(index)))
+        self._tasks.append(asyncio.create_task(self._supervise()))
+        logger.info(f"Started {self.workers} worker processes")
+
+    def route(self, data: Dict[str, Any]) -> int:
+        """Queue a raw update for the worker owning its chat; returns the worker index"""
+        chat_id = update_chat_id(data)
+        index = 0 if chat_id is None else shard_for(chat_id, self.workers)
+        self._pending[index].put_nowait(data)
+        self.routed[index] += 1
+        return index
+
+    async def _forward(self, index: int):
+        loop = asyncio.get_running_loop()
+        pending = self._pending[index]
+        while True:
+            data = await pending.get()
+            while True:
+                conn = self._conns[index]
+                try:
+                    # send() blocks while the pipe is full; keep that off the loop
+                    await loop.run_in_executor(self._senders, conn.send, data)
+                    break
+                except (OSError, ValueError):
+                    # Worker gone: hold the update until its replacement is up
+                    await asyncio.sleep(self.check_interval)
+            pending.task_done()
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if self._stopping:
+                return
+            now = time.monotonic()
+            for index, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                if index not in self._restart_at:
+                    uptime = now - self._started_at[index]
+                    if uptime >= HEALTHY_UPTIME:
+                        self._delays[index] = self.restart_delay
+                    delay = self._delays[index]
+                    self._delays[index] = min(delay * 2, self.max_restart_delay)
+                    self._restart_at[index] = now + delay
+                    logger.error(f"Worker {index} exited with code {process.exitcode} after "
+                                 f"{uptime:.1f}s, restarting in {delay:.1f}s")
+                elif now >= self._restart_at[index]:
+                    del self._restart_at[index]
+                    self._conns[index].close()
+                    self._spawn(index)
+                    self.restarts[index] += 1
+
+    async def stop(self, timeout: float = 10.0):
+        """Hand over the queued updates, then let every worker finish and exit"""
+        self._stopping = True
+        try:
+            await asyncio.wait_for(asyncio.gather(*(pending.join() for pending in self._pending)),
+                                   timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping with updates still queued for workers")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        loop = asyncio.get_running_loop()
+        for conn in self._conns:
+            try:
+                await loop.run_in_executor(self._senders, conn.send, None)
+            except (OSError, ValueError):
+                pass
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in time, terminating")
+                process.terminate()
+                await loop.run_in_executor(None, process.join)
+        for conn in self._conns:
+            conn.close()
+        self._senders.shutdown()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.workers,
+            'alive': sum(process is not None and process.is_alive() for process in self.processes),
+            'routed': list(self.routed),
+            'queued': [pending.qsize() for pending in self._pending],
+            'restarts': list(self.restarts),
+        }
+
+    async def _prepare_database(self):
+        # Migrate once here rather than racing from every worker
+        db = create_storage()
+        await db.initialize()
+        await db.close()
+
+    def run(self):
+        """Run the front process until stopped"""
+        logger.info(f"Starting {Config.BOT_NAME} v{Config.BOT_VERSION} with {self.workers} workers")
+        asyncio.run(self._prepare_database())
+        if Config.RUN_MODE == 'webhook':
+            asyncio.run(self._run_webhook())
+        else:
+            self._run_polling()
+
+    def _run_polling(self):
+        app = Application.builder().token(Config.BOT_TOKEN).build()
+
+        async def forward(update: Update, context):
+            self.route(update.to_dict())
+
+        async def post_init(application: Application):
+            await self.start()
+
+        async def post_shutdown(application: Application):
+            await self.stop()
+
+        app.add_handler(TypeHandler(Update, forward))
+        app.post_init = post_init
+        app.post_shutdown = post_shutdown
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
+
+    async def _run_webhook(self):
+        received: asyncio.Queue = asyncio.Queue()
+        # No decoding here; workers build the Update objects
+        server = WebhookServer(received)
+        bot = Bot(Config.BOT_TOKEN)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        async def consume():
+            while True:
+                self.route(await received.get())
+
+        await self.start()
+        consumer = asyncio.create_task(consume())
+        try:
+            async with bot:
+                await server.start()
+                await bot.set_webhook(
+                    Config.WEBHOOK_URL,
+                    allowed_updates=Update.ALL_TYPES,
+                    secret_token=Config.WEBHOOK_SECRET_TOKEN,
+                    max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                )
+                logger.info(f"Webhook set to {Config.WEBHOOK_URL}")
+                await stop.wait()
+        finally:
+            await server.stop()
+            # Route whatever the server already accepted
+            while not received.empty():
+                self.route(received.get_nowait())
+            consumer.cancel()
+            await self.stop()
@@ -0,0 +1,392 @@
+"""
+Shared state module
+Flood windows, admin lists and warning counters, kept in-process or in Redis
+"""
+import asyncio
+import itertools
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, Optional, Tuple
+from config import Config
+from cache import TTLCache
+from flood_tracker import FloodTracker
+from redis_client import RedisClient, RedisError
+
+logger = logging.getLogger(__name__)
+
+# Loads a user's stored warning count when no counter is cached
+Seed = Callable[[], Awaitable[int]]
+
+
+class SharedState(ABC):
+    """
+    Per-message state that every bot instance must agree on.
+
+    Flood windows, chat admin lists and the warning counters used with
+    write-behind. InProcessState keeps them in this process (enough for one
+    instance, or workers that each own their chats); RedisState keeps them
+    in Redis so instances behind one webhook see the same numbers.
+    """
+
+    async def start(self):
+        """Connect to the backing store, if any"""
+
+    async def close(self):
+        """Disconnect from the backing store, if any"""
+
+    @abstractmethod
+    async def record_message(self, chat_id: int, user_id: int,
+                             time_window: int) -> Tuple[int, Optional[FrozenSet[int]]]:
+        """
+        Record a message for flood detection
+
+        Returns:
+            (messages the user sent in the window including this one,
+             the chat's cached admin set or None), in one round-trip
+        """
+
+    @abstractmethod
+    async def reset_flood(self, chat_id: int, user_id: int):
+        """Forget a user's flood window in a chat"""
+
+    @abstractmethod
+    async def get_admins(self, chat_id: int) -> Optional[FrozenSet[int]]:
+        """Cached admin set of a chat, or None"""
+
+    @abstractmethod
+    async def set_admins(self, chat_id: int, admins: FrozenSet[int],
+                         ttl: Optional[float] = None, replace: bool = True):
+        """Cache a chat's admin set (only if none is cached unless `replace`)"""
+
+    @abstractmethod
+    async def get_member_admin(self, chat_id: int, user_id: int) -> Optional[bool]:
+        """Cached admin status of one user, for chats without an admin list"""
+
+    @abstractmethod
+    async def set_member_admin(self, chat_id: int, user_id: int, is_admin: bool):
+        """Cache the admin status of one user"""
+
+    @abstractmethod
+    async def forget_member_admin(self, chat_id: int, user_id: int):
+        """Drop the cached admin status of one user"""
+
+    @abstractmethod
+    async def incr_warnings(self, chat_id: int, user_id: int, seed: Seed) -> int:
+        """Add a warning to the user's counter and return the new count"""
+
+    @abstractmethod
+    async def get_warnings(self, chat_id: int, user_id: int, seed: Seed) -> int:
+        """The user's warning count"""
+
+    @abstractmethod
+    async def reset_warnings(self, chat_id: int, user_id: int, seed: Seed) -> int:
+        """Set the user's counter to 0 and return what it was"""
+
+    @abstractmethod
+    async def forget_warnings(self, keys: Iterable[Tuple[int, int]]):
+        """Drop cached counters of (chat_id, user_id) keys so they are loaded again"""
+
+    def caches(self) -> Dict[str, TTLCache]:
+        """In-process caches, by name, for the metrics endpoint"""
+        return {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InProcessState(SharedState):
+    """State in this process's memory: FloodTracker windows and TTL caches"""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.flood_tracker = FloodTracker(clock=clock)
+        # chat_id -> frozenset of admin user ids, or (chat_id, user_id) -> bool
+        # for chats without an administrator list (private chats)
+        self.admin_cache = TTLCache(Config.ADMIN_CACHE_SIZE, Config.ADMIN_CACHE_TTL)
+        self.warning_counts = TTLCache(Config.WARNING_COUNT_CACHE_SIZE)
+        self._seeding: Dict[Tuple[int, int], asyncio.Future] = {}
+
+    @property
+    def clock(self) -> Callable[[], float]:
+        return self.flood_tracker.clock
+
+    @clock.setter
+    def clock(self, clock: Callable[[], float]):
+        self.flood_tracker.clock = clock
+
+    async def record_message(self, chat_id: int, user_id: int,
+                             time_window: int) -> Tuple[int, Optional[FrozenSet[int]]]:
+        count = self.flood_tracker.record(chat_id, user_id, time_window)
+        return count, self.admin_cache.get(chat_id)
+
+    async def reset_flood(self, chat_id: int, user_id: int):
+        self.flood_tracker.reset(chat_id, user_id)
+
+    async def get_admins(self, chat_id: int) -> Optional[FrozenSet[int]]:
+        return self.admin_cache.get(chat_id)
+
+    async def set_admins(self, chat_id: int, admins: FrozenSet[int],
+                         ttl: Optional[float] = None, replace: bool = True):
+        if replace or self.admin_cache.peek(chat_id) is None:
+            self.admin_cache.set(chat_id, frozenset(admins), ttl=ttl)
+
+    async def get_member_admin(self, chat_id: int, user_id: int) -> Optional[bool]:
+        return self.admin_cache.get((chat_id, user_id))
+
+    async def set_member_admin(self, chat_id: int, user_id: int, is_admin: bool):
+        self.admin_cache.set((chat_id, user_id), is_admin)
+
+    async def forget_member_admin(self, chat_id: int, user_id: int):
+        self.admin_cache.invalidate((chat_id, user_id))
+
+    async def _cached_warnings(self, key: Tuple[int, int], seed: Seed) -> int:
+        """Counter from the cache, seeded on a miss"""
+        while True:
+            count = self.warning_counts.get(key)
+            if count is not None:
+                return count
+
+            # Concurrent misses share one load so no increment is overwritten
+            seeding = self._seeding.get(key)
+            if seeding is None:
+                seeding = asyncio.ensure_future(self._seed(key, seed))
+                self._seeding[key] = seeding
+                seeding.add_done_callback(lambda _: self._seeding.pop(key, None))
+            await seeding
+
+    async def _seed(self, key: Tuple[int, int], seed: Seed):
+        count = await seed()
+        if self.warning_counts.peek(key) is None:
+            self.warning_counts.set(key, count)
+
+    async def incr_warnings(self, chat_id: int, user_id: int, seed: Seed) -> int:
+        # On a hit nothing is awaited, so callers can queue the matching
+        # write before anyone else touches the counter
+        key = (chat_id, user_id)
+        count = await self._cached_warnings(key, seed) + 1
+        self.warning_counts.set(key, count)
+        return count
+
+    async def get_warnings(self, chat_id: int, user_id: int, seed: Seed) -> int:
+        return await self._cached_warnings((chat_id, user_id), seed)
+
+    async def reset_warnings(self, chat_id: int, user_id: int, seed: Seed) -> int:
+        key = (chat_id, user_id)
+        count = await self._cached_warnings(key, seed)
+        self.warning_counts.set(key, 0)
+        return count
+
+    async def forget_warnings(self, keys: Iterable[Tuple[int, int]]):
+        for key in keys:
+            self.warning_counts.invalidate(key)
+
+    def caches(self) -> Dict[str, TTLCache]:
+        return {'admin': self.admin_cache, 'warning_counts': self.warning_counts}
+
+
+# Connection problems and error replies; either way the local state takes over
+_REDIS_FAILURES = (ConnectionError, OSError, asyncio.TimeoutError, RedisError)
+
+
+class RedisState(SharedState):
+    """
+    State in Redis, shared by every instance pointing at the same server.
+
+    Each operation is a single MULTI/EXEC transaction, so it is atomic and
+    costs one round-trip: a message's flood window update returns the chat's
+    admin list with it. Flood windows are sorted sets of wall-clock times
+    (instances must keep their clocks in sync), trimmed on every write and
+    expiring with the window. Admin lists expire after ADMIN_CACHE_TTL,
+    warning counters WARNING_COUNT_TTL after their last change.
+
+    While Redis is unreachable the instance falls back to an InProcessState
+    and logs once; it goes back to Redis as soon as a request succeeds.
+    """
+
+    def __init__(self, url: str = Config.REDIS_URL, prefix: str = Config.REDIS_PREFIX,
+                 admin_ttl: float = Config.ADMIN_CACHE_TTL,
+                 warning_ttl: float = Config.WARNING_COUNT_TTL,
+                 clock: Callable[[], float] = time.time):
+        self.client = RedisClient(url)
+        self.prefix = prefix
+        self.admin_ttl = admin_ttl
+        self.warning_ttl = warning_ttl
+        self.clock = clock
+        self.fallback = InProcessState()
+        # Distinguishes this instance's flood events from others' at the same time
+        self._instance = f"{os.getpid()}.{id(self) & 0xffff:x}"
+        self._sequence = itertools.count()
+        self._degraded = False
+
+        # Metrics
+        self.errors = 0
+
+    async def start(self):
+        try:
+            await self.client.connect()
+            logger.info(f"Shared state in Redis at {self.client.url}")
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+
+    async def close(self):
+        await self.client.close()
+
+    def _failed(self, error: Exception):
+        self.errors += 1
+        if not self._degraded:
+            self._degraded = True
+            logger.warning(f"Redis unavailable ({str(error) or type(error).__name__}), "
+                           f"using in-process state until it is back")
+
+    async def _transaction(self, *commands) -> list:
+        replies = await self.client.transaction(commands)
+        if self._degraded:
+            self._degraded = False
+            logger.info("Redis is back, shared state restored")
+        return replies
+
+    def _key(self, *parts) -> str:
+        return self.prefix + ':'.join(str(part) for part in parts)
+
+    @staticmethod
+    def _decode_admins(value: Optional[bytes]) -> Optional[FrozenSet[int]]:
+        if value is None:
+            return None
+        return frozenset(int(user_id) for user_id in value.split(b',') if user_id)
+
+    async def record_message(self, chat_id: int, user_id: int,
+                             time_window: int) -> Tuple[int, Optional[FrozenSet[int]]]:
+        key = self._key('flood', chat_id, user_id)
+        now = self.clock()
+        try:
+            _, _, _, count, _, admins = await self._transaction(
+                ('ZADD', key, now, f"{now!r}:{self._instance}:{next(self._sequence)}"),
+                ('ZREMRANGEBYSCORE', key, '-inf', now - time_window),
+                # Keep only the newest events, as FloodTracker does
+                ('ZREMRANGEBYRANK', key, 0, -(FloodTracker.MAX_EVENTS_PER_KEY + 1)),
+                ('ZCARD', key),
+                ('PEXPIRE', key, int(time_window * 1000) + 1000),
+                ('GET', self._key('admins', chat_id)),
+            )
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+            return await self.fallback.record_message(chat_id, user_id, time_window)
+        return count, self._decode_admins(admins)
+
+    async def reset_flood(self, chat_id: int, user_id: int):
+        try:
+            await self._transaction(('DEL', self._key('flood', chat_id, user_id)))
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+        await self.fallback.reset_flood(chat_id, user_id)
+
+    async def get_admins(self, chat_id: int) -> Optional[FrozenSet[int]]:
+        try:
+            value, = await self._transaction(('GET', self._key('admins', chat_id)))
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+            return await self.fallback.get_admins(chat_id)
+        return self._decode_admins(value)
+
+    async def set_admins(self, chat_id: int, admins: FrozenSet[int],
+                         ttl: Optional[float] = None, replace: bool = True):
+        command = ['SET', self._key('admins', chat_id), ','.join(str(user_id) for user_id in sorted(admins)),
+                   'PX', int((ttl or self.admin_ttl) * 1000)]
+        if not replace:
+            command.append('NX')
+        try:
+            await self._transaction(command)
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+            await self.fallback.set_admins(chat_id, admins, ttl, replace)
+
+    async def get_member_admin(self, chat_id: int, user_id: int) -> Optional[bool]:
+        try:
+            value, = await self._transaction(('GET', self._key('admin', chat_id, user_id)))
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+            return await self.fallback.get_member_admin(chat_id, user_id)
+        return None if value is None else value == b'1'
+
+    async def set_member_admin(self, chat_id: int, user_id: int, is_admin: bool):
+        try:
+            await self._transaction(('SET', self._key('admin', chat_id, user_id), int(is_admin),
+                                     'PX', int(self.admin_ttl * 1000)))
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+            await self.fallback.set_member_admin(chat_id, user_id, is_admin)
+
+    async def forget_member_admin(self, chat_id: int, user_id: int):
+        try:
+            await self._transaction(('DEL', self._key('admin', chat_id, user_id)))
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+        await self.fallback.forget_member_admin(chat_id, user_id)
+
+    async def incr_warnings(self, chat_id: int, user_id: int, seed: Seed) -> int:
+        key = self._key('warnings', chat_id, user_id)
+        ttl = int(self.warning_ttl * 1000)
+        try:
+            value, = await self._transaction(('GET', key))
+            # The counter is seeded (only if still missing) in the same
+            # transaction as the increment, so no INCR ever lands on an
+            # unseeded counter, even if the key expired since the GET
+            base = int(value) if value is not None else await seed()
+            _, count, _ = await self._transaction(('SET', key, base, 'NX', 'PX', ttl),
+                                                  ('INCR', key), ('PEXPIRE', key, ttl))
+            return count
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+            return await self.fallback.incr_warnings(chat_id, user_id, seed)
+
+    async def get_warnings(self, chat_id: int, user_id: int, seed: Seed) -> int:
+        key = self._key('warnings', chat_id, user_id)
+        try:
+            value, = await self._transaction(('GET', key))
+            if value is not None:
+                return int(value)
+            # Whoever seeds first wins; everyone reads the same value back
+            _, value = await self._transaction(
+                ('SET', key, await seed(), 'NX', 'PX', int(self.warning_ttl * 1000)), ('GET', key)
+            )
+            return int(value)
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+            return await self.fallback.get_warnings(chat_id, user_id, seed)
+
+    async def reset_warnings(self, chat_id: int, user_id: int, seed: Seed) -> int:
+        key = self._key('warnings', chat_id, user_id)
+        try:
+            value, _ = await self._transaction(('GET', key),
+                                               ('SET', key, 0, 'PX', int(self.warning_ttl * 1000)))
+            return int(value) if value is not None else await seed()
+        except _REDIS_FAILURES as e:
+            self._failed(e)
+            return await self.fallback.reset_warnings(chat_id, user_id, seed)
+
+    async def forget_warnings(self, keys: Iterable[Tuple[int, int]]):
+        keys = list(keys)
+        if keys:
+            try:
+                await self._transaction(('DEL', *(self._key('warnings', *key) for key in keys)))
+            except _REDIS_FAILURES as e:
+                self._failed(e)
+        await self.fallback.forget_warnings(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'round_trips': self.client.round_trips,
+            'commands': self.client.commands,
+            'errors': self.errors,
+            'degraded': self._degraded,
+        }
+
+
+def create_shared_state(kind: str = Config.SHARED_STATE) -> SharedState:
+    """The configured shared state: 'local' (this process) or 'redis' (Config.REDIS_URL)"""
+    if kind == 'local':
+        return InProcessState()
+    if kind == 'redis':
+        return RedisState()
+    raise ValueError(f"Unknown shared state {kind!r} (expected local or redis)")
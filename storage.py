@@ -0,0 +1,271 @@
+"""
+Storage module
+The interface the bot uses for its data, and the factory picking a backend
+"""
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from config import Config
+from cache import TTLCache
+from metrics import REGISTRY, timed
+from records import CHAT_CONFIG_FIELDS, ChatConfig, UserStats, WarningRecord
+
+logger = logging.getLogger(__name__)
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'moderator_db_query_seconds', "Latency of Database methods, including pool waits", ['method']
+)
+
+BACKENDS = ('sqlite', 'memory')
+
+
+def utc_timestamp() -> str:
+    """Current time in the format SQLite's CURRENT_TIMESTAMP writes"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def retention_cutoff(seconds: float) -> str:
+    """utc_timestamp() of `seconds` ago, for purging older rows"""
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def default_chat_config(chat_id: int) -> ChatConfig:
+    """Defaults for a chat without a stored configuration"""
+    return ChatConfig(
+        chat_id=chat_id,
+        warn_limit=Config.DEFAULT_WARN_LIMIT,
+        ban_duration=Config.DEFAULT_BAN_DURATION,
+        enable_ai_moderation=Config.ENABLE_AI_MODERATION,
+        flood_threshold=Config.FLOOD_THRESHOLD,
+        flood_time_window=Config.FLOOD_TIME_WINDOW,
+    )
+
+
+# Settings set_chat_config accepts
+CHAT_CONFIG_COLUMNS = frozenset(CHAT_CONFIG_FIELDS) - {'chat_id'}
+
+
+class Storage(ABC):
+    """
+    Everything the bot reads and writes, independent of where it is kept.
+
+    Database (SQLite), PostgresDatabase (experimental) and MemoryDatabase implement it.
+    Timestamps cross this interface as utc_timestamp() strings, temporary
+    ban expiries as Unix times. Chat settings are cached here, the same way
+    for every backend.
+    """
+
+    # Backends batching writes expose their queue (depth, stats()) here
+    write_queue = None
+    # Backends keeping warning counts outside the database expose that
+    # SharedState here
+    state = None
+
+    def __init__(self):
+        # Read-through cache of per-chat settings, invalidated by set_chat_config
+        self.config_cache = TTLCache(Config.CHAT_CONFIG_CACHE_SIZE)
+        self._config_version = 0
+
+    @abstractmethod
+    async def initialize(self):
+        """Connect and bring the schema up to date"""
+
+    @abstractmethod
+    async def close(self):
+        """Write anything still queued and disconnect"""
+
+    @timed(DB_QUERY_SECONDS)
+    async def flush(self):
+        """Write everything still queued"""
+
+    @abstractmethod
+    async def add_warning(self, user_id: int, chat_id: int, username: str,
+                          reason: str, warned_by: int) -> int:
+        """
+        Add a warning for a user
+
+        Returns:
+            The user's warning count in the chat, including this warning
+        """
+
+    @abstractmethod
+    async def get_warnings(self, user_id: int, chat_id: int) -> List[WarningRecord]:
+        """Get all warnings for a user in a chat, newest first"""
+
+    @abstractmethod
+    async def get_warning_count(self, user_id: int, chat_id: int) -> int:
+        """Get warning count for a user"""
+
+    @abstractmethod
+    async def clear_warnings(self, user_id: int, chat_id: int) -> int:
+        """Clear all warnings for a user, returning how many there were"""
+
+    @abstractmethod
+    async def add_ban(self, user_id: int, chat_id: int, username: str,
+                      reason: str, banned_by: int, duration: Optional[int] = None) -> Optional[int]:
+        """
+        Add a ban record and mark the user as banned
+
+        Returns:
+            The history row id, or None if the write was queued
+        """
+
+    @abstractmethod
+    async def add_bans(self, bans: Iterable[Tuple[int, int, str]], reason: str,
+                       banned_by: int, duration: Optional[int] = None) -> int:
+        """
+        Record many bans in one batch
+
+        Args:
+            bans: (user_id, chat_id, username) per banned user
+
+        Returns:
+            Number of bans written
+        """
+
+    @abstractmethod
+    async def is_banned(self, user_id: int, chat_id: int) -> bool:
+        """Check if user is currently banned"""
+
+    @abstractmethod
+    async def remove_ban(self, user_id: int, chat_id: int) -> bool:
+        """Mark a user as no longer banned (the history is kept)"""
+
+    @abstractmethod
+    async def get_expiring_bans(self) -> List[Tuple[int, int, float]]:
+        """(chat_id, user_id, ban_until) of every temporary ban still active"""
+
+    @abstractmethod
+    async def lift_expired_bans(self, bans: Iterable[Tuple[int, int]], now: float) -> int:
+        """
+        Remove temporary bans that ran out by `now`
+
+        A ban renewed meanwhile expires later than `now` and is left alone.
+        """
+
+    def _default_chat_config(self, chat_id: int) -> ChatConfig:
+        """Defaults for a chat without a stored configuration"""
+        return default_chat_config(chat_id)
+
+    @abstractmethod
+    async def _load_chat_config(self, chat_id: int) -> Optional[ChatConfig]:
+        """The stored settings of a chat, or None"""
+
+    @abstractmethod
+    async def _store_chat_config(self, chat_id: int, settings: Dict[str, Any]):
+        """Create the chat's settings row if needed and update `settings` in it"""
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_chat_config(self, chat_id: int) -> ChatConfig:
+        """Get configuration for a chat (cached, read-only)"""
+        config = self.config_cache.get(chat_id)
+        if config is not None:
+            return config
+
+        # A set_chat_config racing with this read must not be overwritten
+        version = self._config_version
+        config = await self._load_chat_config(chat_id)
+        if config is None:
+            # Return defaults if no config exists
+            config = self._default_chat_config(chat_id)
+
+        if version == self._config_version:
+            self.config_cache.set(chat_id, config)
+        return config
+
+    @timed(DB_QUERY_SECONDS)
+    async def set_chat_config(self, chat_id: int, **kwargs):
+        """Update chat configuration"""
+        settings = {key: value for key, value in kwargs.items() if key != 'chat_id'}
+        unknown = set(settings) - CHAT_CONFIG_COLUMNS
+        if unknown:
+            raise ValueError(f"Unknown chat settings: {', '.join(sorted(unknown))}")
+
+        await self._store_chat_config(chat_id, settings)
+        self._config_version += 1
+        self.config_cache.invalidate(chat_id)
+
+    @abstractmethod
+    async def track_message(self, user_id: int, chat_id: int):
+        """Track a user message (flood detection itself uses FloodTracker)"""
+
+    @abstractmethod
+    async def get_recent_message_count(self, user_id: int, chat_id: int,
+                                       time_window: int) -> int:
+        """Get message count in time window"""
+
+    @timed(DB_QUERY_SECONDS)
+    async def cleanup_old_messages(self, hours: int = 24, chunk_size: int = 1000) -> int:
+        """Clean up old message tracking records, a chunk per transaction"""
+        before = retention_cutoff(hours * 3600)
+        total = 0
+        while True:
+            removed = await self.purge_messages(before, chunk_size)
+            total += removed
+            if removed < chunk_size:
+                return total
+
+    @abstractmethod
+    async def purge_messages(self, before: str, limit: int) -> int:
+        """Delete up to `limit` message tracking rows older than `before`"""
+
+    @abstractmethod
+    async def purge_ban_history(self, before: str, limit: int) -> int:
+        """Delete up to `limit` ban history rows older than `before` (active bans stay)"""
+
+    @abstractmethod
+    async def purge_warnings(self, before: str, limit: int) -> int:
+        """Delete up to `limit` warnings older than `before`, keeping counters in step"""
+
+    @abstractmethod
+    async def optimize(self, analyze: bool = False):
+        """Refresh the query planner's statistics"""
+
+    @abstractmethod
+    async def incremental_vacuum(self, pages: int) -> Optional[int]:
+        """
+        Release up to `pages` free pages back to the filesystem
+
+        Returns:
+            Pages released, or None if the backend can't do it incrementally
+        """
+
+    @abstractmethod
+    async def get_admins(self) -> Dict[int, Set[int]]:
+        """Get the last known admin set of every chat"""
+
+    @abstractmethod
+    async def set_chat_admins(self, chat_id: int, user_ids: Iterable[int],
+                              added_by: Optional[int] = None):
+        """Replace the stored admin set of a chat"""
+
+    @timed(DB_QUERY_SECONDS)
+    async def get_user_stats(self, user_id: int, chat_id: int) -> UserStats:
+        """Get statistics for a user"""
+        warnings = await self.get_warning_count(user_id, chat_id)
+        is_banned = await self.is_banned(user_id, chat_id)
+
+        return UserStats(warnings=warnings, is_banned=is_banned)
+
+
+def create_storage(backend: str = Config.DATABASE_BACKEND,
+                   write_behind: bool = Config.WRITE_BEHIND, state=None) -> Storage:
+    """
+    The configured storage backend
+
+    Args:
+        backend: 'sqlite' (Config.DATABASE_PATH) or 'memory' (nothing
+            persisted); PostgresDatabase is experimental and only built directly
+        write_behind: Batch writes where the backend supports it
+        state: SharedState for the warning counters of write-behind SQLite
+            (the other backends count in the database itself)
+    """
+    # Imported here: each backend pulls in its own driver
+    if backend == 'sqlite':
+        from database import Database
+        return Database(write_behind=write_behind, state=state)
+    if backend == 'memory':
+        from memory_database import MemoryDatabase
+        return MemoryDatabase()
+    raise ValueError(f"Unknown storage backend {backend!r} (expected one of {', '.join(BACKENDS)})")
@@ -4,13 +4,40 @@ Run this to verify all core functionality works correctly
 """
 import asyncio
 import sys
+import time
 from datetime import datetime
+from types import SimpleNamespace
 
 # Test imports
 try:
     from config import Config
-    from database import Database
+    from database import Database, utc_timestamp
     from ai_moderator import AIContentModerator
+    from flood_tracker import FloodTracker
+    from migrations import MIGRATIONS
+    from cache import TTLCache
+    from admin_commands import AdminCommands
+    from toxicity_classifier import BatchingClassifier, DummyClassifier, toxic_label_index
+    from analysis_executor import AnalysisExecutor
+    from verdict_cache import VerdictCache
+    from campaign_detector import CampaignDetector
+    from webhook_server import WebhookServer
+    from loadgen import post, synthetic_update
+    from update_processor import KeyedUpdateProcessor
+    from action_scheduler import ActionScheduler, SchedulerStopped, TokenBucket
+    from ban_expiry import BanExpiryScheduler
+    from fake_bot import FakeBot
+    from telegram.error import TelegramError
+    from maintenance import Maintenance
+    from metrics import MetricsServer, Registry, REGISTRY
+    from raid_mode import RaidMode
+    from replay import generate_corpus, load_corpus, replay, save_corpus
+    from sharding import ShardedBot, shard_for, update_chat_id
+    from memory_database import MemoryDatabase
+    from storage import Storage, create_storage
+    from records import AnalysisResult, ChatConfig, UserStats
+    from fake_redis import FakeRedisServer
+    from shared_state import InProcessState, RedisState, create_shared_state
     print("✅ All imports successful")
 except Exception as e:
     print(f"❌ Import failed: {e}")
@@ -65,6 +92,103 @@ class BotTester:
             return False
 
 
+def echo_worker(index: int, shards: int, conn, results):
+    """Stand-in worker process for the sharding tests: reports what it receives"""
+    import os
+    while True:
+        data = conn.recv()
+        if data is None:
+            return
+        if data.get('crash'):
+            # Flush the feeder thread first: dying while it holds the shared
+            # queue's lock would hang the other workers' reports
+            results.close()
+            results.join_thread()
+            os._exit(3)
+        results.put((index, update_chat_id(data), data['update_id']))
+
+
+async def storage_contract(tester: BotTester, db, label: str):
+    """Behaviour every storage backend must share; ids are unique per run"""
+    chat_id = -(int(time.time() * 1000) % 10**9) - 10**12
+    user_id, other = 4242, 4343
+    
+    try:
+        counts = [await db.add_warning(user_id, chat_id, "user", f"reason {i}", 1) for i in range(3)]
+        await db.add_warning(other, chat_id, "other", "reason", 1)
+        tester.test(f"[{label}] add_warning returns running counts", counts == [1, 2, 3], str(counts))
+        warnings = await db.get_warnings(user_id, chat_id)
+        tester.test(f"[{label}] Warnings listed newest first",
+                    [w.reason for w in warnings] == ["reason 2", "reason 1", "reason 0"]
+                    and isinstance(warnings[0].timestamp, str),
+                    str(warnings[:1]))
+        tester.test(f"[{label}] Warning count", await db.get_warning_count(user_id, chat_id) == 3)
+        cleared = await db.clear_warnings(user_id, chat_id)
+        tester.test(f"[{label}] Clearing warnings touches one user only",
+                    cleared == 3 and await db.get_warning_count(user_id, chat_id) == 0
+                    and await db.get_warning_count(other, chat_id) == 1)
+        
+        future = utc_timestamp().replace(utc_timestamp()[:4], str(int(utc_timestamp()[:4]) + 1))
+        await db.add_warning(user_id, chat_id, "user", "old", 1)
+        await db.purge_warnings(future, 100000)
+        tester.test(f"[{label}] Purged warnings leave counters in step",
+                    await db.get_warning_count(user_id, chat_id) == 0
+                    and await db.get_warnings(other, chat_id) == []
+                    and await db.add_warning(user_id, chat_id, "user", "new", 1) == 1)
+        
+        await db.add_ban(user_id, chat_id, "user", "test", 1)
+        await db.add_ban(other, chat_id, "other", "test", 1, duration=3600)
+        tester.test(f"[{label}] Permanent and temporary bans active",
+                    await db.is_banned(user_id, chat_id) and await db.is_banned(other, chat_id))
+        expiring = [ban for ban in await db.get_expiring_bans() if ban[0] == chat_id]
+        tester.test(f"[{label}] Only temporary bans expire",
+                    [ban[:2] for ban in expiring] == [(chat_id, other)]
+                    and abs(expiring[0][2] - time.time() - 3600) < 60, str(expiring))
+        lifted = await db.lift_expired_bans([(chat_id, other)], time.time())
+        tester.test(f"[{label}] Unexpired ban is not lifted", lifted == 0 and await db.is_banned(other, chat_id))
+        lifted = await db.lift_expired_bans([(chat_id, other)], time.time() + 7200)
+        tester.test(f"[{label}] Expired ban lifted", lifted == 1 and not await db.is_banned(other, chat_id))
+        tester.test(f"[{label}] Removing a ban",
+                    await db.remove_ban(user_id, chat_id) and not await db.remove_ban(user_id, chat_id)
+                    and not await db.is_banned(user_id, chat_id))
+        written = await db.add_bans([(5000 + i, chat_id, f"raider{i}") for i in range(250)]
+                                    + [(5000, chat_id, "raider0")], "Raid", 0, duration=600)
+        tester.test(f"[{label}] Batched bans, repeats included",
+                    written == 251 and await db.is_banned(5249, chat_id)
+                    and len([ban for ban in await db.get_expiring_bans() if ban[0] == chat_id]) == 250)
+        
+        config = await db.get_chat_config(chat_id)
+        tester.test(f"[{label}] Default chat config",
+                    config.warn_limit == Config.DEFAULT_WARN_LIMIT and config.chat_id == chat_id)
+        await db.set_chat_config(chat_id, warn_limit=7, rules="Be nice")
+        config = await db.get_chat_config(chat_id)
+        tester.test(f"[{label}] Stored chat config",
+                    config.warn_limit == 7 and config.rules == "Be nice"
+                    and config.ban_duration == Config.DEFAULT_BAN_DURATION, str(config))
+        try:
+            await db.set_chat_config(chat_id, warn_limit_typo=1)
+            rejected = False
+        except ValueError:
+            rejected = True
+        tester.test(f"[{label}] Unknown chat settings rejected", rejected)
+        
+        await db.set_chat_admins(chat_id, [1, 2, 3], added_by=1)
+        await db.set_chat_admins(chat_id, [2, 4])
+        tester.test(f"[{label}] Admin set replaced", (await db.get_admins()).get(chat_id) == {2, 4})
+        
+        for _ in range(3):
+            await db.track_message(user_id, chat_id)
+        await db.track_message(other, chat_id)
+        tester.test(f"[{label}] Recent message count",
+                    await db.get_recent_message_count(user_id, chat_id, 60) == 3)
+        stats = await db.get_user_stats(user_id, chat_id)
+        tester.test(f"[{label}] User stats", stats == UserStats(warnings=1, is_banned=False), str(stats))
+        await db.optimize(analyze=True)
+        await db.flush()
+    except Exception as e:
+        tester.test(f"[{label}] Storage contract", False, f"{type(e).__name__}: {e}")
+
+
 async def run_tests():
     """Run all tests"""
     tester = BotTester()
@@ -114,16 +238,48 @@ async def run_tests():
         tester.test("Database initialization", False, str(e))
         return tester.summary()
     
+    # Test connection pool
+    try:
+        writer = test_db.pool._writer
+        await test_db.get_warning_count(12345, 67890)
+        await test_db.track_message(12345, 67890)
+        tester.test("Connection pool opened", test_db.pool.is_open)
+        tester.test("Writer connection is reused", test_db.pool._writer is writer)
+        tester.test(
+            "Reader pool sized from config",
+            len(test_db.pool._readers) == Config.DATABASE_READERS
+        )
+    except Exception as e:
+        tester.test("Connection pool", False, str(e))
+    
+    # Test schema migrations
+    try:
+        async with test_db.pool.reader() as db:
+            async with db.execute('SELECT MAX(version) FROM schema_version') as cursor:
+                version = (await cursor.fetchone())[0]
+            async with db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'"
+            ) as cursor:
+                indexes = {row[0] for row in await cursor.fetchall()}
+            async with db.execute('PRAGMA journal_mode') as cursor:
+                journal_mode = (await cursor.fetchone())[0]
+        
+        tester.test("Schema migrated to latest", version == MIGRATIONS[-1][0], f"Got version {version}")
+        tester.test("Warning lookup index exists", 'idx_warnings_chat_user_ts' in indexes, str(indexes))
+        tester.test("WAL mode enabled", journal_mode == 'wal', f"Got {journal_mode}")
+    except Exception as e:
+        tester.test("Schema migrations", False, str(e))
+    
     # Test warning operations
     try:
-        warning_id = await test_db.add_warning(
+        count = await test_db.add_warning(
             user_id=12345,
             chat_id=67890,
             username="testuser",
             reason="Test warning",
             warned_by=99999
         )
-        tester.test("Add warning to database", warning_id > 0)
+        tester.test("Add warning to database", count == 1, f"Expected count 1, got {count}")
     except Exception as e:
         tester.test("Add warning to database", False, str(e))
     
@@ -165,7 +321,7 @@ async def run_tests():
         tester.test("Get chat config (defaults)", config is not None)
         tester.test(
             "Default warn limit in config",
-            config['warn_limit'] == Config.DEFAULT_WARN_LIMIT
+            config.warn_limit == Config.DEFAULT_WARN_LIMIT
         )
     except Exception as e:
         tester.test("Get chat config", False, str(e))
@@ -173,11 +329,36 @@ async def run_tests():
     try:
         await test_db.set_chat_config(67890, warn_limit=5, ban_duration=7200)
         config = await test_db.get_chat_config(67890)
-        tester.test("Update chat config", config['warn_limit'] == 5)
-        tester.test("Config persists", config['ban_duration'] == 7200)
+        tester.test("Update chat config", config.warn_limit == 5)
+        tester.test("Config persists", config.ban_duration == 7200)
     except Exception as e:
         tester.test("Update chat config", False, str(e))
     
+    # Test chat config cache
+    try:
+        first = await test_db.get_chat_config(67890)
+        second = await test_db.get_chat_config(67890)
+        tester.test("Chat config served from cache", first is second)
+        
+        defaults = await test_db.get_chat_config(24680)
+        tester.test("Default config materialized once",
+                    defaults is await test_db.get_chat_config(24680))
+        
+        await test_db.set_chat_config(67890, warn_limit=4)
+        config = await test_db.get_chat_config(67890)
+        tester.test("Config cache invalidated on write", config.warn_limit == 4,
+                    f"Expected 4, got {config.warn_limit}")
+        
+        try:
+            config.warn_limit = 99
+            tester.test("Cached config is read-only", False)
+        except AttributeError:
+            tester.test("Cached config is read-only", True)
+        
+        await test_db.set_chat_config(67890, warn_limit=5)
+    except Exception as e:
+        tester.test("Chat config cache", False, str(e))
+    
     # Test message tracking
     try:
         await test_db.track_message(12345, 67890)
@@ -190,8 +371,8 @@ async def run_tests():
     # Test user stats
     try:
         stats = await test_db.get_user_stats(12345, 67890)
-        tester.test("Get user stats", 'warnings' in stats and 'is_banned' in stats)
-        tester.test("User stats accuracy", stats['warnings'] >= 1)
+        tester.test("Get user stats", isinstance(stats.is_banned, bool))
+        tester.test("User stats accuracy", stats.warnings >= 1)
     except Exception as e:
         tester.test("Get user stats", False, str(e))
     
@@ -212,14 +393,14 @@ async def run_tests():
     # Test profanity detection
     try:
         result = ai_mod.analyze_message("This is a clean message")
-        tester.test("Clean message detection", not result['should_flag'])
+        tester.test("Clean message detection", not result.should_flag)
     except Exception as e:
         tester.test("Clean message detection", False, str(e))
     
     try:
         result = ai_mod.analyze_message("fuck shit damn")
-        tester.test("Profanity detection", result['has_profanity'])
-        tester.test("Profanity flags message", result['should_flag'])
+        tester.test("Profanity detection", result.has_profanity)
+        tester.test("Profanity flags message", result.should_flag)
     except Exception as e:
         tester.test("Profanity detection", False, str(e))
     
@@ -227,7 +408,7 @@ async def run_tests():
     try:
         spam_msg = "AAAAAAAAAA " * 10 + "http://spam.com " * 5
         result = ai_mod.analyze_message(spam_msg)
-        tester.test("Spam detection", result['is_spam'])
+        tester.test("Spam detection", result.is_spam)
     except Exception as e:
         tester.test("Spam detection", False, str(e))
     
@@ -235,7 +416,7 @@ async def run_tests():
     try:
         url_spam = "Check http://link1.com and http://link2.com and http://link3.com"
         result = ai_mod.analyze_message(url_spam)
-        tester.test("URL spam detection", result['is_spam'])
+        tester.test("URL spam detection", result.is_spam)
     except Exception as e:
         tester.test("URL spam detection", False, str(e))
     
@@ -243,10 +424,50 @@ async def run_tests():
     try:
         toxic_msg = "I hate you, you should kill yourself"
         result = ai_mod.analyze_message(toxic_msg)
-        tester.test("Toxic content detection", result['is_toxic'] or result['should_flag'])
+        tester.test("Toxic content detection", result.is_toxic or result.should_flag)
     except Exception as e:
         tester.test("Toxic content detection", False, str(e))
     
+    # Test compiled rule engine
+    try:
+        hits = ai_mod.rules.scan("i hate you, kill yourself")
+        categories = {category for category, _ in hits}
+        tester.test("Rule engine reports every category", categories == {'harassment', 'aggressive', 'toxic'},
+                    str(hits))
+        tester.test("Rule engine keeps overlapping hits", ('toxic', 'kill yourself') in hits, str(hits))
+        tester.test("Rule engine clean text", ai_mod.rules.scan("see you at the meetup") == [])
+        
+        result = ai_mod.analyze_message("this is a threat from a terrorist")
+        tester.test("Earliest listed keyword wins",
+                    result.reason == "Contains toxic keyword: terrorist", result.reason)
+    except Exception as e:
+        tester.test("Rule engine", False, str(e))
+    
+    # Test tiered analysis pipeline
+    try:
+        staged = AIContentModerator()
+        staged.analyze_message("ok")
+        stats = staged.stage_stats()
+        tester.test("Sentiment skipped without aggressive words", stats['sentiment']['skips'] == 1, str(stats))
+        tester.test("Stages ordered by cost",
+                    [stage.cost for stage in staged.stages] == sorted(stage.cost for stage in staged.stages))
+        
+        staged = AIContentModerator(early_exit=True)
+        result = staged.analyze_message("AAAAAAAAAA " * 10 + "http://spam.com " * 5)
+        stats = staged.stage_stats()
+        tester.test("Early exit after spam verdict",
+                    result.is_spam and stats['profanity']['runs'] == 0, str(stats))
+        
+        exhaustive = AIContentModerator(early_exit=False)
+        text = "fuck this, http://a.com http://b.com http://c.com"
+        tester.test("Exhaustive mode reports every finding",
+                    exhaustive.analyze_message(text).reason == "profanity, spam",
+                    exhaustive.analyze_message(text).reason)
+        tester.test("Stages run exhaustively by default",
+                    AIContentModerator().analyze_message(text) == exhaustive.analyze_message(text))
+    except Exception as e:
+        tester.test("Tiered analysis pipeline", False, str(e))
+    
     # Test flood detection
     try:
         is_flood = ai_mod.check_user_behavior(
@@ -270,8 +491,8 @@ async def run_tests():
         result = ai_mod.analyze_message("fuck spam http://test.com AAAAA")
         tester.test(
             "Confidence scoring",
-            0 <= result['confidence'] <= 1,
-            f"Confidence should be 0-1, got {result['confidence']}"
+            0 <= result.confidence <= 1,
+            f"Confidence should be 0-1, got {result.confidence}"
         )
     except Exception as e:
         tester.test("Confidence scoring", False, str(e))
@@ -288,7 +509,7 @@ async def run_tests():
         
         # Add warnings up to limit
         config = await test_db.get_chat_config(11111)
-        warn_limit = config['warn_limit']
+        warn_limit = config.warn_limit
         
         for i in range(warn_limit):
             await test_db.add_warning(99999, 11111, "testuser", f"Warning {i+1}", 88888)
@@ -320,7 +541,7 @@ async def run_tests():
         flagged_count = 0
         for msg in violations:
             result = ai_mod.analyze_message(msg)
-            if result['should_flag']:
+            if result.should_flag:
                 flagged_count += 1
         
         tester.test(
@@ -347,6 +568,7 @@ async def run_tests():
         # Verify data persists
         count = await test_db2.get_warning_count(77777, 88888)
         tester.test("Data persists across restarts", count > 0)
+        await test_db2.close()
     except Exception as e:
         tester.test("Data persistence", False, str(e))
     
@@ -376,6 +598,989 @@ async def run_tests():
     except Exception as e:
         tester.test("Invalid user ID handling", False, str(e))
     
+    # =================================================================
+    # TEST 7: Flood Tracker Tests
+    # =================================================================
+    tester.section("7. Flood Tracker Tests")
+    
+    try:
+        tracker = FloodTracker()
+        counts = [tracker.record(67890, 12345, 10, now=100.0 + i) for i in range(5)]
+        tester.test("Flood tracker counts messages", counts == [1, 2, 3, 4, 5], str(counts))
+        
+        count = tracker.record(67890, 12345, 10, now=112.5)
+        tester.test("Flood tracker slides window", count == 3, f"Expected 3, got {count}")
+        
+        other = tracker.record(67890, 54321, 10, now=112.5)
+        tester.test("Flood tracker keys per user", other == 1, f"Expected 1, got {other}")
+        
+        tracker.record(11111, 12345, 10, now=200.0)
+        tester.test("Flood tracker evicts idle keys", len(tracker) == 1, f"Got {len(tracker)} keys")
+    except Exception as e:
+        tester.test("Flood tracker", False, str(e))
+    
+    try:
+        tracker = FloodTracker(max_keys=100)
+        for user_id in range(1000):
+            tracker.record(67890, user_id, 10, now=100.0)
+        tester.test("Flood tracker memory is capped", len(tracker) == 100, f"Got {len(tracker)} keys")
+    except Exception as e:
+        tester.test("Flood tracker memory cap", False, str(e))
+    
+    # =================================================================
+    # TEST 8: Write-Behind Queue Tests
+    # =================================================================
+    tester.section("8. Write-Behind Queue Tests")
+    
+    wb_db = Database('test_write_behind.db', write_behind=True)
+    try:
+        await wb_db.initialize()
+        
+        counts = [await wb_db.add_warning(12345, 67890, "testuser", f"Queued {i}", 99999)
+                  for i in range(3)]
+        # Each warning queues its row and the updated counter
+        tester.test("Warnings are queued", wb_db.write_queue.depth == 6,
+                    f"Expected depth 6, got {wb_db.write_queue.depth}")
+        tester.test("Counts returned without flushing", counts == [1, 2, 3], str(counts))
+        
+        warnings = await wb_db.get_warnings(12345, 67890)
+        tester.test("Flush before read for same user", len(warnings) == 3, f"Expected 3, got {len(warnings)}")
+        tester.test("Queue drained by flush", wb_db.write_queue.depth == 0)
+        
+        for user_id in range(500):
+            await wb_db.track_message(user_id, 67890)
+        await wb_db.add_ban(12345, 67890, "testuser", "Queued ban", 99999, 3600)
+        await wb_db.flush()
+        stats = wb_db.write_queue.stats()
+        tester.test("Rows flushed in batches", stats['rows_flushed'] == 508 and stats['flushes'] < 508,
+                    str(stats))
+        tester.test("Flush latency is measured", stats['max_flush_ms'] > 0, str(stats))
+        tester.test("Queued ban is visible", await wb_db.is_banned(12345, 67890))
+        
+        await wb_db.add_warning(77777, 67890, "testuser", "Pending at shutdown", 99999)
+        await wb_db.close()
+        
+        wb_db = Database('test_write_behind.db')
+        await wb_db.initialize()
+        count = await wb_db.get_warning_count(77777, 67890)
+        tester.test("Flush on shutdown", count == 1, f"Expected 1, got {count}")
+    except Exception as e:
+        tester.test("Write-behind queue", False, str(e))
+    finally:
+        await wb_db.close()
+    
+    # =================================================================
+    # TEST 9: Cache Tests
+    # =================================================================
+    tester.section("9. Cache Tests")
+    
+    try:
+        clock = [0.0]
+        cache = TTLCache(max_size=2, ttl=10, clock=lambda: clock[0])
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        tester.test("LRU evicts least recently used", cache.get('b') is None and cache.get('a') == 1)
+        
+        clock[0] = 11.0
+        tester.test("Entries expire after TTL", cache.get('a') is None)
+        tester.test("Hit/miss counters", cache.hits == 2 and cache.misses == 2, str(cache.stats()))
+    except Exception as e:
+        tester.test("TTL cache", False, str(e))
+    
+    try:
+        api_calls = []
+        
+        async def get_chat_administrators(chat_id):
+            api_calls.append(chat_id)
+            return [SimpleNamespace(user=SimpleNamespace(id=1)), SimpleNamespace(user=SimpleNamespace(id=2))]
+        
+        context = SimpleNamespace(bot=SimpleNamespace(get_chat_administrators=get_chat_administrators))
+        
+        def make_update(user_id, chat_id=67890, chat_type='group'):
+            return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id, type=chat_type),
+                                   effective_user=SimpleNamespace(id=user_id))
+        
+        admin_commands = AdminCommands(test_db)
+        results = [await admin_commands.is_admin(make_update(user_id), context) for user_id in (1, 2, 3, 1)]
+        tester.test("Admin status from chat administrators", results == [True, True, False, True], str(results))
+        tester.test("Admin list fetched once per chat", len(api_calls) == 1, f"Got {len(api_calls)} calls")
+        tester.test("Admin cache hits counted", admin_commands.state.admin_cache.hits == 3,
+                    str(admin_commands.state.admin_cache.stats()))
+        
+        demotion = SimpleNamespace(
+            chat_member=SimpleNamespace(
+                chat=SimpleNamespace(id=67890),
+                old_chat_member=SimpleNamespace(status='administrator', user=SimpleNamespace(id=2)),
+                new_chat_member=SimpleNamespace(status='member', user=SimpleNamespace(id=2)),
+            ),
+            my_chat_member=None,
+        )
+        await admin_commands.handle_chat_member_update(demotion, context)
+        tester.test("Demotion invalidates admin status", not await admin_commands.is_admin(make_update(2), context))
+        
+        warm = AdminCommands(test_db)
+        await warm.warm_start()
+        tester.test("Admin cache warm-starts from admins table",
+                    await warm.is_admin(make_update(1), context) and len(api_calls) == 1)
+        
+        bot = FakeBot()
+        private = [await admin_commands.is_admin(make_update(5, 5, 'private'), SimpleNamespace(bot=bot))
+                   for _ in range(3)]
+        tester.test("Private chats skip the administrator list",
+                    private == [False] * 3 and not bot.calls_to('get_chat_administrators')
+                    and len(bot.calls_to('get_chat_member')) == 1, str(bot.calls))
+        
+        async def failing_administrators(chat_id):
+            api_calls.append(chat_id)
+            raise TelegramError("Chat not found")
+        
+        failing = SimpleNamespace(bot=SimpleNamespace(get_chat_administrators=failing_administrators,
+                                                      get_chat_member=bot.get_chat_member))
+        before = len(api_calls)
+        for _ in range(3):
+            await admin_commands.is_admin(make_update(6, -6), failing)
+        tester.test("Failed administrator list load not retried per message", len(api_calls) == before + 1,
+                    f"{len(api_calls) - before} calls")
+    except Exception as e:
+        tester.test("Admin cache", False, str(e))
+    
+    # =================================================================
+    # TEST 10: Model Classifier Tests
+    # =================================================================
+    tester.section("10. Model Classifier Tests")
+    
+    classifier = BatchingClassifier(DummyClassifier(), max_batch=4, max_wait=0.05)
+    try:
+        texts = ["you idiot"] + ["nice weather today"] * 9
+        scores = await asyncio.gather(*(classifier.classify(text) for text in texts))
+        tester.test("Batched scores returned in order", scores[0] > 0.9 and max(scores[1:]) < 0.1, str(scores))
+        
+        stats = classifier.stats()
+        tester.test("Requests are micro-batched", max(stats) == 4, str(stats))
+        tester.test("Per-batch p99 latency reported", all('p99_ms' in s for s in stats.values()))
+        
+        clean = ai_mod.analyze_message("nice weather today")
+        flagged = ai_mod.apply_model_score(clean, scores[0])
+        tester.test("Model score flags message", flagged.should_flag and flagged.is_toxic, str(flagged))
+        tester.test("Low model score keeps verdict", ai_mod.apply_model_score(clean, scores[1]) == clean)
+    except Exception as e:
+        tester.test("Model classifier", False, str(e))
+    finally:
+        await classifier.stop()
+    
+    tester.test("Toxic label found by name", toxic_label_index({0: 'non-toxic', 1: 'toxic'}) == 1)
+    tester.test("Explicit toxic label used", toxic_label_index({0: 'LABEL_0', 1: 'LABEL_1'}, 'label_1') == 1)
+    try:
+        toxic_label_index({0: 'LABEL_0', 1: 'LABEL_1'})
+        tester.test("Untrained classification head rejected", False)
+    except ValueError:
+        tester.test("Untrained classification head rejected", True)
+    
+    # Stopped while a batch is in inference, and while another is still filling
+    for label, model, max_wait in (("in-flight", DummyClassifier(batch_cost=0.3), 0.0),
+                                   ("filling", DummyClassifier(), 5.0)):
+        classifier = BatchingClassifier(model, max_batch=4, max_wait=max_wait)
+        pending = [asyncio.create_task(classifier.classify("hello")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        await classifier.stop()
+        done, _ = await asyncio.wait(pending, timeout=2)
+        tester.test(f"Stop fails the {label} batch",
+                    len(done) == 2 and all(isinstance(task.exception(), RuntimeError) for task in done))
+    
+    # =================================================================
+    # TEST 11: Analysis Executor Tests
+    # =================================================================
+    tester.section("11. Analysis Executor Tests")
+    
+    texts = ["This is a clean message", "fuck shit damn", "I hate you, you should kill yourself"]
+    expected = [ai_mod.analyze_message(text) for text in texts]
+    for mode in ('inline', 'thread', 'process'):
+        executor = AnalysisExecutor(ai_mod, mode=mode, workers=2, max_pending=2)
+        try:
+            await executor.start()
+            runs_before = sum(stats['runs'] for stats in ai_mod.stage_stats().values())
+            results = await asyncio.gather(*(executor.analyze(text) for text in texts * 2))
+            tester.test(f"{mode.capitalize()} analysis matches", results == expected * 2)
+            tester.test(f"{mode.capitalize()} analysis counted in stage stats",
+                        sum(stats['runs'] for stats in ai_mod.stage_stats().values()) > runs_before)
+            tester.test(f"{mode.capitalize()} analysis drains", executor.stats()['in_flight'] == 0,
+                        str(executor.stats()))
+        except Exception as e:
+            tester.test(f"{mode.capitalize()} analysis", False, str(e))
+        finally:
+            await executor.stop()
+    
+    edited = AIContentModerator()
+    executor = AnalysisExecutor(edited, mode='process', workers=1, max_pending=2)
+    try:
+        await executor.start()
+        before = await executor.analyze("pineapple on pizza")
+        edited.toxic_keywords.append('pineapple')
+        edited.compile_rules()
+        after = await executor.analyze("pineapple on pizza")
+        tester.test("Process workers pick up rule edits",
+                    not before.is_toxic and after == edited.analyze_message("pineapple on pizza"), str(after))
+    except Exception as e:
+        tester.test("Process workers pick up rule edits", False, str(e))
+    finally:
+        await executor.stop()
+    
+    try:
+        AnalysisExecutor(ai_mod, mode='gpu')
+        tester.test("Unknown analysis mode rejected", False)
+    except ValueError:
+        tester.test("Unknown analysis mode rejected", True)
+    
+    # =================================================================
+    # TEST 12: Verdict Cache Tests
+    # =================================================================
+    tester.section("12. Verdict Cache Tests")
+    
+    try:
+        version = ['rules-v1']
+        verdicts = VerdictCache(version=lambda: version[0], max_size=100, ttl=60, near_duplicates=True)
+        spam = "join my crypto pump group now at http://scam.example and http://pump.example @pumpbot"
+        verdict = ai_mod.analyze_message(spam)
+        verdicts.put(spam, verdict)
+        
+        tester.test("Exact repeat reuses verdict", verdicts.get(spam) is verdict)
+        tester.test("Near-duplicate spam reuses verdict",
+                    verdicts.get(spam.replace("crypto", "cry\u200bpto") + " 42") is verdict)
+        
+        clean = "does anyone know when the next community meetup is happening"
+        verdicts.put(clean, ai_mod.analyze_message(clean))
+        tester.test("Clean verdicts not shared with near-duplicates",
+                    verdicts.get(clean + " 42") is None)
+        
+        stats = verdicts.stats()
+        tester.test("Verdict hit ratios exposed", stats['hits'] == 1 and stats['near_hits'] == 1, str(stats))
+        
+        version[0] = 'rules-v2'
+        tester.test("Rule change invalidates verdicts", verdicts.get(spam) is None)
+        
+        before = ai_mod.rules_version
+        ai_mod.toxic_keywords.append('scammer')
+        ai_mod.compile_rules()
+        tester.test("Rules version tracks rule edits", ai_mod.rules_version != before)
+        ai_mod.toxic_keywords.remove('scammer')
+        ai_mod.compile_rules()
+    except Exception as e:
+        tester.test("Verdict cache", False, str(e))
+    
+    # =================================================================
+    # TEST 13: Campaign Detector Tests
+    # =================================================================
+    tester.section("13. Campaign Detector Tests")
+    
+    try:
+        detector = CampaignDetector(chat_threshold=5, user_threshold=10, window=60, width=1024)
+        link = "check this out http://promo.example/join"
+        reasons = [detector.observe(chat, 1000 + chat, link, now=1.0) for chat in range(5)]
+        tester.test("Link below chat threshold not flagged", not any(reasons[:4]), str(reasons))
+        tester.test("Link crossing chat threshold flagged", reasons[4] is not None and 'link' in reasons[4])
+        tester.test("Campaign stays flagged in new chats",
+                    detector.observe(99, 2000, "look http://promo.example/join!", now=2.0) is not None)
+        
+        repeats = [detector.observe(1, 1, "see http://other.example", now=3.0) for _ in range(20)]
+        tester.test("Repeats in one chat by one user not counted", not any(repeats))
+        
+        raid = "everyone should join our amazing new channel right now for free stuff"
+        raid_reasons = [detector.observe(7, user, raid, now=4.0) for user in range(10)]
+        tester.test("Same message from many users flagged", raid_reasons[-1] is not None and not any(raid_reasons[:-1]))
+        tester.test("Short texts without links ignored",
+                    not any(detector.observe(chat, chat, "hello everyone", now=5.0) for chat in range(20)))
+        
+        top = detector.top(1)
+        tester.test("Heavy hitters reported", top and top[0]['chats'] >= 5, str(top))
+        
+        reasons = [detector.observe(chat, chat, "http://slow.example", now=chat * 30.0) for chat in range(10, 20)]
+        tester.test("Counts decay outside the window", not any(reasons), str(reasons))
+        labels = [entry['label'] for entry in detector.top()]
+        tester.test("Expired campaigns leave the heavy hitters",
+                    'http://promo.example/join' not in labels and all(entry['chats'] <= 3 for entry in detector.top()),
+                    str(detector.top()))
+        
+        campaign = ai_mod.campaign_result(reasons[0] or "Cross-chat campaign")
+        tester.test("Campaign verdict deletes and warns", campaign.should_flag and campaign.is_spam)
+    except Exception as e:
+        tester.test("Campaign detector", False, str(e))
+    
+    # =================================================================
+    # TEST 14: Webhook Server Tests
+    # =================================================================
+    tester.section("14. Webhook Server Tests")
+    
+    import json
+    import random
+    updates = asyncio.Queue()
+    server = WebhookServer(updates, path='/hook', secret_token='s3cret')
+    try:
+        await server.start('127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        body = json.dumps(synthetic_update(1, random.Random(1))).encode()
+        
+        status = await post(reader, writer, 'localhost', '/hook', 's3cret', body)
+        tester.test("Valid update accepted", status == 200 and updates.qsize() == 1)
+        tester.test("Update queued as posted", (await updates.get())['update_id'] == 1)
+        
+        status = await post(reader, writer, 'localhost', '/hook', 'wrong', body)
+        tester.test("Wrong secret token rejected", status == 403 and updates.empty())
+        status = await post(reader, writer, 'localhost', '/other', 's3cret', body)
+        tester.test("Unknown path rejected", status == 404)
+        status = await post(reader, writer, 'localhost', '/hook', 's3cret', b'{not json')
+        tester.test("Malformed body rejected", status == 400)
+        
+        for _ in range(10):
+            await post(reader, writer, 'localhost', '/hook', 's3cret', body)
+        tester.test("Connection kept alive across requests", updates.qsize() == 10,
+                    str(server.stats()))
+        writer.close()
+    except Exception as e:
+        tester.test("Webhook server", False, str(e))
+    finally:
+        await server.stop()
+    
+    # =================================================================
+    # TEST 15: Concurrent Dispatch Tests
+    # =================================================================
+    tester.section("15. Concurrent Dispatch Tests")
+    
+    try:
+        processor = KeyedUpdateProcessor(max_concurrent_updates=8)
+        rng = random.Random(7)
+        seen = {}
+        
+        async def warn_handler(chat_id, user_id):
+            # Read-modify-write across awaits, like _handle_flagged_message
+            await test_db.add_warning(user_id, chat_id, "stress", "stress test", 1)
+            await asyncio.sleep(rng.random() * 0.002)
+            count = await test_db.get_warning_count(user_id, chat_id)
+            seen.setdefault((chat_id, user_id), []).append(count)
+        
+        def make_update(chat_id, user_id):
+            return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id),
+                                   effective_user=SimpleNamespace(id=user_id))
+        
+        pairs = [(-9000 - chat, 9000 + user) for chat in range(10) for user in range(3)] * 15
+        rng.shuffle(pairs)
+        await asyncio.gather(*(processor.process_update(make_update(chat, user), warn_handler(chat, user))
+                               for chat, user in pairs))
+        
+        tester.test("No lost or duplicated warnings under contention",
+                    all(counts == list(range(1, 16)) for counts in seen.values()) and len(seen) == 30,
+                    str(list(seen.values())[:3]))
+        final = [await test_db.get_warning_count(user, chat) for chat, user in set(pairs)]
+        tester.test("Stored warning counts match", final == [15] * 30, str(final))
+        stats = processor.stats()
+        tester.test("Different chats processed in parallel", 1 < stats['peak'] <= 8, str(stats))
+        tester.test("Idle chat locks released", stats['busy_keys'] == 0 and stats['processed'] == 450, str(stats))
+    except Exception as e:
+        tester.test("Concurrent dispatch", False, str(e))
+    
+    # =================================================================
+    # TEST 16: Action Scheduler Tests
+    # =================================================================
+    tester.section("16. Action Scheduler Tests")
+    
+    try:
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+        bucket.take()
+        bucket.take()
+        tester.test("Empty bucket reports wait", abs(bucket.delay() - 0.5) < 1e-9, str(bucket.delay()))
+        now[0] = 0.5
+        tester.test("Bucket refills over time", bucket.delay() == 0)
+        
+        fake = FakeBot()
+        actions = ActionScheduler(global_rate=1000, chat_per_minute=600)
+        notices = [actions.reply(-1, f"⚠️ @user{i} slow down! Warning 1/3", coalesce='flood') for i in range(50)]
+        ban = actions.ban(-1, 42, until_date=60)
+        actions.ban(-1, 42, until_date=3600)
+        deletes = [actions.delete(-1, message_id) for message_id in range(1, 51)]
+        actions.start(fake)
+        await asyncio.gather(*notices, ban, *deletes)
+        
+        order = [name for name, _ in fake.calls]
+        tester.test("Deletes before bans before replies",
+                    order == ['delete_messages', 'ban_chat_member', 'send_message'], str(order))
+        tester.test("Deletes batched into one call",
+                    fake.calls_to('delete_messages')[0]['message_ids'] == list(range(1, 51)))
+        text = fake.calls_to('send_message')[0]['text']
+        tester.test("Repeated notices coalesced into one summary", text.count('slow down') == 50)
+        tester.test("Duplicate ban coalesced", len(fake.calls_to('ban_chat_member')) == 1)
+        tester.test("Coalesced ban sent with the latest arguments",
+                    fake.calls_to('ban_chat_member')[0].get('until_date') == 3600,
+                    str(fake.calls_to('ban_chat_member')))
+        
+        fake.missing_messages.add(99)
+        try:
+            await actions.delete(-2, 99)
+            tester.test("API errors surface to the caller", False)
+        except Exception as e:
+            tester.test("API errors surface to the caller", 'not found' in str(e) and actions.failed == 1)
+        await actions.stop()
+        
+        limited = FakeBot(chat_limit=1, limit_window=0.5, retry_after=1)
+        actions = ActionScheduler(global_rate=1000, chat_per_minute=600)
+        actions.start(limited)
+        first = actions.reply(-3, "first")
+        await first
+        await actions.reply(-3, "second")
+        tester.test("429 retried after retry_after",
+                    actions.rate_limited == 1 and len(limited.calls_to('send_message')) == 2,
+                    str(actions.stats()))
+        await actions.stop()
+        
+        actions = ActionScheduler(global_rate=1000, chat_per_minute=60)
+        actions.chat_burst = 1
+        actions.start(FakeBot())
+        start = time.perf_counter()
+        await asyncio.gather(actions.reply(-4, "a"), actions.reply(-4, "b"))
+        tester.test("Per-chat token bucket paces sends", time.perf_counter() - start >= 0.9)
+        await actions.stop()
+        
+        actions = ActionScheduler(global_rate=1000, chat_per_minute=600)
+        pending = actions.ban(-5, 55)
+        await actions.stop(timeout=0)
+        try:
+            await pending
+            tester.test("Actions pending at shutdown fail with SchedulerStopped", False)
+        except SchedulerStopped:
+            tester.test("Actions pending at shutdown fail with SchedulerStopped", True)
+    except Exception as e:
+        tester.test("Action scheduler", False, str(e))
+    
+    # =================================================================
+    # TEST 17: Raid Mode Tests
+    # =================================================================
+    tester.section("17. Raid Mode Tests")
+    
+    fake = FakeBot(bot_id=777)
+    actions = ActionScheduler(global_rate=1000, chat_per_minute=600)
+    try:
+        raid = RaidMode(test_db, actions, join_threshold=5, flag_threshold=3, window=30,
+                        duration=60, sweep_delay=0.05)
+        tester.test("Flag spike triggers raid mode",
+                    [raid.record_flag(-7001) for _ in range(3)] == [False, False, True]
+                    and raid.is_active(-7001))
+        tester.test("Join spike triggers raid mode", raid.record_joins(-7002, 5) and raid.is_active(-7002))
+        tester.test("Quiet chat stays normal", not raid.record_flag(-7003) and not raid.is_active(-7003))
+        
+        for message_id in range(1, 31):
+            raid.collect(-7001, 7100 + message_id % 10, f"raider{message_id % 10}", message_id)
+        tester.test("Offenders collected, not handled", raid.pending(-7001) == (30, 10) and not fake.calls)
+        
+        actions.start(fake)
+        await asyncio.sleep(0.3)
+        report = raid.reports.get(-7001, {})
+        tester.test("Sweep reports its size and duration",
+                    report.get('messages') == 30 and report.get('users') == 10 and report.get('seconds', 0) > 0,
+                    str(report))
+        tester.test("Messages deleted in one batch",
+                    [len(call['message_ids']) for call in fake.calls_to('delete_messages')] == [30])
+        tester.test("Every raider banned once", len(fake.calls_to('ban_chat_member')) == 10)
+        tester.test("Bans recorded in bulk", report.get('recorded') == 10 and await test_db.is_banned(7101, -7001))
+        
+        rows = [(8000 + i, -7004, f"bulk{i}") for i in range(250)]
+        tester.test("Multi-row insert handles large sweeps", await test_db.add_bans(rows, "Raid sweep", 777) == 250)
+        
+        raid.deactivate(-7001)
+        tester.test("Raid mode can be switched off", not raid.is_active(-7001))
+        
+        now = [0.0]
+        bounded = RaidMode(test_db, actions, flag_threshold=3, window=30, max_chats=10, clock=lambda: now[0])
+        for chat_id in range(50):
+            bounded.record_flag(chat_id)
+        tester.test("Raid chats bounded by max_chats", len(bounded) == 10, str(len(bounded)))
+        now[0] = 31.0
+        bounded.record_flag(100)
+        tester.test("Idle raid chats forgotten", len(bounded) == 1, str(len(bounded)))
+    except Exception as e:
+        tester.test("Raid mode", False, str(e))
+    finally:
+        await actions.stop()
+    
+    # =================================================================
+    # TEST 18: Warning Counter Tests
+    # =================================================================
+    tester.section("18. Warning Counter Tests")
+    
+    try:
+        counts = await asyncio.gather(*(
+            test_db.add_warning(18001, -1800, "racer", f"Concurrent {i}", 1) for i in range(20)
+        ))
+        tester.test("Concurrent warnings get distinct counts", sorted(counts) == list(range(1, 21)),
+                    str(sorted(counts)))
+        tester.test("Counter matches stored warnings",
+                    await test_db.get_warning_count(18001, -1800) == len(await test_db.get_warnings(18001, -1800)) == 20)
+        
+        cleared = await test_db.clear_warnings(18001, -1800)
+        count = await test_db.get_warning_count(18001, -1800)
+        tester.test("Clearing resets the counter", cleared == 20 and count == 0, f"cleared {cleared}, count {count}")
+        tester.test("Counting restarts after a clear",
+                    await test_db.add_warning(18001, -1800, "racer", "Again", 1) == 1)
+    except Exception as e:
+        tester.test("Warning counter", False, str(e))
+    
+    wb_db = Database('test_write_behind.db', write_behind=True)
+    try:
+        await wb_db.initialize()
+        # Rows written before this instance started seed its counter lazily
+        seeded = await wb_db.get_warning_count(77777, 67890)
+        tester.test("Counter seeded from stored warnings", seeded == 1, f"Expected 1, got {seeded}")
+        
+        counts = await asyncio.gather(*(
+            wb_db.add_warning(18002, -1800, "racer", f"Queued {i}", 1) for i in range(20)
+        ))
+        tester.test("Concurrent queued warnings get distinct counts", sorted(counts) == list(range(1, 21)),
+                    str(sorted(counts)))
+        
+        adds = [wb_db.add_warning(18003, -1800, "racer", f"Mixed {i}", 1) for i in range(5)]
+        await asyncio.gather(*adds, wb_db.clear_warnings(18003, -1800),
+                             *(wb_db.add_warning(18003, -1800, "racer", f"After {i}", 1) for i in range(3)))
+        count = await wb_db.get_warning_count(18003, -1800)
+        stored = len(await wb_db.get_warnings(18003, -1800))
+        tester.test("Counter agrees with rows after a concurrent clear", count == stored, f"{count} != {stored}")
+        await wb_db.close()
+        
+        wb_db = Database('test_write_behind.db')
+        await wb_db.initialize()
+        count = await wb_db.get_warning_count(18002, -1800)
+        tester.test("Queued counters persisted", count == 20, f"Expected 20, got {count}")
+    except Exception as e:
+        tester.test("Write-behind warning counter", False, str(e))
+    finally:
+        await wb_db.close()
+    
+    # =================================================================
+    # TEST 19: Ban Expiry Tests
+    # =================================================================
+    tester.section("19. Ban Expiry Tests")
+    
+    fake = FakeBot(bot_id=777)
+    actions = ActionScheduler(global_rate=1000, chat_per_minute=600)
+    expiry = BanExpiryScheduler(test_db, actions)
+    try:
+        actions.start(fake)
+        await test_db.add_ban(19001, -1900, "short", "Test", 1, 0.2)
+        await test_db.add_ban(19002, -1900, "renewed", "Test", 1, 0.2)
+        await test_db.add_ban(19003, -1900, "forever", "Test", 1, None)
+        await test_db.add_ban(19004, -1900, "later", "Test", 1, 3600)
+        await expiry.start()
+        scheduled = {user_id for chat_id, user_id in expiry._expiry if chat_id == -1900}
+        tester.test("Active temporary bans loaded at start", scheduled == {19001, 19002, 19004}, str(scheduled))
+        tester.test("Temporary ban is active", await test_db.is_banned(19001, -1900))
+        
+        await test_db.add_ban(19002, -1900, "renewed", "Renewed", 1, None)
+        expiry.schedule(-1900, 19002, None)
+        await asyncio.sleep(0.5)
+        unbanned = [call['user_id'] for call in fake.calls_to('unban_chat_member')]
+        tester.test("Expired ban lifted on time", unbanned == [19001], str(unbanned))
+        tester.test("Lifted ban is no longer active", not await test_db.is_banned(19001, -1900))
+        tester.test("Renewed ban stays", await test_db.is_banned(19002, -1900))
+        tester.test("Permanent and later bans stay",
+                    await test_db.is_banned(19003, -1900) and await test_db.is_banned(19004, -1900))
+        scheduled = {user_id for chat_id, user_id in expiry._expiry if chat_id == -1900}
+        tester.test("Only the later ban is still scheduled", scheduled == {19004}, str(scheduled))
+        
+        tester.test("Unban removes the active ban",
+                    await test_db.remove_ban(19003, -1900) and not await test_db.is_banned(19003, -1900))
+        async with test_db.pool.reader() as db:
+            async with db.execute('SELECT COUNT(*) FROM bans WHERE chat_id = -1900') as cursor:
+                history = (await cursor.fetchone())[0]
+        tester.test("Ban history kept for audit", history == 5, f"Expected 5 rows, got {history}")
+        
+        ban = actions.ban(-1901, 19005)
+        unban = actions.unban(-1901, 19005)
+        await asyncio.sleep(0.1)
+        tester.test("Unban replaces a pending ban",
+                    ban.done() and ban.result() is None and unban.done()
+                    and not any(call['chat_id'] == -1901 for call in fake.calls_to('ban_chat_member')))
+    except Exception as e:
+        tester.test("Ban expiry", False, str(e))
+    finally:
+        await expiry.stop()
+        await actions.stop()
+    
+    # =================================================================
+    # TEST 20: Database Maintenance Tests
+    # =================================================================
+    tester.section("20. Database Maintenance Tests")
+    
+    mt_db = Database('test_maintenance.db', write_behind=True)
+    try:
+        await mt_db.initialize()
+        async with mt_db.pool.writer() as db:
+            async with db.execute('PRAGMA auto_vacuum') as cursor:
+                auto_vacuum = (await cursor.fetchone())[0]
+            await db.executemany(
+                'INSERT INTO user_messages (user_id, chat_id, timestamp) VALUES (?, ?, ?)',
+                [(i, -2000, '2020-01-01 00:00:00') for i in range(2500)]
+                + [(i, -2000, utc_timestamp()) for i in range(10)]
+            )
+            await db.commit()
+        tester.test("New databases use incremental auto-vacuum", auto_vacuum == 2, f"Got {auto_vacuum}")
+        
+        for i in range(3):
+            await mt_db.add_warning(20001, -2000, "old", f"Warning {i}", 1)
+        await mt_db.add_warning(20002, -2000, "old", "Warning", 1)
+        await mt_db.add_ban(20003, -2000, "old", "Ban", 1, None)
+        await mt_db.flush()
+        async with mt_db.pool.writer() as db:
+            await db.execute('''
+                UPDATE warnings SET timestamp = '2020-01-01 00:00:00'
+                WHERE id IN (SELECT id FROM warnings WHERE user_id = 20001 LIMIT 2) OR user_id = 20002
+            ''')
+            await db.execute("UPDATE bans SET timestamp = '2020-01-01 00:00:00'")
+            await db.commit()
+        # Queued but not yet flushed while the purge runs
+        await mt_db.add_warning(20001, -2000, "old", "Fresh", 1)
+        
+        maintenance = Maintenance(mt_db, message_retention_hours=24, warning_retention_days=90,
+                                  ban_history_retention_days=30, chunk_size=1000, vacuum_pages=100000)
+        report = await maintenance.run_once()
+        tester.test("Old rows purged per table",
+                    report['purged'] == {'user_messages': 2500, 'warnings': 3, 'bans': 1}, str(report['purged']))
+        tester.test("Deletes split into chunks", report['chunks'] >= 5, str(report))
+        tester.test("Time spent reported per step",
+                    set(report['seconds']) == {'user_messages', 'warnings', 'bans', 'optimize', 'vacuum'})
+        tester.test("Statistics analyzed on the first run", report['analyzed'])
+        tester.test("Free pages released", (report['vacuumed_pages'] or 0) > 0, str(report['vacuumed_pages']))
+        
+        counts = (await mt_db.get_warning_count(20001, -2000), await mt_db.get_warning_count(20002, -2000))
+        tester.test("Cached counters follow the purge", counts == (2, 0), str(counts))
+        await mt_db.flush()
+        async with mt_db.pool.reader() as db:
+            async with db.execute('''
+                SELECT user_id, count FROM warning_counts WHERE chat_id = -2000 ORDER BY user_id
+            ''') as cursor:
+                stored = [tuple(row) for row in await cursor.fetchall()]
+        tester.test("Stored counters follow the purge", stored == [(20001, 2)], str(stored))
+        tester.test("Active bans outlive their history", await mt_db.is_banned(20003, -2000))
+        tester.test("Recent message tracking kept",
+                    await mt_db.get_recent_message_count(1, -2000, 3600) == 1)
+    except Exception as e:
+        tester.test("Database maintenance", False, str(e))
+    finally:
+        await mt_db.close()
+    
+    # =================================================================
+    # TEST 21: Metrics Tests
+    # =================================================================
+    tester.section("21. Metrics Tests")
+    
+    registry = Registry()
+    latency = registry.histogram('test_latency_seconds', "Test latency", ['phase'], buckets=(0.01, 0.1))
+    for value in (0.005, 0.05, 0.5):
+        latency.observe(value, 'db')
+    with latency.time('admin_check'):
+        pass
+    errors = registry.counter('test_errors', "Test errors", ['kind'])
+    errors.inc('timeout')
+    errors.inc('timeout', amount=2)
+    registry.register(lambda: [('test_queue_depth', 'gauge', "Test depth", [({'queue': 'writes'}, 7)])])
+    text = registry.render()
+    tester.test("Histogram buckets are cumulative",
+                'test_latency_seconds_bucket{phase="db",le="0.01"} 1.0' in text
+                and 'test_latency_seconds_bucket{phase="db",le="0.1"} 2.0' in text
+                and 'test_latency_seconds_bucket{phase="db",le="+Inf"} 3.0' in text)
+    tester.test("Histogram sum and count", 'test_latency_seconds_count{phase="db"} 3.0' in text
+                and latency.count('admin_check') == 1)
+    tester.test("Counter exported with _total", 'test_errors_total{kind="timeout"} 3.0' in text
+                and '# TYPE test_errors_total counter' in text and '# TYPE test_errors ' not in text)
+    tester.test("Collector families exported", '# TYPE test_queue_depth gauge' in text
+                and 'test_queue_depth{queue="writes"} 7.0' in text)
+    
+    db_seconds = REGISTRY.histogram('moderator_db_query_seconds', "")
+    before = db_seconds.count('get_chat_config')
+    await test_db.get_chat_config(-2100)
+    tester.test("Database methods timed", db_seconds.count('get_chat_config') == before + 1)
+    
+    metrics_server = MetricsServer(registry)
+    await metrics_server.start('127.0.0.1', 0)
+    try:
+        async def fetch(path: str) -> bytes:
+            reader, writer = await asyncio.open_connection('127.0.0.1', metrics_server.port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+        
+        response = await fetch('/metrics')
+        tester.test("Metrics endpoint serves the text format",
+                    response.startswith(b'HTTP/1.1 200') and b'text/plain; version=0.0.4' in response
+                    and b'test_errors_total' in response)
+        response = await fetch('/other')
+        tester.test("Unknown paths return 404", response.startswith(b'HTTP/1.1 404'))
+    except Exception as e:
+        tester.test("Metrics endpoint", False, str(e))
+    finally:
+        await metrics_server.stop()
+    
+    # =================================================================
+    # TEST 22: Replay Harness Tests
+    # =================================================================
+    tester.section("22. Replay Harness Tests")
+    
+    corpus = generate_corpus(500, chats=5, users=40)
+    tester.test("Corpus is reproducible", corpus == generate_corpus(500, chats=5, users=40))
+    tester.test("Corpus includes admin commands",
+                any(update['message']['text'].startswith('/') for update in corpus))
+    save_corpus('test_corpus.jsonl', corpus)
+    tester.test("Corpus survives a save/load round trip", load_corpus('test_corpus.jsonl') == corpus)
+    
+    try:
+        first = await replay(corpus)
+        second = await replay(corpus, write_behind=True)
+        tester.test("Every update handled without errors",
+                    first['updates'] == len(corpus) and first['errors'] == 0, str(first['errors']))
+        tester.test("Latency percentiles reported",
+                    0 < first['p50_ms'] <= first['p95_ms'] <= first['p99_ms'])
+        tester.test("Moderation work reaches the database and the API",
+                    first['db_ops'].get('add_warning', 0) > 0 and first['api_calls'].get('send_message', 0) > 0,
+                    str(first['db_ops']))
+        tester.test("Replays are reproducible across runs and write modes",
+                    first['db_ops'] == second['db_ops'] and first['api_calls'] == second['api_calls'],
+                    f"{first['api_calls']} vs {second['api_calls']}")
+    except Exception as e:
+        tester.test("Replay harness", False, str(e))
+    
+    # =================================================================
+    # TEST 23: Sharding Tests
+    # =================================================================
+    tester.section("23. Sharding Tests")
+    
+    tester.test("Shard assignment is stable and in range",
+                all(0 <= shard_for(chat_id, 4) < 4 and shard_for(chat_id, 4) == shard_for(chat_id, 4)
+                    for chat_id in range(-1001000000100, -1001000000000)))
+    tester.test("Shards are balanced",
+                min(sum(shard_for(-1001000000000 - i, 4) == s for i in range(1000)) for s in range(4)) >= 200)
+    tester.test("Chat found in messages and callback queries",
+                update_chat_id({'update_id': 1, 'message': {'chat': {'id': -5}}}) == -5
+                and update_chat_id({'update_id': 2, 'callback_query': {'message': {'chat': {'id': -6}}}}) == -6)
+    tester.test("Updates without a chat have no shard key",
+                update_chat_id({'update_id': 3, 'inline_query': {'id': 'q', 'query': 'x'}}) is None)
+    
+    import multiprocessing
+    results = multiprocessing.get_context('spawn').Queue()
+    sharded = ShardedBot(workers=2, restart_delay=0.1, check_interval=0.05,
+                         target=echo_worker, target_args=(results,))
+    loop = asyncio.get_running_loop()
+    
+    async def received(count: int):
+        return [await loop.run_in_executor(None, results.get, True, 30) for _ in range(count)]
+    
+    try:
+        await sharded.start()
+        chats = [-1001000000000 - i for i in range(10)]
+        for update_id, chat_id in enumerate(chats * 3):
+            sharded.route({'update_id': update_id, 'message': {'chat': {'id': chat_id}}})
+        got = await received(30)
+        tester.test("Each update reaches the worker owning its chat",
+                    all(index == shard_for(chat_id, 2) for index, chat_id, _ in got), str(got[:5]))
+        per_chat = {}
+        for _, chat_id, update_id in got:
+            per_chat.setdefault(chat_id, []).append(update_id)
+        tester.test("Per-chat order preserved", all(ids == sorted(ids) for ids in per_chat.values()))
+        
+        crashing = chats[0]
+        index = sharded.route({'update_id': 100, 'crash': True, 'message': {'chat': {'id': crashing}}})
+        for _ in range(200):
+            if sharded.restarts[index]:
+                break
+            await asyncio.sleep(0.05)
+        tester.test("Crashed worker restarted", sharded.restarts[index] == 1, str(sharded.stats()))
+        sharded.route({'update_id': 101, 'message': {'chat': {'id': crashing}}})
+        got = await received(1)
+        tester.test("Restarted worker takes its chats again", got == [(index, crashing, 101)], str(got))
+    except Exception as e:
+        tester.test("Sharded workers", False, str(e))
+    finally:
+        await sharded.stop(timeout=5)
+    tester.test("Workers stopped", not any(process.is_alive() for process in sharded.processes))
+    
+    # =================================================================
+    # TEST 24: Storage Backend Tests
+    # =================================================================
+    tester.section("24. Storage Backend Tests")
+    
+    import os
+    backends = [("sqlite", lambda: Database('test_storage.db')),
+                ("sqlite write-behind", lambda: Database('test_storage.db', write_behind=True)),
+                ("memory", MemoryDatabase)]
+    # e.g. TEST_POSTGRES_DSN=postgresql://postgres@localhost/moderator_test (a throwaway database)
+    if os.getenv('TEST_POSTGRES_DSN'):
+        from postgres_database import PostgresDatabase
+        dsn = os.getenv('TEST_POSTGRES_DSN')
+        backends += [("postgres", lambda: PostgresDatabase(dsn)),
+                     ("postgres write-behind", lambda: PostgresDatabase(dsn, write_behind=True))]
+    else:
+        print("ℹ️  TEST_POSTGRES_DSN not set, skipping the postgres backend")
+    
+    for label, factory in backends:
+        db = factory()
+        try:
+            await db.initialize()
+            await storage_contract(tester, db, label)
+        finally:
+            await db.close()
+    
+    tester.test("Factory picks the backend",
+                isinstance(create_storage('sqlite'), Database)
+                and isinstance(create_storage('memory'), MemoryDatabase)
+                and all(isinstance(db, Storage) for db in (test_db, MemoryDatabase())))
+    try:
+        create_storage('oracle')
+        tester.test("Unknown backend rejected", False)
+    except ValueError:
+        tester.test("Unknown backend rejected", True)
+    try:
+        create_storage('postgres')
+        tester.test("Experimental postgres backend not selectable", False)
+    except ValueError:
+        tester.test("Experimental postgres backend not selectable", True)
+    try:
+        import asyncpg  # noqa: F401
+    except ImportError:
+        from postgres_database import PostgresDatabase
+        try:
+            PostgresDatabase('postgresql://localhost/none')
+            tester.test("Missing asyncpg reported", False)
+        except ImportError as e:
+            tester.test("Missing asyncpg reported", 'asyncpg' in str(e))
+    
+    memory_result = await replay(generate_corpus(300, chats=5, users=40), backend='memory')
+    tester.test("Replay runs on the memory backend",
+                memory_result['updates'] > 0 and memory_result['errors'] == 0, str(memory_result)[:200])
+    tester.test("Replayed bots leave no metric collectors behind",
+                '# TYPE moderator_cache_hits_total' not in REGISTRY.render())
+    
+    # =================================================================
+    # TEST 25: Shared State
+    # =================================================================
+    tester.section("25. Shared State Tests")
+    
+    redis_server = FakeRedisServer()
+    await redis_server.start()
+    clock = [1000.0]
+    first = RedisState(redis_server.url, prefix='test:', clock=lambda: clock[0])
+    second = RedisState(redis_server.url, prefix='test:', clock=lambda: clock[0])
+    try:
+        await first.start()
+        await second.start()
+        
+        counts = []
+        for state in (first, second, first):
+            counts.append((await state.record_message(-2500, 1, 10))[0])
+        tester.test("Flood window shared between instances", counts == [1, 2, 3], str(counts))
+        clock[0] += 11
+        count, _ = await second.record_message(-2500, 1, 10)
+        tester.test("Flood window slides", count == 1, str(count))
+        
+        before = first.client.round_trips
+        await first.set_admins(-2500, frozenset({7, 8}))
+        count, admins = await second.record_message(-2500, 2, 10)
+        tester.test("Admin list comes back with the flood count", admins == frozenset({7, 8}) and count == 1,
+                    str(admins))
+        round_trips = second.stats()['round_trips']
+        await second.record_message(-2500, 2, 10)
+        tester.test("One round-trip per message", second.stats()['round_trips'] == round_trips + 1,
+                    str(second.stats()))
+        await second.set_admins(-2500, frozenset({9}), replace=False)
+        tester.test("Existing admin list kept without replace",
+                    await first.get_admins(-2500) == frozenset({7, 8}) and first.client.round_trips > before)
+        
+        for _ in range(FloodTracker.MAX_EVENTS_PER_KEY + 5):
+            count, _ = await first.record_message(-2500, 3, 60)
+        tester.test("Flood window capped like FloodTracker", count == FloodTracker.MAX_EVENTS_PER_KEY, str(count))
+        
+        seeds = []
+        async def seed():
+            seeds.append(1)
+            return 4
+        counts = [await first.incr_warnings(-2500, 1, seed), await second.incr_warnings(-2500, 1, seed),
+                  await second.get_warnings(-2500, 1, seed)]
+        tester.test("Warning counter seeded once and shared", counts == [5, 6, 6] and len(seeds) == 1,
+                    f"{counts} {seeds}")
+        async def slow_seed():
+            await asyncio.sleep(0.05)
+            return 4
+        counts = await asyncio.gather(first.incr_warnings(-2500, 2, slow_seed),
+                                      second.incr_warnings(-2500, 2, slow_seed))
+        tester.test("Concurrent first warnings both counted from the seed",
+                    sorted(counts) == [5, 6] and await first.get_warnings(-2500, 2, seed) == 6, str(counts))
+        tester.test("Warning counter reset", await first.reset_warnings(-2500, 1, seed) == 6
+                    and await second.get_warnings(-2500, 1, seed) == 0)
+        await second.forget_warnings([(-2500, 1)])
+        tester.test("Forgotten counter reloaded", await first.get_warnings(-2500, 1, seed) == 4
+                    and len(seeds) == 2)
+        
+        # Two bots sharing one Redis: admin lists loaded by one serve the other
+        bot = FakeBot(admins={-2501: [42]})
+        first_admins = AdminCommands(MemoryDatabase(), first)
+        second_admins = AdminCommands(MemoryDatabase(), second)
+        update = SimpleNamespace(effective_chat=SimpleNamespace(id=-2501, type='supergroup'),
+                                 effective_user=SimpleNamespace(id=42))
+        context = SimpleNamespace(bot=bot)
+        checks = [await first_admins.is_admin(update, context), await second_admins.is_admin(update, context)]
+        tester.test("Admin lists shared between instances",
+                    checks == [True, True] and len(bot.calls_to('get_chat_administrators')) == 1,
+                    f"{checks} {bot.calls}")
+        
+        # Write-behind warning counts on Redis
+        db = Database('test_storage.db', write_behind=True, state=first)
+        try:
+            await db.initialize()
+            await storage_contract(tester, db, "sqlite write-behind on redis")
+        finally:
+            await db.close()
+        
+        await redis_server.stop()
+        tester.test("Redis outage falls back to in-process state",
+                    (await first.record_message(-2500, 9, 10))[0] == 1
+                    and (await first.record_message(-2500, 9, 10))[0] == 2
+                    and first.stats()['degraded'] and first.stats()['errors'] > 0, str(first.stats()))
+    finally:
+        await first.close()
+        await second.close()
+        await redis_server.stop()
+    
+    local = InProcessState(clock=lambda: clock[0])
+    await local.set_admins(-2500, frozenset({7}))
+    counts = [await local.record_message(-2500, 1, 10) for _ in range(2)]
+    tester.test("In-process state behaves the same",
+                counts == [(1, frozenset({7})), (2, frozenset({7}))]
+                and await local.incr_warnings(-2500, 1, seed) == 5, str(counts))
+    tester.test("Shared state factory", isinstance(create_shared_state('local'), InProcessState)
+                and isinstance(create_shared_state('redis'), RedisState))
+    
+    # =================================================================
+    # TEST 26: Records
+    # =================================================================
+    tester.section("26. Record Tests")
+    
+    import pickle
+    from dataclasses import replace
+    config = ChatConfig.from_row({'chat_id': -2600, 'warn_limit': 3, 'ban_duration': 60,
+                                  'enable_ai_moderation': 0, 'flood_threshold': 5,
+                                  'flood_time_window': 10, 'auto_delete_spam': 1,
+                                  'welcome_message': None, 'rules': None, 'created_at': 'ignored'})
+    tester.test("Stored row becomes a ChatConfig",
+                config.enable_ai_moderation is False and config.auto_delete_spam is True, str(config))
+    tester.test("Config changes make a new record",
+                replace(config, warn_limit=5).warn_limit == 5 and config.warn_limit == 3)
+    
+    result = AIContentModerator().analyze_message("BUY NOW!!!!! LIMITED OFFER @promo_bot @deals_bot @crypto_bot")
+    tester.test("Analysis returns a slotted record",
+                isinstance(result, AnalysisResult) and not hasattr(result, '__dict__') and result.is_spam)
+    tester.test("Analysis record survives the process pool", pickle.loads(pickle.dumps(result)) == result)
+    verdicts = VerdictCache(version=lambda: 0)
+    verdicts.put("spam", result)
+    tester.test("Verdict cache shares one record", verdicts.get("spam") is result)
+    
     # =================================================================
     # Cleanup
     # =================================================================
@@ -385,9 +1590,14 @@ async def run_tests():
     
     import os
     try:
-        if os.path.exists('test_bot.db'):
-            os.remove('test_bot.db')
-            print("✅ Test database cleaned up")
+        await test_db.close()
+        for path in ('test_bot.db', 'test_write_behind.db', 'test_maintenance.db', 'test_storage.db'):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        if os.path.exists('test_corpus.jsonl'):
+            os.remove('test_corpus.jsonl')
+        print("✅ Test database cleaned up")
     except Exception as e:
         print(f"⚠️  Could not remove test database: {e}")
     
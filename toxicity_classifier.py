@@ -0,0 +1,219 @@
+"""
+Model-backed toxicity classification module
+Micro-batches messages from all chats through an optional transformer model
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def toxic_label_index(id2label: Dict[int, str], toxic_label: str = '') -> int:
+    """
+    Index of the classifier label to score: `toxic_label` if given, else "toxic"
+
+    Raises:
+        ValueError: If there is no such label, e.g. on an untrained head with
+            LABEL_0/LABEL_1 that would score at random
+    """
+    wanted = (toxic_label or 'toxic').lower()
+    for i, label in id2label.items():
+        if label.lower() == wanted:
+            return int(i)
+    raise ValueError(
+        f"Model has no {wanted!r} label (labels: {', '.join(id2label.values())}); "
+        f"use a model fine-tuned for toxicity or set MODEL_TOXIC_LABEL"
+    )
+
+
+class TransformerClassifier:
+    """Sequence classifier loaded through `transformers` (optional dependency)"""
+
+    def __init__(self, model_name: str = Config.AI_MODEL_NAME,
+                 local_files_only: bool = Config.MODEL_LOCAL_FILES_ONLY,
+                 toxic_label: str = Config.MODEL_TOXIC_LABEL):
+        try:
+            import torch
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                "The model classifier needs 'transformers' and 'torch' "
+                "(pip install -r requirements.txt)"
+            ) from e
+
+        self._torch = torch
+        self.model_name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=local_files_only)
+        self.model = AutoModelForSequenceClassification.from_pretrained(
+            model_name, local_files_only=local_files_only
+        )
+        self.model.eval()
+
+        self.toxic_label = toxic_label_index(self.model.config.id2label, toxic_label)
+
+    def predict_batch(self, texts: List[str]) -> List[float]:
+        """Return a 0-1 toxicity score per text (blocking, CPU)"""
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=128,
+                                return_tensors='pt')
+        with self._torch.inference_mode():
+            logits = self.model(**inputs).logits
+        return logits.softmax(dim=-1)[:, self.toxic_label].tolist()
+
+
+class DummyClassifier:
+    """
+    Offline stand-in with a deterministic score and a simulated cost
+
+    Texts containing any of `toxic_words` score 0.95, everything else 0.05.
+    Each batch sleeps `batch_cost + item_cost * len(batch)` seconds.
+    """
+
+    model_name = 'dummy'
+
+    def __init__(self, toxic_words: Iterable[str] = ('idiot', 'stupid', 'hate'),
+                 batch_cost: float = 0.0, item_cost: float = 0.0):
+        self.toxic_words = tuple(toxic_words)
+        self.batch_cost = batch_cost
+        self.item_cost = item_cost
+
+    def predict_batch(self, texts: List[str]) -> List[float]:
+        if self.batch_cost or self.item_cost:
+            time.sleep(self.batch_cost + self.item_cost * len(texts))
+        return [0.95 if any(word in text.lower() for word in self.toxic_words) else 0.05
+                for text in texts]
+
+
+def load_classifier(backend: str = Config.MODEL_BACKEND):
+    """Build the classifier named by MODEL_BACKEND"""
+    if backend == 'dummy':
+        return DummyClassifier()
+    if backend == 'transformers':
+        return TransformerClassifier()
+    raise ValueError(f"Unknown MODEL_BACKEND: {backend}")
+
+
+class BatchingClassifier:
+    """
+    Collects classify() calls from every chat into micro-batches.
+
+    A batch is dispatched when `max_batch` texts are waiting or the oldest
+    has waited `max_wait` seconds. Inference runs in a dedicated
+    single-thread executor so the event loop never blocks on the model.
+    """
+
+    def __init__(self, model, max_batch: int = Config.MODEL_BATCH_SIZE,
+                 max_wait: float = Config.MODEL_MAX_WAIT_MS / 1000):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        # Requests taken off the queue and not answered yet
+        self._batch: list = []
+
+        # batch size -> [batches, texts, total inference seconds]
+        self._batch_stats: Dict[int, List[float]] = {}
+        # (batch size, request latency seconds) for percentile reporting
+        self._latencies: List[Tuple[int, float]] = []
+
+    def start(self):
+        """Start the executor and the batching loop"""
+        if self._task is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='classifier')
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop batching and release the executor"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Fail anything in flight or still waiting rather than leaving callers hanging
+        pending, self._batch = self._batch, []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for _, future, _ in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Classifier stopped"))
+
+        if self.executor is not None:
+            executor, self.executor = self.executor, None
+            await asyncio.to_thread(executor.shutdown, True)
+
+    async def classify(self, text: str) -> float:
+        """Return the toxicity score for one message"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((text, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self) -> list:
+        """Wait for one request, then gather more until full or max_wait passes"""
+        # Gathered into self._batch so stop() can fail it if cancelled midway
+        batch = self._batch = []
+        batch.append(await self.queue.get())
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            texts = [text for text, _, _ in batch]
+
+            start = time.perf_counter()
+            try:
+                scores = await loop.run_in_executor(self.executor, self.model.predict_batch, texts)
+            except Exception as e:
+                logger.error(f"Classifier batch of {len(batch)} failed: {str(e)}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                self._batch = []
+                continue
+
+            done = time.perf_counter()
+            stats = self._batch_stats.setdefault(len(batch), [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += len(batch)
+            stats[2] += done - start
+
+            for (_, future, queued_at), score in zip(batch, scores):
+                self._latencies.append((len(batch), done - queued_at))
+                if not future.done():
+                    future.set_result(score)
+            # Keep the latency sample bounded
+            if len(self._latencies) > 10000:
+                del self._latencies[:5000]
+            self._batch = []
+
+    def stats(self) -> Dict[int, Dict[str, Any]]:
+        """Per batch size: batches, texts/sec of inference and p99 request latency"""
+        report = {}
+        for size, (batches, texts, seconds) in sorted(self._batch_stats.items()):
+            latencies = sorted(latency for batch_size, latency in self._latencies
+                               if batch_size == size)
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+            report[size] = {
+                'batches': int(batches),
+                'throughput': texts / seconds if seconds else 0.0,
+                'p99_ms': p99 * 1000,
+            }
+        return report
@@ -0,0 +1,105 @@
+"""
+Update processing module
+Concurrent update dispatch that keeps each chat and user serialized
+"""
+import asyncio
+import inspect
+from typing import Any, Awaitable, Dict, Hashable, List
+from telegram.ext import BaseUpdateProcessor
+from config import Config
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Runs up to `max_concurrent_updates` handlers at once, one per chat/user.
+
+    Every update locks its chat and its user (in a fixed order, so two
+    updates can never deadlock) before taking one of the concurrency slots.
+    Updates from one chat therefore run one at a time in arrival order and
+    a user's updates in different chats never overlap, while unrelated chats
+    proceed in parallel. Updates waiting on a busy chat don't hold a slot;
+    `max_pending` only bounds how many are admitted at all.
+    """
+
+    def __init__(self, max_concurrent_updates: int = Config.CONCURRENT_UPDATES,
+                 max_pending: int = Config.MAX_PENDING_UPDATES):
+        super().__init__(max(max_pending, max_concurrent_updates, 2))
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # key -> [lock, updates holding or waiting for it]
+        self._locks: Dict[Hashable, List[Any]] = {}
+
+        # Metrics
+        self.running = 0
+        self.peak = 0
+        self.processed = 0
+
+    @staticmethod
+    def keys(update: object) -> List[Hashable]:
+        """Serialization keys of an update, in lock order"""
+        keys = []
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            keys.append(('chat', chat.id))
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            keys.append(('user', user.id))
+        return keys
+
+    async def _acquire(self, key: Hashable):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._forget(key, entry)
+            raise
+
+    def _release(self, key: Hashable):
+        entry = self._locks[key]
+        entry[0].release()
+        self._forget(key, entry)
+
+    def _forget(self, key: Hashable, entry: List[Any]):
+        # Drop idle locks so the table only holds chats/users with work queued
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        acquired = []
+        try:
+            for key in self.keys(update):
+                await self._acquire(key)
+                acquired.append(key)
+
+            async with self._slots:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+                    self.processed += 1
+        finally:
+            for key in reversed(acquired):
+                self._release(key)
+            # Cancelled while waiting: the handler never started
+            if inspect.iscoroutine(coroutine) and \
+                    inspect.getcoroutinestate(coroutine) == inspect.CORO_CREATED:
+                coroutine.close()
+
+    async def initialize(self) -> None:
+        """Nothing to set up"""
+
+    async def shutdown(self) -> None:
+        """Nothing to release; pending updates finish under the application's shutdown"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limit': self.limit,
+            'running': self.running,
+            'peak': self.peak,
+            'processed': self.processed,
+            'busy_keys': len(self._locks),
+        }
@@ -0,0 +1,190 @@
+"""
+Verdict caching module
+Reuses analysis results for repeated (and optionally near-duplicate) messages
+"""
+import hashlib
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+from cache import TTLCache
+from config import Config
+from records import AnalysisResult
+
+_ZERO_WIDTH = re.compile('[\u200b-\u200f\u2060\ufeff]')
+_WORD = re.compile(r'\w+')
+
+
+def text_key(text: str) -> bytes:
+    """Exact cache key; any normalization here could change the verdict"""
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+def normalize_for_similarity(text: str) -> str:
+    """Aggressive normalization for near-duplicate matching only"""
+    text = unicodedata.normalize('NFKC', text)
+    text = _ZERO_WIDTH.sub('', text).lower()
+    return ' '.join(_WORD.findall(text))
+
+
+def simhash(text: str, bits: int = 64, shingle: int = 4) -> Optional[int]:
+    """
+    SimHash fingerprint over character shingles
+
+    Returns None for texts too short to fingerprint reliably.
+    """
+    text = normalize_for_similarity(text)
+    if text.count(' ') + 1 < Config.VERDICT_SIMHASH_MIN_WORDS:
+        return None
+
+    features = [text[i:i + shingle] for i in range(len(text) - shingle + 1)]
+    weights = [0] * bits
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=bits // 8).digest(), 'big')
+        for i in range(bits):
+            weights[i] += 1 if h >> i & 1 else -1
+
+    fingerprint = 0
+    for i, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << i
+    return fingerprint
+
+
+class SimHashIndex:
+    """
+    Bounded LRU index of 64-bit fingerprints with banded lookup.
+
+    Fingerprints are split into `max_distance + 1` bands; by the pigeonhole
+    principle any fingerprint within `max_distance` bits shares a band, so
+    only that band's bucket has to be compared.
+    """
+
+    def __init__(self, max_size: int, max_distance: int):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self._entries: 'OrderedDict[int, Any]' = OrderedDict()
+        self._buckets: Dict[Tuple[int, int], Set[int]] = {}
+
+        # (shift, mask) per band, widths differing by at most one bit
+        bands = max_distance + 1
+        width, extra = divmod(64, bands)
+        self._bands = []
+        shift = 0
+        for band in range(bands):
+            bits = width + (1 if band < extra else 0)
+            self._bands.append((shift, (1 << bits) - 1))
+            shift += bits
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, fingerprint: int):
+        for band, (shift, mask) in enumerate(self._bands):
+            yield band, fingerprint >> shift & mask
+
+    def add(self, fingerprint: int, value: Any):
+        if fingerprint not in self._entries:
+            for key in self._band_keys(fingerprint):
+                self._buckets.setdefault(key, set()).add(fingerprint)
+        self._entries[fingerprint] = value
+        self._entries.move_to_end(fingerprint)
+
+        while len(self._entries) > self.max_size:
+            evicted, _ = self._entries.popitem(last=False)
+            for key in self._band_keys(evicted):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(evicted)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def find(self, fingerprint: int) -> Optional[Any]:
+        """Return the value of the closest fingerprint within max_distance bits"""
+        best, best_distance = None, self.max_distance + 1
+        for key in self._band_keys(fingerprint):
+            for candidate in self._buckets.get(key, ()):
+                distance = (candidate ^ fingerprint).bit_count()
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        if best is None:
+            return None
+        self._entries.move_to_end(best)
+        return self._entries[best]
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+
+
+class VerdictCache:
+    """
+    LRU/TTL cache of analysis results keyed on the message text.
+
+    With `near_duplicates` enabled, flagged verdicts are also indexed by
+    SimHash so lightly mutated copies of the same spam reuse them; clean
+    verdicts are never shared this way. Everything is dropped whenever
+    `version()` changes (rule set or model update).
+    """
+
+    def __init__(self, version: Callable[[], Hashable],
+                 max_size: int = Config.VERDICT_CACHE_SIZE,
+                 ttl: Optional[float] = Config.VERDICT_CACHE_TTL,
+                 near_duplicates: bool = Config.VERDICT_NEAR_DUPLICATES,
+                 near_size: int = Config.VERDICT_SIMHASH_INDEX_SIZE,
+                 max_distance: int = Config.VERDICT_SIMHASH_DISTANCE):
+        self.version = version
+        self.exact = TTLCache(max_size, ttl)
+        self.near = SimHashIndex(near_size, max_distance) if near_duplicates else None
+        self._version = version()
+
+        # Metrics
+        self.near_hits = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        current = self.version()
+        if current != self._version:
+            self._version = current
+            self.clear()
+            self.invalidations += 1
+
+    def get(self, text: str) -> Optional[AnalysisResult]:
+        """Return a cached verdict for this text, or None"""
+        self._check_version()
+
+        verdict = self.exact.get(text_key(text))
+        if verdict is not None or self.near is None:
+            return verdict
+
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return None
+        verdict = self.near.find(fingerprint)
+        if verdict is not None:
+            self.near_hits += 1
+        return verdict
+
+    def put(self, text: str, verdict: AnalysisResult):
+        """Remember the verdict for this text"""
+        self._check_version()
+        self.exact.set(text_key(text), verdict)
+
+        if self.near is not None and verdict.should_flag:
+            fingerprint = simhash(text)
+            if fingerprint is not None:
+                self.near.add(fingerprint, verdict)
+
+    def clear(self):
+        self.exact.clear()
+        if self.near is not None:
+            self.near.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit ratios for exact and near-duplicate lookups"""
+        stats = self.exact.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['near_hits'] = self.near_hits
+        stats['near_hit_ratio'] = self.near_hits / lookups if lookups else 0.0
+        stats['invalidations'] = self.invalidations
+        return stats
@@ -0,0 +1,143 @@
+"""
+Webhook server module
+Minimal asyncio HTTP/1.1 server that receives Telegram updates
+"""
+import asyncio
+import hmac
+import json
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+}
+
+
+class WebhookServer:
+    """
+    Accepts Telegram webhook POSTs and puts the decoded updates on a queue.
+
+    Requests must target `path` and carry the secret token Telegram echoes
+    back in the X-Telegram-Bot-Api-Secret-Token header. Connections are
+    kept alive between requests, as Telegram reuses them.
+    """
+
+    def __init__(self, queue: asyncio.Queue, decode: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 path: str = Config.WEBHOOK_PATH,
+                 secret_token: str = Config.WEBHOOK_SECRET_TOKEN,
+                 max_body: int = 1 << 20):
+        self.queue = queue
+        self.decode = decode
+        self.path = path
+        self.secret_token = secret_token.encode()
+        self.max_body = max_body
+        self.server: Optional[asyncio.AbstractServer] = None
+
+        # Metrics
+        self.accepted = 0
+        self.rejected = 0
+
+    @property
+    def port(self) -> Optional[int]:
+        """Bound port (useful when started on port 0)"""
+        if self.server is None or not self.server.sockets:
+            return None
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = Config.WEBHOOK_LISTEN, port: int = Config.WEBHOOK_PORT):
+        """Start listening"""
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Webhook server listening on {host}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Stop accepting connections and close the listener"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, str, dict]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, version = request_line.decode('latin-1').split()
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, version, headers = request
+
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+                if 'content-length' not in headers and method == 'POST':
+                    status, keep_alive = 411, False
+                elif int(headers.get('content-length', 0)) > self.max_body:
+                    status, keep_alive = 413, False
+                else:
+                    length = int(headers.get('content-length', 0))
+                    body = await reader.readexactly(length) if length else b''
+                    status = await self._dispatch(method, target, headers, body)
+
+                if status != 200:
+                    self.rejected += 1
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                    f"Content-Length: 0\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str, headers: dict, body: bytes) -> int:
+        if target.split('?', 1)[0] != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode(), self.secret_token):
+            return 403
+
+        try:
+            data = json.loads(body)
+            update = self.decode(data) if self.decode else data
+        except Exception as e:
+            logger.warning(f"Rejected malformed webhook update: {str(e)}")
+            return 400
+
+        await self.queue.put(update)
+        self.accepted += 1
+        return 200
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'queue_depth': self.queue.qsize(),
+        }